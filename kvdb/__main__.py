@@ -1,11 +1,16 @@
 """Entrypoint for kvdb."""
 import asyncio
-from .server import run_from_cli_args
+import logging
+from . import event_loop
+from .server import parse_cli_args, run_from_cli_args
 
 
 def main():
-    """Runs kvdb."""
-    asyncio.run(run_from_cli_args())
+    """Runs kvdb on the chosen event loop."""
+    args = parse_cli_args()
+    logging.basicConfig(level=args.log_level)
+    event_loop.install(args.loop)
+    asyncio.run(run_from_cli_args(args))
 
 
 if __name__ == "__main__":
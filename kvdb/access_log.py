@@ -0,0 +1,82 @@
+"""Sampled access log of the requests.
+
+The access log is off by default. Request handlers check the precomputed
+enabled flag before anything else, so a disabled log costs a single
+attribute lookup per request. Enabled, it logs 1 in every sample requests,
+and the records are put on a queue, written by a background thread, so
+a request never waits for the log file."""
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG = logging.getLogger(__name__)
+# Keys are truncated in the log, values are never logged.
+KEY_LENGTH = 64
+FORMAT = "%(asctime)s %(message)s"
+
+
+class AccessLog():
+    """Access log writing through a queue on a background thread."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.sample = 1
+        self._counter = itertools.count()
+        self._listener = None
+        self._handler = None
+
+    def configure(self, path, sample=1):
+        """Starts logging 1 in every sample requests to the file,
+          or to stderr if the path is -."""
+        self.close()
+        if path == "-":
+            target = logging.StreamHandler(sys.stderr)
+        else:
+            target = logging.FileHandler(path)
+        target.setFormatter(logging.Formatter(FORMAT))
+        records = queue.SimpleQueue()
+        self._handler = logging.handlers.QueueHandler(records)
+        self._listener = logging.handlers.QueueListener(records, target)
+        self._listener.start()
+        LOG.addHandler(self._handler)
+        LOG.setLevel(logging.INFO)
+        # Requests are only written to the access log.
+        LOG.propagate = False
+        self.sample = sample
+        self.enabled = True
+
+    def close(self):
+        """Stops logging, after writing the records still in the queue."""
+        self.enabled = False
+        if self._listener is not None:
+            LOG.removeHandler(self._handler)
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = self._handler = None
+
+    def record(self, message):
+        """Logs a parsed request, if it is sampled."""
+        # itertools.count is safe to share between event loop threads.
+        if next(self._counter) % self.sample:
+            return
+        key, keys = key_fields(message)
+        LOG.info("command=%s key=%r keys=%s", message[0], key, keys)
+
+
+def key_fields(message):
+    """Returns the truncated key of the request,
+      and the number of keys it is on."""
+    if len(message) < 2:
+        return None, 0
+    argument = message[1]
+    if isinstance(argument, (list, dict)):
+        return None, len(argument)
+    if isinstance(argument, bytes):
+        return argument[:KEY_LENGTH], 1
+    return argument, 1
+
+
+ACCESS_LOG = AccessLog()
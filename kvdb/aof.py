@@ -0,0 +1,213 @@
+"""Append-only file persistence for kvdb.
+
+Every mutation is appended to the file as a binary request frame,
+so replaying the file is the same as parsing a binary framing connection.
+Mutations are collected in a memory buffer, and written to the file
+by a background task, or right away with the always fsync policy.
+The file is rewritten in the background from the live contents,
+so its size follows the size of the data set instead of its history."""
+import asyncio
+import itertools
+import logging
+import os
+from kvdb import binary_parser, expiry, rpc
+
+LOG = logging.getLogger(__name__)
+ALWAYS = "always"
+EVERYSEC = "everysec"
+NO = "no"
+FSYNC_POLICIES = (ALWAYS, EVERYSEC, NO)
+FLUSH_INTERVAL = 1
+READ_CHUNK_SIZE = 1024 * 1024
+WRITE_BATCH_SIZE = 1024
+# The file is rewritten when it reaches the minimum size, and it is
+# at least REWRITE_GROWTH times as large as after the last rewrite.
+REWRITE_MIN_SIZE = 64 * 1024 * 1024
+REWRITE_GROWTH = 2
+
+
+class AppendOnlyFile():
+    """Log of the mutations of a storage."""
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, path, fsync_policy=EVERYSEC) -> None:
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self._file = open(path, "ab")  # pylint: disable=consider-using-with
+        self._buffer = bytearray()
+        self._size = os.path.getsize(path)
+        self._rewritten_size = self._size
+        # Mutations logged while a rewrite is in progress, None otherwise.
+        self._rewrite_buffer = None
+        self._write_lock = asyncio.Lock()
+        self._background_task = None
+
+    def log_set(self, key, value):
+        """Appends a SET mutation."""
+        self._append(binary_parser.encode_request(rpc.SET, key, value))
+
+    def log_delete(self, key):
+        """Appends a DELETE mutation."""
+        self._append(binary_parser.encode_request(rpc.DELETE, key))
+
+    def log_expire_at(self, key, deadline):
+        """Appends the deadline of a key, as an absolute EXPIREAT mutation,
+          so replaying it later doesn't extend the time to live."""
+        self._append(binary_parser.encode_request(
+            rpc.EXPIREAT, key, repr(deadline).encode()))
+
+    def log_set_many(self, items):
+        """Appends a SET mutation for each item of a key to value mapping."""
+        encode = binary_parser.encode_request
+        self._append(b''.join(encode(rpc.SET, key, value)
+                              for key, value in items.items()))
+
+    def log_delete_many(self, keys):
+        """Appends a DELETE mutation for each key."""
+        encode = binary_parser.encode_request
+        self._append(b''.join(encode(rpc.DELETE, key) for key in keys))
+
+    def start(self, contents, deadlines):
+        """Starts flushing the buffered mutations in the background,
+          and rewriting the file from the live contents and deadlines
+          of the storage whenever it doubles in size since the last rewrite."""
+        self._background_task = asyncio.create_task(
+            self._run_in_background(contents, deadlines))
+
+    def flush(self):
+        """Writes the buffered mutations to the file,
+          and syncs it to disk unless the fsync policy is no."""
+        data, self._buffer = self._buffer, bytearray()
+        self._write(data)
+
+    async def close(self):
+        """Stops the background tasks, and writes the buffered mutations.
+          A write of the background task in progress is waited for,
+          so the file is not written and closed at the same time."""
+        async with self._write_lock:
+            if self._background_task is not None:
+                self._background_task.cancel()
+                await asyncio.wait([self._background_task])
+                self._background_task = None
+            self.flush()
+            self._file.close()
+
+    async def rewrite(self, contents, deadlines=None):
+        """Replaces the file with the SET and EXPIREAT mutations
+          of the live contents and deadlines.
+          Mutations logged during the rewrite are kept in a side buffer,
+          and appended to the new file before it replaces the old one."""
+        if self._rewrite_buffer is not None:
+            LOG.warning("Rewrite of %s is already in progress", self.path)
+            return
+        rewrite_path = f"{self.path}.rewrite"
+        self._rewrite_buffer = bytearray()
+        try:
+            snapshot = contents.copy()
+            await asyncio.to_thread(self._write_snapshot, rewrite_path,
+                                    snapshot, dict(deadlines or {}))
+            async with self._write_lock:
+                # No awaits from here, so no mutations can get lost.
+                with open(rewrite_path, "ab") as file:
+                    file.write(self._rewrite_buffer)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(rewrite_path, self.path)
+                self._file.close()
+                # pylint: disable-next=consider-using-with
+                self._file = open(self.path, "ab")
+                # Every buffered mutation is either in the snapshot
+                # or in the side buffer.
+                self._buffer = bytearray()
+                self._size = os.path.getsize(self.path)
+                self._rewritten_size = self._size
+        finally:
+            self._rewrite_buffer = None
+        LOG.info("Rewrote %s with %s keys, %s bytes", self.path,
+                 len(snapshot), self._size)
+
+    def _append(self, data):
+        self._buffer += data
+        if self._rewrite_buffer is not None:
+            self._rewrite_buffer += data
+        if self.fsync_policy == ALWAYS:
+            self.flush()
+
+    async def _run_in_background(self, contents, deadlines):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if self._buffer and self.fsync_policy != ALWAYS:
+                async with self._write_lock:
+                    data, self._buffer = self._buffer, bytearray()
+                    # Writing and syncing must not block the event loop.
+                    await asyncio.to_thread(self._write, data)
+            if self._needs_rewrite():
+                await self.rewrite(contents, deadlines)
+
+    def _needs_rewrite(self):
+        return self._size >= max(REWRITE_MIN_SIZE,
+                                 self._rewritten_size * REWRITE_GROWTH)
+
+    def _write(self, data):
+        if not data:
+            return
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        if self.fsync_policy != NO:
+            os.fsync(self._file.fileno())
+
+    @staticmethod
+    def _write_snapshot(path, snapshot, deadlines):
+        encode = binary_parser.encode_request
+        mutations = itertools.chain(
+            ((rpc.SET, key, value) for key, value in snapshot.items()),
+            ((rpc.EXPIREAT, key, repr(deadline).encode())
+             for key, deadline in deadlines.items()))
+        with open(path, "wb") as file:
+            batch = []
+            for mutation in mutations:
+                batch.append(encode(*mutation))
+                if len(batch) == WRITE_BATCH_SIZE:
+                    file.write(b''.join(batch))
+                    batch.clear()
+            file.write(b''.join(batch))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def replay(path):
+    """Rebuilds the storage contents and deadlines from an append-only file.
+      A frame cut short at the end of the file, by a crash during
+      a write, is dropped from the file. Keys past their deadline
+      are left out."""
+    contents = {}
+    deadlines = {}
+    if not os.path.exists(path):
+        return contents, deadlines
+    with open(path, "rb+") as file:
+        buffer = bytearray()
+        consumed = 0
+        while chunk := file.read(READ_CHUNK_SIZE):
+            buffer += chunk
+            offset = 0
+            while (frame := binary_parser.next_frame(
+                    buffer, offset, len(buffer))) is not None:
+                opcode, key, value, offset = frame
+                if opcode == binary_parser.OPCODE_SET:
+                    contents[key] = value
+                    deadlines.pop(key, None)
+                elif opcode == binary_parser.OPCODE_EXPIREAT:
+                    deadlines[key] = float(value)
+                else:
+                    contents.pop(key, None)
+                    deadlines.pop(key, None)
+            del buffer[:offset]
+            consumed += offset
+        if buffer:
+            LOG.warning("Dropping %s bytes of incomplete mutation from %s",
+                        len(buffer), path)
+            file.truncate(consumed)
+    expiry.drop_expired(contents, deadlines)
+    LOG.info("Replayed %s keys from %s", len(contents), path)
+    return contents, deadlines
@@ -0,0 +1,119 @@
+"""Parser for the length-prefixed binary framing of the KVDB RPC commands.
+
+A request frame is a fixed size header followed by the payload:
+    opcode (1 byte) | key length (4 bytes) | value length (4 bytes)
+    | key | value
+A response frame is a status byte and the payload length
+followed by the payload:
+    status (1 byte) | payload length (4 bytes) | payload
+All integers are unsigned big-endian. Keys and values can contain any byte.
+The value of EXPIRE is the time to live in seconds, and the value of EXPIREAT
+is a unix timestamp, both as decimal ASCII numbers."""
+import asyncio
+import logging
+import struct
+from kvdb import expiry, rpc
+from .exceptions import (InvalidCommandException, InvalidFrameException,
+                         InvalidKeyException)
+
+LOG = logging.getLogger(__name__)
+
+REQUEST_HEADER = struct.Struct("!BII")
+RESPONSE_HEADER = struct.Struct("!BI")
+MAX_KEY_SIZE = 64 * 1024
+MAX_VALUE_SIZE = 512 * 1024 * 1024
+
+OPCODE_GET = 1
+OPCODE_SET = 2
+OPCODE_DELETE = 3
+OPCODE_EXPIRE = 4
+OPCODE_EXPIREAT = 5
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_COMMANDS = {OPCODE_GET: rpc.GET,
+             OPCODE_SET: rpc.SET,
+             OPCODE_DELETE: rpc.DELETE,
+             OPCODE_EXPIRE: rpc.EXPIRE,
+             OPCODE_EXPIREAT: rpc.EXPIREAT}
+_OPCODES = {command: opcode for opcode, command in _COMMANDS.items()}
+
+
+async def parse_message(reader: asyncio.StreamReader):
+    """Parses a single binary frame from the incoming TCP stream.
+        Every field is read with a single readexactly call,
+        without scanning for delimiters."""
+    try:
+        header = await reader.readexactly(REQUEST_HEADER.size)
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial:
+            return ("CLOSE", None)
+        raise InvalidFrameException() from exc
+    opcode, key_length, value_length = REQUEST_HEADER.unpack(header)
+    _raise_frame_too_large(key_length, value_length)
+    try:
+        key = await reader.readexactly(key_length)
+        value = await reader.readexactly(value_length)
+    except asyncio.IncompleteReadError as exc:
+        raise InvalidFrameException() from exc
+    return parse_frame(opcode, key, value)
+
+
+def next_frame(buffer, start, length):
+    """Finds the next complete binary frame in the first length bytes
+        of a buffer. Returns the opcode, the key, the value and the offset
+        after the frame, or None if the frame is not complete yet."""
+    if length - start < REQUEST_HEADER.size:
+        return None
+    opcode, key_length, value_length = REQUEST_HEADER.unpack_from(buffer,
+                                                                  start)
+    _raise_frame_too_large(key_length, value_length)
+    key_start = start + REQUEST_HEADER.size
+    value_start = key_start + key_length
+    end = value_start + value_length
+    if end > length:
+        return None
+    with memoryview(buffer) as view:
+        return (opcode, bytes(view[key_start:value_start]),
+                bytes(view[value_start:end]), end)
+
+
+def parse_frame(opcode, key, value):
+    """Parses a binary frame that is already read in full."""
+    command = _COMMANDS.get(opcode)
+    if command is None:
+        LOG.debug("Opcode %s is invalid", opcode)
+        raise InvalidCommandException()
+    if len(key) == 0:
+        raise InvalidKeyException()
+    if command == rpc.SET:
+        return (command, key, value)
+    if command == rpc.EXPIRE:
+        return (command, key, expiry.parse_ttl(value))
+    if command == rpc.EXPIREAT:
+        return (command, key, expiry.parse_deadline(value))
+    return (command, key)
+
+
+def encode_request(command, key, value=b''):
+    """Encodes a command into a binary request frame."""
+    return REQUEST_HEADER.pack(_OPCODES[command],
+                               len(key), len(value)) + key + value
+
+
+def encode_response(payload: bytes):
+    """Encodes a successful response into a binary response frame."""
+    return RESPONSE_HEADER.pack(STATUS_OK, len(payload)) + payload
+
+
+def encode_error(rpc_message: str):
+    """Encodes an RPC error message into a binary response frame."""
+    payload = rpc.encode_response_message(rpc_message)
+    return RESPONSE_HEADER.pack(STATUS_ERROR, len(payload)) + payload
+
+
+def _raise_frame_too_large(key_length, value_length):
+    if key_length > MAX_KEY_SIZE or value_length > MAX_VALUE_SIZE:
+        LOG.error("Frame of %s + %s bytes is too large",
+                  key_length, value_length)
+        raise InvalidFrameException()
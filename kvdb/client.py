@@ -0,0 +1,899 @@
+"""Client library for kvdb.
+
+Both clients keep a bounded pool of connections upgraded with REUSECONN,
+so a request never pays for a connection setup. The asyncio Client writes
+requests as soon as they are made, without waiting for the responses of
+the earlier ones, so concurrent callers share the connections and their
+requests are pipelined. Responses arrive in the order of the requests,
+and are matched to them by a reader task per connection. The blocking
+SyncClient lends a connection to one thread at a time.
+
+With a cache_size, the clients keep the values read by get in a near cache,
+a bounded LRU, and serve the cached keys without a round trip. The server
+tracks the keys read by the client, and pushes their invalidations on
+a dedicated connection when they are modified. A value read while its key
+is invalidated, or while the invalidation connection is lost, is not cached,
+and losing that connection clears the cache.
+
+The text protocol limits the arguments: keys can't contain spaces or
+newlines, values can't contain newlines, and values of batches can't
+contain spaces either."""
+import abc
+import asyncio
+import collections
+import functools
+import logging
+import socket
+import threading
+import time
+from kvdb import rpc
+from kvdb.exceptions import (EventsLostException, IndexDisabledException,
+                             InvalidCommandException, InvalidKeyException,
+                             KeyNotFoundException, KvdbException,
+                             SaveInProgressException,
+                             SnapshotsDisabledException,
+                             WorkerUnavailableException)
+
+LOG = logging.getLogger(__name__)
+DEFAULT_MAX_CONNECTIONS = 4
+# Seconds to wait for a response.
+DEFAULT_TIMEOUT = 5
+DEFAULT_SCAN_COUNT = 100
+# Idle connections of the SyncClient are checked before they are reused,
+# if they were not used for this many seconds.
+HEALTH_CHECK_INTERVAL = 1
+# Initial size of the receive buffer of a SyncClient connection,
+# it grows to fit the longest line received.
+BUFFER_SIZE = 16 * 1024
+# Longest line an asyncio connection reads, the StreamReader default of
+# 64 KiB would fail the values larger than that.
+MAX_LINE_LENGTH = 512 * 1024 * 1024
+NEWLINE = b"\n"
+INVALIDATE = rpc.encode_response_message(rpc.INVALIDATE + " ")
+_MISSING = object()
+_ERRORS = {exception.rpc_message.encode(): exception for exception in (
+    InvalidCommandException, InvalidKeyException, KeyNotFoundException,
+    WorkerUnavailableException, SaveInProgressException,
+    SnapshotsDisabledException, IndexDisabledException, EventsLostException)}
+_ERRORS[rpc.UNKNOWN_ERROR.encode()] = KvdbException
+_ERRORS[rpc.TIMEOUT_ERROR.encode()] = KvdbException
+
+
+class _Commands(abc.ABC):
+    """Commands of both clients. Requests are sent by _request,
+      that returns the response of the synchronous client,
+      and an awaitable of the response in the asyncio one.
+      The keys modified by a request are dropped from the near cache."""
+    _cache = None
+
+    def get(self, key):
+        """Gets the value of the key, None if it is missing."""
+        key = _key(key)
+        if self._cache is not None:
+            return self._cached_get(key)
+        return self._request(b"GET " + key, _read_value())
+
+    def set(self, key, value, ttl=None):
+        """Sets the value of the key, expiring after ttl seconds if given."""
+        key = _key(key)
+        if ttl is None:
+            request = b"SET " + key + b" " + _value(value)
+        else:
+            request = (b"SETEX " + key + b" " + str(int(ttl)).encode() +
+                       b" " + _value(value))
+        return self._request(request, _read_line(), (key,))
+
+    def delete(self, key):
+        """Deletes the key."""
+        key = _key(key)
+        return self._request(b"DELETE " + key, _read_line(), (key,))
+
+    def expire(self, key, ttl):
+        """Expires an existing key after ttl seconds."""
+        return self._request(b"EXPIRE " + _key(key) + b" " +
+                             str(int(ttl)).encode(), _read_line())
+
+    def expire_at(self, key, deadline):
+        """Expires an existing key at a unix timestamp."""
+        return self._request(b"EXPIREAT " + _key(key) + b" " +
+                             repr(float(deadline)).encode(), _read_line())
+
+    def get_many(self, keys):
+        """Gets the values of the keys, None for missing keys."""
+        keys = [_key(key) for key in keys]
+        return self._request(b"MGET " + b" ".join(keys),
+                             _read_values(len(keys)))
+
+    def set_many(self, items):
+        """Sets the values of a key to value mapping."""
+        arguments = []
+        for key, value in items.items():
+            value = _value(value)
+            if b" " in value:
+                raise ValueError("values of batches can't contain spaces")
+            arguments += [_key(key), value]
+        return self._request(b"MSET " + b" ".join(arguments), _read_line(),
+                             arguments[::2])
+
+    def delete_many(self, keys):
+        """Deletes the keys, skipping missing keys."""
+        keys = [_key(key) for key in keys]
+        return self._request(b"MDELETE " + b" ".join(keys), _read_line(),
+                             keys)
+
+    def range(self, start, end, limit=None):
+        """Gets the keys from start, inclusive, to end, exclusive, in order.
+          Needs the sorted index on the server."""
+        return self._request(b"RANGE " + _key(start) + b" " + _key(end) +
+                             _limit(limit), _read_list())
+
+    def scan(self, prefix, limit=None):
+        """Gets the keys starting with the prefix, in order.
+          Needs the sorted index on the server."""
+        return self._request(b"SCAN " + _key(prefix) + _limit(limit),
+                             _read_list())
+
+    def info(self):
+        """Gets the metrics of the server, as a name to value dict."""
+        return self._request(b"INFO", _read_info())
+
+    def slowlog_get(self, count=None):
+        """Gets the last count entries of the slow log, newest first."""
+        request = b"SLOWLOG GET"
+        if count is not None:
+            request += b" " + str(int(count)).encode()
+        return self._request(request, _read_list())
+
+    def save(self):
+        """Saves a snapshot on the server."""
+        return self._request(b"SAVE", _read_line())
+
+    def bgsave(self):
+        """Starts saving a snapshot on the server in the background."""
+        return self._request(b"BGSAVE", _read_line())
+
+    def publish(self, channel, message):
+        """Publishes the message on the channel, and returns the number
+          of subscribers it was sent to."""
+        return self._request(b"PUBLISH " + _key(channel) + b" " +
+                             _value(message), _read_count())
+
+    @abc.abstractmethod
+    def _request(self, request, parser, keys=()):
+        """Sends the request and parses its response."""
+
+    @abc.abstractmethod
+    def _cached_get(self, key):
+        """Gets the value of the key through the near cache."""
+
+
+class Client(_Commands):
+    """Asyncio client of a kvdb server, listening on a TCP port
+      or on a unix socket."""
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self, host=None, port=None, unix_socket=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT, cache_size=0) -> None:
+        if unix_socket is None and port is None:
+            raise ValueError("port or unix_socket is required")
+        self.timeout = timeout
+        address = (host, port, unix_socket)
+        self._address = address
+        self._connections = [_Connection(address)
+                             for _ in range(max_connections)]
+        if cache_size:
+            self._cache = _NearCache(cache_size)
+            self._invalidations = _Invalidations(address, self._cache)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def scan_iter(self, count=DEFAULT_SCAN_COUNT):
+        """Iterates every key of the server, count keys per request."""
+        cursor = 0
+        while True:
+            cursor, keys = await self._request(
+                f"SCAN {cursor} COUNT {count}".encode(), _read_cursor())
+            for key in keys:
+                yield key
+            if cursor == 0:
+                return
+
+    async def watch(self, prefix, since=None):
+        """Iterates the modifications of the keys starting with the prefix,
+          as (sequence, command, key, value) tuples, value None for deletes,
+          received on a dedicated connection. Passing the sequence number
+          of the last modification seen resumes after it."""
+        prefix = _value(prefix)
+        if b" " in prefix:
+            raise ValueError(f"invalid prefix {prefix!r}")
+        request = b"WATCH " + prefix
+        if since is not None:
+            request += b" " + str(int(since)).encode()
+        reader, writer = await _open_connection(self._address, rpc.REUSECONN)
+        try:
+            writer.write(request + NEWLINE)
+            _raise_for_error(await _read_stream_line(reader))
+            while True:
+                yield _parse_event(await _read_stream_line(reader))
+        finally:
+            writer.close()
+
+    async def close(self):
+        """Closes the connections, failing the pending requests."""
+        for connection in self._connections:
+            await connection.close()
+        if self._cache is not None:
+            await self._invalidations.close()
+
+    def _request(self, request, parser, keys=()):
+        return self._send(request, parser, keys)
+
+    async def _send(self, request, parser, keys=(), tracking_id=None):
+        if keys and self._cache is not None:
+            self._cache.invalidate(keys)
+        try:
+            connection = self._connection()
+            response = await connection.send(request + NEWLINE, parser,
+                                             tracking_id)
+            return await asyncio.wait_for(response, self.timeout)
+        finally:
+            # Drops the values read while the request was in flight.
+            if keys and self._cache is not None:
+                self._cache.invalidate(keys)
+
+    def _cached_get(self, key):
+        return self._send_cached_get(key)
+
+    async def _send_cached_get(self, key):
+        value = self._cache.get(key)
+        if value is not _MISSING:
+            return value
+        tracking_id = await self._invalidations.connect()
+        self._cache.start_read(key)
+        value = _MISSING
+        try:
+            value = await self._send(b"GET " + key, _read_value(),
+                                     tracking_id=tracking_id)
+            return value
+        finally:
+            self._cache.finish_read(
+                key, value if self._invalidations.client_id == tracking_id
+                else _MISSING)
+
+    def _connection(self):
+        """Chooses an idle connection, opens a new one if there is none,
+          or pipelines on the least busy one once the pool is full."""
+        open_connections = [connection for connection in self._connections
+                            if connection.is_open()]
+        idle = next((connection for connection in open_connections
+                     if not connection.pending), None)
+        if idle is not None:
+            return idle
+        if len(open_connections) < len(self._connections):
+            return next(connection for connection in self._connections
+                        if not connection.is_open())
+        return min(open_connections,
+                   key=lambda connection: len(connection.pending))
+
+
+class _Connection():
+    """Pipelined connection of the asyncio pool."""
+
+    def __init__(self, address) -> None:
+        self._address = address
+        self._writer = None
+        # Tracking client declared on the connection.
+        self.tracking_id = None
+        self._reader_task = None
+        # Futures of the requests, and the parsers of their responses.
+        self.pending = collections.deque()
+        self._connect_lock = asyncio.Lock()
+
+    def is_open(self):
+        """Checks if the connection is open, or being opened."""
+        return self._writer is not None or self._connect_lock.locked()
+
+    async def send(self, request, parser, tracking_id=None):
+        """Writes a request, and returns the awaitable of its response.
+          If a tracking client id is given, it is declared first."""
+        if self._writer is None:
+            await self._connect()
+        loop = asyncio.get_running_loop()
+        tracked = None
+        if tracking_id is not None and tracking_id != self.tracking_id:
+            tracked = loop.create_future()
+            tracked.add_done_callback(
+                functools.partial(self._tracked, tracking_id))
+            self.pending.append((tracked, _read_line()))
+            self._writer.write(rpc.encode_response_message(
+                rpc.TRACKING + " ") + str(tracking_id).encode() + NEWLINE)
+        future = loop.create_future()
+        self.pending.append((future, parser))
+        self._writer.write(request)
+        await self._writer.drain()
+        if tracked is not None:
+            return _last(asyncio.gather(tracked, future))
+        return future
+
+    async def close(self):
+        """Closes the connection, failing the pending requests."""
+        writer, self._writer = self._writer, None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending()
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError as exc:
+                LOG.warning("Closing connection failed: %s", exc)
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, self._writer = await _open_connection(self._address,
+                                                          rpc.REUSECONN)
+            self.tracking_id = None
+            self._reader_task = asyncio.create_task(self._read(reader))
+
+    def _tracked(self, tracking_id, future):
+        if not future.cancelled() and future.exception() is None:
+            self.tracking_id = tracking_id
+
+    async def _read(self, reader):
+        try:
+            while True:
+                line = await _read_stream_line(reader)
+                if not self.pending:
+                    # Like the timeout error of an idle connection.
+                    LOG.error("Unexpected response %r", line)
+                    break
+                future, parser = self.pending.popleft()
+                try:
+                    next(parser)
+                    while True:
+                        parser.send(line)
+                        line = await _read_stream_line(reader)
+                except StopIteration as response:
+                    if not future.done():
+                        future.set_result(response.value)
+                except KvdbException as exc:
+                    if not future.done():
+                        future.set_exception(exc)
+        except OSError as exc:
+            LOG.error("Connection lost: %s", exc)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            LOG.error("Can not read the response: %s", exc)
+        # The connection is out of sync, it is reopened by the next request.
+        self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while self.pending:
+            future, _ = self.pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed"))
+
+
+class _Invalidations():
+    """Connection receiving the invalidations of the near cache."""
+
+    def __init__(self, address, cache) -> None:
+        self._address = address
+        self._cache = cache
+        # Id of the tracking client, None until the connection is open.
+        self.client_id = None
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        """Returns the tracking client id, opening the connection
+          if it is not open."""
+        if self.client_id is not None:
+            return self.client_id
+        async with self._connect_lock:
+            if self.client_id is None:
+                reader, writer = await _open_connection(self._address,
+                                                        rpc.INVALIDATIONS)
+                try:
+                    client_id = int(await _read_stream_line(reader))
+                except (OSError, ValueError):
+                    writer.close()
+                    raise
+                self._writer = writer
+                self._reader_task = asyncio.create_task(self._read(reader))
+                self.client_id = client_id
+            return self.client_id
+
+    async def close(self):
+        """Closes the connection, and clears the cache."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._lost()
+
+    async def _read(self, reader):
+        try:
+            while True:
+                line = await _read_stream_line(reader)
+                if line.startswith(INVALIDATE):
+                    self._cache.invalidate((line[len(INVALIDATE):],))
+        except OSError as exc:
+            LOG.error("Invalidation connection lost: %s", exc)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            LOG.error("Can not read the invalidations: %s", exc)
+        self._lost()
+
+    def _lost(self):
+        # Nothing is invalidated any more, the cached values can't be used.
+        self.client_id = None
+        self._reader_task = None
+        self._cache.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _NearCache():
+    """Bounded LRU cache of the values read by get, that drops the values
+      invalidated while they are read. Safe to share between threads."""
+
+    def __init__(self, max_size) -> None:
+        self.max_size = max_size
+        self._values = collections.OrderedDict()
+        # Keys being read, and whether they were not invalidated meanwhile.
+        self._reads = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        """Returns the cached value of the key, or _MISSING."""
+        with self._lock:
+            value = self._values.get(key, _MISSING)
+            if value is not _MISSING:
+                self._values.move_to_end(key)
+            return value
+
+    def start_read(self, key):
+        """Marks the key as being read from the server."""
+        with self._lock:
+            self._reads.setdefault(key, True)
+
+    def finish_read(self, key, value):
+        """Caches the value read, unless the key was invalidated
+          since the read started, or the value is _MISSING."""
+        with self._lock:
+            if self._reads.pop(key, False) and value is not _MISSING:
+                self._values[key] = value
+                self._values.move_to_end(key)
+                if len(self._values) > self.max_size:
+                    self._values.popitem(last=False)
+
+    def invalidate(self, keys):
+        """Drops the keys, and the values of their reads in flight."""
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+                if key in self._reads:
+                    self._reads[key] = False
+
+    def clear(self):
+        """Drops every value, and the values of the reads in flight."""
+        with self._lock:
+            self._values.clear()
+            for key in self._reads:
+                self._reads[key] = False
+
+
+class SyncClient(_Commands):
+    """Blocking client of a kvdb server, that can be shared by threads."""
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self, host=None, port=None, unix_socket=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL,
+                 cache_size=0) -> None:
+        if unix_socket is None and port is None:
+            raise ValueError("port or unix_socket is required")
+        self._address = unix_socket if unix_socket is not None \
+            else (host, port)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._slots = threading.BoundedSemaphore(max_connections)
+        # deque.append and pop are safe to share between threads. The last
+        # returned connection is reused first, so the others can time out.
+        self._idle = collections.deque()
+        if cache_size:
+            self._cache = _NearCache(cache_size)
+            self._invalidations = _InvalidationThread(self._address, timeout,
+                                                      self._cache)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def scan_iter(self, count=DEFAULT_SCAN_COUNT):
+        """Iterates every key of the server, count keys per request."""
+        cursor = 0
+        while True:
+            cursor, keys = self._request(
+                f"SCAN {cursor} COUNT {count}".encode(), _read_cursor())
+            yield from keys
+            if cursor == 0:
+                return
+
+    def close(self):
+        """Closes the idle connections. Connections in use are closed
+          by the next close after their request."""
+        while self._idle:
+            self._idle.pop().close()
+        if self._cache is not None:
+            self._invalidations.close()
+
+    def _request(self, request, parser, keys=(), tracking_id=None):
+        if keys and self._cache is not None:
+            self._cache.invalidate(keys)
+        try:
+            return self._exchange(request, parser, tracking_id)
+        finally:
+            # Drops the values read while the request was in flight.
+            if keys and self._cache is not None:
+                self._cache.invalidate(keys)
+
+    def _cached_get(self, key):
+        value = self._cache.get(key)
+        if value is not _MISSING:
+            return value
+        tracking_id = self._invalidations.connect()
+        self._cache.start_read(key)
+        value = _MISSING
+        try:
+            value = self._request(b"GET " + key, _read_value(),
+                                  tracking_id=tracking_id)
+            return value
+        finally:
+            self._cache.finish_read(
+                key, value if self._invalidations.client_id == tracking_id
+                else _MISSING)
+
+    def _exchange(self, request, parser, tracking_id):
+        # pylint: disable-next=consider-using-with
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("No connection available")
+        try:
+            connection = self._checkout()
+            try:
+                if tracking_id is not None and \
+                        tracking_id != connection.tracking_id:
+                    connection.request(
+                        rpc.encode_response_message(rpc.TRACKING + " ") +
+                        str(tracking_id).encode() + NEWLINE, _read_line())
+                    connection.tracking_id = tracking_id
+                response = connection.request(request + NEWLINE, parser)
+            except KvdbException:
+                self._idle.append(connection)
+                raise
+            except BaseException:
+                # The rest of the response may still arrive.
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return response
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        while self._idle:
+            try:
+                connection = self._idle.pop()
+            except IndexError:
+                break
+            if connection.is_healthy(self.health_check_interval):
+                return connection
+            connection.close()
+        return _SocketConnection(self._address, self.timeout)
+
+
+class _SocketConnection():
+    """Blocking connection of the SyncClient pool,
+      receiving into a preallocated buffer."""
+
+    def __init__(self, address, timeout, handshake=rpc.REUSECONN) -> None:
+        if isinstance(address, str):
+            # pylint: disable-next=consider-using-with
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(address, timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                    1)
+        self._timeout = timeout
+        self._buffer = bytearray(BUFFER_SIZE)
+        # Unread bytes are between start and end.
+        self._start = self._end = 0
+        self.last_used = time.monotonic()
+        # Tracking client declared on the connection.
+        self.tracking_id = None
+        try:
+            self._socket.sendall(
+                rpc.encode_response_message(handshake + " "))
+            response = self.read_line()
+        except BaseException:
+            self._socket.close()
+            raise
+        if response != rpc.encode_response_message(rpc.OK):
+            self._socket.close()
+            raise ConnectionError(f"Unexpected handshake {response!r}")
+
+    def request(self, request, parser):
+        """Sends a request, and returns its parsed response."""
+        self._socket.sendall(request)
+        try:
+            next(parser)
+            while True:
+                parser.send(self.read_line())
+        except StopIteration as response:
+            return response.value
+        finally:
+            self.last_used = time.monotonic()
+
+    def is_healthy(self, interval):
+        """Checks that a connection idle for longer than the interval
+          was not closed by the server, without a round trip."""
+        if time.monotonic() - self.last_used < interval:
+            return True
+        if self._start != self._end:
+            return False
+        self._socket.setblocking(False)
+        try:
+            # Nothing to read is healthy, a closed connection reads b"".
+            self._socket.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            self._socket.settimeout(self._timeout)
+        return False
+
+    def set_timeout(self, timeout):
+        """Sets the timeout of the socket, None blocks without a timeout."""
+        self._timeout = timeout
+        self._socket.settimeout(timeout)
+
+    def close(self):
+        """Closes the socket, waking up a thread reading from it."""
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+    def read_line(self):
+        """Reads the next line, without the newline."""
+        while True:
+            end = self._buffer.find(NEWLINE, self._start, self._end)
+            if end != -1:
+                line = bytes(self._buffer[self._start:end])
+                self._start = end + 1
+                if self._start == self._end:
+                    self._start = self._end = 0
+                return line
+            self._receive()
+
+    def _receive(self):
+        if self._end == len(self._buffer):
+            if self._start:
+                # Moves the partial line to the start of the buffer.
+                self._buffer[:self._end - self._start] = \
+                    self._buffer[self._start:self._end]
+                self._end -= self._start
+                self._start = 0
+            else:
+                self._buffer.extend(bytes(len(self._buffer)))
+        with memoryview(self._buffer)[self._end:] as view:
+            received = self._socket.recv_into(view)
+        if not received:
+            raise ConnectionResetError("Connection closed by server")
+        self._end += received
+
+
+class _InvalidationThread():
+    """Connection receiving the invalidations of the near cache
+      of the SyncClient on a background thread."""
+
+    def __init__(self, address, timeout, cache) -> None:
+        self._address = address
+        self._timeout = timeout
+        self._cache = cache
+        # Id of the tracking client, None until the connection is open.
+        self.client_id = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Returns the tracking client id, opening the connection
+          if it is not open."""
+        client_id = self.client_id
+        if client_id is not None:
+            return client_id
+        with self._lock:
+            if self.client_id is None:
+                connection = _SocketConnection(self._address, self._timeout,
+                                               rpc.INVALIDATIONS)
+                try:
+                    client_id = int(connection.read_line())
+                except (OSError, ValueError):
+                    connection.close()
+                    raise
+                connection.set_timeout(None)
+                self._connection = connection
+                threading.Thread(target=self._read, args=(connection,),
+                                 daemon=True).start()
+                self.client_id = client_id
+            return self.client_id
+
+    def close(self):
+        """Closes the connection, and clears the cache."""
+        with self._lock:
+            connection, self._connection = self._connection, None
+            self.client_id = None
+        if connection is not None:
+            connection.close()
+        self._cache.clear()
+
+    def _read(self, connection):
+        try:
+            while True:
+                line = connection.read_line()
+                if line.startswith(INVALIDATE):
+                    self._cache.invalidate((line[len(INVALIDATE):],))
+        except OSError as exc:
+            with self._lock:
+                if self._connection is not connection:
+                    return
+                LOG.error("Invalidation connection lost: %s", exc)
+                # Nothing is invalidated any more,
+                # the cached values can't be used.
+                self._connection = None
+                self.client_id = None
+            connection.close()
+            self._cache.clear()
+
+
+async def _open_connection(address, handshake):
+    """Opens a connection, and sends the command upgrading it."""
+    host, port, unix_socket = address
+    if unix_socket is not None:
+        reader, writer = await asyncio.open_unix_connection(
+            unix_socket, limit=MAX_LINE_LENGTH)
+    else:
+        reader, writer = await asyncio.open_connection(
+            host, port, limit=MAX_LINE_LENGTH)
+    writer.write(rpc.encode_response_message(handshake + " "))
+    response = await reader.readline()
+    if response != rpc.encode_response_message(rpc.OK) + NEWLINE:
+        writer.close()
+        raise ConnectionError(f"Unexpected handshake {response!r}")
+    return reader, writer
+
+
+async def _last(responses):
+    return (await responses)[-1]
+
+
+async def _read_stream_line(reader):
+    line = await reader.readline()
+    if not line.endswith(NEWLINE):
+        raise ConnectionResetError("Connection closed by server")
+    return line[:-1]
+
+
+def _parse_event(line):
+    _, sequence, command, rest = line.split(b" ", 3)
+    if command == rpc.encode_response_message(rpc.DELETE):
+        return int(sequence), command.decode(), rest, None
+    key, _, value = rest.partition(b" ")
+    return int(sequence), command.decode(), key, value
+
+
+def _key(key):
+    key = _value(key)
+    if not key or b" " in key or NEWLINE in key:
+        raise ValueError(f"invalid key {key!r}")
+    return key
+
+
+def _value(value):
+    if isinstance(value, str):
+        value = value.encode()
+    if NEWLINE in value:
+        raise ValueError("values can't contain newlines")
+    return value
+
+
+def _limit(limit):
+    if limit is None:
+        return b""
+    return b" LIMIT " + str(int(limit)).encode()
+
+
+def _raise_for_error(line):
+    exception = _ERRORS.get(line)
+    if exception is not None:
+        raise exception(line.decode())
+
+
+# Parsers of the responses are generators, that are sent the lines of the
+# response, and return the parsed response once they have read all of them.
+
+def _read_line():
+    line = yield
+    _raise_for_error(line)
+    return line
+
+
+def _read_value():
+    line = yield
+    if line == rpc.encode_response_message(rpc.KEY_NOT_FOUND):
+        return None
+    _raise_for_error(line)
+    return line
+
+
+def _read_values(count):
+    missing = rpc.encode_response_message(rpc.KEY_NOT_FOUND)
+    line = yield
+    # Missing keys are reported per key, other errors for the batch.
+    if line != missing:
+        _raise_for_error(line)
+    lines = [line]
+    for _ in range(count - 1):
+        lines.append((yield))
+    return [None if value == missing else value for value in lines]
+
+
+def _read_count():
+    line = yield
+    _raise_for_error(line)
+    return int(line)
+
+
+def _read_list():
+    """Reads lines until the closing empty line."""
+    line = yield
+    _raise_for_error(line)
+    lines = []
+    while line:
+        lines.append(line)
+        line = yield
+    return lines
+
+
+def _read_cursor():
+    line = yield
+    _raise_for_error(line)
+    return int(line), (yield from _read_list())
+
+
+def _read_info():
+    lines = yield from _read_list()
+    return dict(line.decode().split(":", 1) for line in lines)
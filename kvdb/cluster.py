@@ -0,0 +1,239 @@
+"""Keyspace partitioning between the worker processes of a single node.
+
+Every worker owns a hash partition of the keyspace. Commands that land on
+a worker not owning their key are forwarded to the owner over a unix socket,
+using binary framing. Requests to the same worker are pipelined over a single
+connection, and the responses are matched to the requests by their order."""
+import asyncio
+import collections
+import logging
+import os
+import zlib
+from kvdb import binary_parser, rpc
+from kvdb.exceptions import (ForwardedCommandException,
+                             WorkerUnavailableException)
+
+LOG = logging.getLogger(__name__)
+FORWARDED_COMMANDS = (rpc.GET, rpc.SET, rpc.DELETE, rpc.EXPIRE, rpc.EXPIREAT)
+BATCH_COMMANDS = (rpc.MGET, rpc.MSET, rpc.MDELETE)
+# Seconds to wait for the response of a forwarded command.
+FORWARD_TIMEOUT = 5
+
+
+def shard_of(key, shards):
+    """Returns the shard owning the key.
+      Stable across processes, unlike the builtin hash."""
+    return zlib.crc32(key) % shards
+
+
+def worker_socket_path(socket_dir, worker):
+    """Path of the unix socket where a worker accepts forwarded commands."""
+    return os.path.join(socket_dir, f"worker-{worker}.sock")
+
+
+class Forwarder():
+    """Forwards commands to the worker owning their key."""
+
+    def __init__(self, worker, workers, socket_dir) -> None:
+        self.worker = worker
+        self.workers = workers
+        self._peers = {peer: _PeerConnection(
+                            worker_socket_path(socket_dir, peer))
+                       for peer in range(workers) if peer != worker}
+
+    def forwards(self, message):
+        """Checks if the message has to be executed by an other worker.
+          Batches are split between the workers owning their keys."""
+        if message[0] in BATCH_COMMANDS:
+            return not all(map(self._is_local, message[1]))
+        return (message[0] in FORWARDED_COMMANDS and
+                not self._is_local(message[1]))
+
+    def forward(self, message):
+        """Sends the message to the owner of its key before returning, so
+          the commands reach the owner in the order they were executed.
+          Returns the awaitable status and payload of the response."""
+        peer = self._peers[shard_of(message[1], self.workers)]
+        if message[0] == rpc.SET and len(message) > 3:
+            # Binary framing has no SET with time to live, so it is sent
+            # as a SET and an EXPIRE, pipelined on the same connection.
+            return self._first_error(
+                [peer.send(_encode_frame(message[:3])),
+                 peer.send(_encode_frame((rpc.EXPIRE, message[1],
+                                          message[3])))])
+        return peer.send(_encode_frame(message))
+
+    def get_many(self, storage, keys):
+        """Gets the values of keys from the workers owning them,
+          None for missing keys. The local keys are read, and the others
+          sent to their owners before returning the awaitable values."""
+        local_keys = [key for key in keys if self._is_local(key)]
+        values = dict(zip(local_keys, storage.get_many(local_keys)))
+        remote_keys = [key for key in keys if not self._is_local(key)]
+        return self._merge_values(
+            keys, values, remote_keys,
+            [self.forward((rpc.GET, key)) for key in remote_keys])
+
+    def set_many(self, storage, items):
+        """Sets the values on the workers owning their keys. The local keys
+          are set, and the others sent to their owners before returning
+          the awaitable completion."""
+        storage.set_many({key: value for key, value in items.items()
+                          if self._is_local(key)})
+        return self._raise_for_errors(
+            [self.forward((rpc.SET, key, value))
+             for key, value in items.items() if not self._is_local(key)])
+
+    def delete_many(self, storage, keys):
+        """Deletes keys on the workers owning them, skipping missing keys.
+          The local keys are deleted, and the others sent to their owners
+          before returning the awaitable number of deleted values."""
+        deleted = storage.delete_many(
+            [key for key in keys if self._is_local(key)])
+        return self._count_deleted(
+            deleted, [self.forward((rpc.DELETE, key))
+                      for key in keys if not self._is_local(key)])
+
+    def close(self):
+        """Closes the connections to the other workers."""
+        for peer in self._peers.values():
+            peer.close()
+
+    def _is_local(self, key):
+        return shard_of(key, self.workers) == self.worker
+
+    @staticmethod
+    async def _first_error(responses):
+        responses = await asyncio.gather(*responses)
+        return next((response for response in responses
+                     if response[0] != binary_parser.STATUS_OK),
+                    responses[-1])
+
+    @staticmethod
+    async def _merge_values(keys, values, remote_keys, responses):
+        for key, (status, payload) in zip(remote_keys,
+                                          await asyncio.gather(*responses)):
+            values[key] = payload if status == binary_parser.STATUS_OK \
+                else None
+        return [values[key] for key in keys]
+
+    @staticmethod
+    async def _raise_for_errors(responses):
+        for status, payload in await asyncio.gather(*responses):
+            if status != binary_parser.STATUS_OK:
+                raise ForwardedCommandException(payload.decode())
+
+    @staticmethod
+    async def _count_deleted(deleted, responses):
+        return deleted + sum(status == binary_parser.STATUS_OK
+                             for status, _ in await asyncio.gather(*responses))
+
+
+def _encode_frame(message):
+    if message[0] == rpc.SET:
+        value = message[2]
+    elif message[0] in (rpc.EXPIRE, rpc.EXPIREAT):
+        value = repr(message[2]).encode()
+    else:
+        value = b''
+    return binary_parser.encode_request(message[0], message[1], value)
+
+
+class _PeerConnection():
+    """Pipelined binary framing connection to an other worker."""
+
+    def __init__(self, path) -> None:
+        self._path = path
+        self._writer = None
+        self._reader_task = None
+        self._connect_task = None
+        # Frames sent while the connection is being opened.
+        self._queued = []
+        self._pending = collections.deque()
+
+    async def request(self, frame):
+        """Sends a frame, and waits for its response."""
+        return await self.send(frame)
+
+    def send(self, frame):
+        """Writes a frame without yielding to the event loop, so frames sent
+          one after the other are written in the same order, even while the
+          connection is being opened. Returns the awaitable response."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        if self._writer is not None:
+            self._writer.write(frame)
+        else:
+            self._queued.append(frame)
+            if self._connect_task is None:
+                self._connect_task = asyncio.create_task(self._connect())
+        return self._response(future)
+
+    async def _response(self, future):
+        """Waits for the response of a sent frame. The connection is
+          closed if the response doesn't arrive in time, since the responses
+          that follow could not be matched to their requests any more."""
+        try:
+            return await asyncio.wait_for(future, FORWARD_TIMEOUT)
+        except asyncio.TimeoutError as exc:
+            LOG.error("Forwarded command to %s timed out", self._path)
+            self.close()
+            raise WorkerUnavailableException() from exc
+
+    def close(self):
+        """Closes the connection, failing the pending requests.
+          The next request opens a new connection."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._connect_task is not None:
+            self._connect_task.cancel()
+            self._connect_task = None
+        self._queued.clear()
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(WorkerUnavailableException())
+
+    async def _connect(self):
+        try:
+            reader, writer = await asyncio.open_unix_connection(self._path)
+            writer.write(rpc.encode_response_message(rpc.BINARY + " "))
+            await reader.readuntil(rpc.encode_response_message(rpc.NEWLINE))
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            LOG.error("Can not connect to %s: %s", self._path, exc)
+            # Cleared first, so close doesn't cancel the running task.
+            self._connect_task = None
+            self.close()
+            return
+        self._connect_task = None
+        self._writer = writer
+        writer.write(b''.join(self._queued))
+        self._queued.clear()
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader):
+        try:
+            while True:
+                header = await reader.readexactly(
+                    binary_parser.RESPONSE_HEADER.size)
+                status, length = binary_parser.RESPONSE_HEADER.unpack(header)
+                payload = await reader.readexactly(length)
+                if not self._pending:
+                    LOG.error("Unexpected frame from %s: %r", self._path,
+                              payload)
+                    break
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result((status, payload))
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            LOG.error("Connection to %s lost: %s", self._path, exc)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as exc:
+            LOG.error("Can not read from %s: %s", self._path, exc)
+        # Cleared first, so close doesn't cancel the running task.
+        self._reader_task = None
+        self.close()
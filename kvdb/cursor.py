@@ -0,0 +1,111 @@
+"""Bucket table of the keys of a storage, for cursor based iteration.
+
+Keys are placed in buckets by the low bits of their hash, using linear
+hashing: the table grows by splitting one bucket at a time, so there is no
+pause to rehash every key. The cursor is a bucket number, incremented
+in reverse binary order, like the SCAN of Redis. Splitting bucket b adds
+bucket b + 2^level, that comes right after b in this order, so a scan
+returns every key present during the whole scan, even if the table grows.
+Buckets are sets, so a key is removed in constant time."""
+import sys
+
+MIN_LEVEL = 4
+# A bucket is split whenever the table has more keys than this many
+# times the number of buckets.
+LOAD_FACTOR = 4
+# Maximum number of buckets visited for every requested key,
+# so a scan of a sparse table returns in bounded time.
+EMPTY_VISITS = 10
+# Approximate bytes of a key in its bucket, and of an empty bucket
+# with its slot in the list of buckets.
+KEY_SIZE = 32
+BUCKET_SIZE = sys.getsizeof(set()) + 8
+
+
+class CursorTable():
+    """Keys in buckets that can be visited in a stable order."""
+
+    def __init__(self, keys=()) -> None:
+        self._level = MIN_LEVEL
+        # Buckets before the split pointer are split to the next level.
+        self._split = 0
+        self._buckets = [set() for _ in range(1 << MIN_LEVEL)]
+        self._length = 0
+        # Approximate bytes used by the table.
+        self.size = len(self._buckets) * BUCKET_SIZE
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self._length
+
+    def add(self, key):
+        """Adds a key, that is not in the table yet.
+          Returns the bytes added to the size of the table."""
+        self._buckets[self._bucket_of(hash(key))].add(key)
+        self._length += 1
+        added = KEY_SIZE
+        if self._length > LOAD_FACTOR * len(self._buckets):
+            self._split_bucket()
+            added += BUCKET_SIZE
+        self.size += added
+        return added
+
+    def remove(self, key):
+        """Removes a key, that is in the table.
+          Returns the bytes removed from the size of the table."""
+        self._buckets[self._bucket_of(hash(key))].remove(key)
+        self._length -= 1
+        self.size -= KEY_SIZE
+        return KEY_SIZE
+
+    def scan(self, cursor, count):
+        """Returns about count keys from the buckets starting at the cursor,
+          and the cursor of the next bucket, that is 0 after the last one."""
+        # Buckets are visited at the level of the split buckets, and keys
+        # of the other half are skipped in buckets that are not split yet.
+        level = self._level + 1 if self._split else self._level
+        mask = (1 << level) - 1
+        keys = []
+        for _ in range(count * EMPTY_VISITS):
+            bucket_number = cursor & mask
+            bucket = self._buckets[self._bucket_of(bucket_number)]
+            if self._split and bucket_number & ((1 << self._level) - 1) \
+                    >= self._split:
+                keys += [key for key in bucket
+                         if hash(key) & mask == bucket_number]
+            else:
+                keys += bucket
+            cursor = _next_cursor(bucket_number, level)
+            if cursor == 0 or len(keys) >= count:
+                break
+        return cursor, keys
+
+    def _bucket_of(self, hash_value):
+        bucket_number = hash_value & ((1 << self._level) - 1)
+        if bucket_number < self._split:
+            bucket_number = hash_value & ((2 << self._level) - 1)
+        return bucket_number
+
+    def _split_bucket(self):
+        bucket = self._buckets[self._split]
+        high_bit = 1 << self._level
+        moved = {key for key in bucket if hash(key) & high_bit}
+        self._buckets.append(moved)
+        bucket -= moved
+        self._split += 1
+        if self._split == high_bit:
+            self._level += 1
+            self._split = 0
+
+
+def _next_cursor(cursor, bits):
+    """Increments the cursor in reverse binary order, 0 after the last."""
+    reversed_cursor = _reverse(cursor, bits) + 1
+    if reversed_cursor >> bits:
+        return 0
+    return _reverse(reversed_cursor, bits)
+
+
+def _reverse(value, bits):
+    return int(format(value, f"0{bits}b")[::-1], 2)
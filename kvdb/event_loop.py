@@ -0,0 +1,26 @@
+"""Choice of the event loop implementation.
+
+uvloop is an optional dependency, a faster event loop built on libuv.
+If it is not installed, kvdb falls back to the asyncio event loop."""
+import asyncio
+import logging
+
+LOG = logging.getLogger(__name__)
+ASYNCIO = "asyncio"
+UVLOOP = "uvloop"
+LOOPS = (ASYNCIO, UVLOOP)
+
+
+def install(name):
+    """Makes the event loops created from now on use the given
+      implementation, including the loops of other threads.
+      Returns the name of the implementation actually installed."""
+    if name == UVLOOP:
+        try:
+            # pylint: disable-next=import-outside-toplevel
+            import uvloop
+        except ImportError:
+            LOG.warning("uvloop is not installed, using the asyncio loop")
+            return ASYNCIO
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return name
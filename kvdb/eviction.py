@@ -0,0 +1,150 @@
+"""Eviction policies of memory-capped storages.
+
+The memory usage of the storage is accounted per entry when it is stored.
+When it is over the limit, keys are evicted until it is under the limit again.
+Victims are chosen from a small random sample of the keys, like Redis does,
+so choosing one takes the same time regardless of the number of keys."""
+import random
+import sys
+import time
+
+LRU = "lru"
+LFU = "lfu"
+RANDOM = "random"
+POLICIES = (LRU, LFU, RANDOM)
+SAMPLE_SIZE = 5
+# Approximate size of a dict slot and of the eviction bookkeeping of a key,
+# and of the headers of the key and the value bytes objects.
+ENTRY_OVERHEAD = 96 + 2 * sys.getsizeof(b'')
+# Logarithmic access counters, like the LFU policy of Redis. New keys start
+# from LFU_INIT so they are not evicted before they are accessed again,
+# and counters are decremented every LFU_DECAY_TIME minutes without access.
+LFU_INIT = 5
+LFU_MAX = 255
+LFU_LOG_FACTOR = 10
+LFU_DECAY_TIME = 1
+_UNITS = {"kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3,
+          "k": 1000, "m": 1000 ** 2, "g": 1000 ** 3}
+
+
+def entry_size(key, value):
+    """Approximate memory used by a key and its value. The lengths are
+    cheaper to get than the size of the objects, and the same for bytes."""
+    return len(key) + len(value) + ENTRY_OVERHEAD
+
+
+def parse_memory(raw: str):
+    """Parses an amount of memory, like 1024, 100kb or 2gb."""
+    raw = raw.strip().lower()
+    for unit, multiplier in _UNITS.items():
+        if raw.endswith(unit):
+            return int(raw[:-len(unit)]) * multiplier
+    return int(raw)
+
+
+def create_policy(name):
+    """Creates the eviction policy with the given name."""
+    return _POLICIES[name]()
+
+
+class RandomPolicy():
+    """Evicts random keys."""
+
+    def __init__(self) -> None:
+        # Keys in a list, so they can be sampled in constant time.
+        self._keys = []
+        self._positions = {}
+
+    def added(self, key):
+        """Tracks a new key."""
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+
+    def accessed(self, key):
+        """Records an access to a key."""
+
+    def removed(self, key):
+        """Stops tracking a removed key."""
+        position = self._positions.pop(key)
+        last = self._keys.pop()
+        if position < len(self._keys):
+            self._keys[position] = last
+            self._positions[last] = position
+
+    def victim(self, excluded=()):
+        """Chooses the key to evict from a sample, never an excluded key.
+          Returns None if there is no other key to choose."""
+        keys = self._keys
+        if len(keys) <= len(excluded) and \
+                all(key in excluded for key in keys):
+            return None
+        candidates = []
+        while not candidates:
+            candidates = [key for key in random.choices(keys, k=SAMPLE_SIZE)
+                          if key not in excluded]
+        return min(candidates, key=self._rank)
+
+    def _rank(self, _):
+        return 0
+
+
+class LruPolicy(RandomPolicy):
+    """Evicts the least recently used key of the sample."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._clock = 0
+        self._last_access = {}
+
+    def added(self, key):
+        super().added(key)
+        self.accessed(key)
+
+    def accessed(self, key):
+        self._clock += 1
+        self._last_access[key] = self._clock
+
+    def removed(self, key):
+        super().removed(key)
+        del self._last_access[key]
+
+    def _rank(self, key):
+        return self._last_access[key]
+
+
+class LfuPolicy(RandomPolicy):
+    """Evicts the least frequently used key of the sample."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        # Access counter, and the minute it was last decremented.
+        self._counters = {}
+
+    def added(self, key):
+        super().added(key)
+        self._counters[key] = (LFU_INIT, _minutes())
+
+    def accessed(self, key):
+        counter = self._rank(key)
+        # Incremented with decreasing probability, so the counter of
+        # a byte can tell apart keys accessed up to millions of times.
+        if counter < LFU_MAX and random.random() < 1 / (
+                max(counter - LFU_INIT, 0) * LFU_LOG_FACTOR + 1):
+            counter += 1
+        self._counters[key] = (counter, _minutes())
+
+    def removed(self, key):
+        super().removed(key)
+        del self._counters[key]
+
+    def _rank(self, key):
+        counter, last_decrement = self._counters[key]
+        return max(counter - (_minutes() - last_decrement) // LFU_DECAY_TIME,
+                   0)
+
+
+def _minutes():
+    return int(time.monotonic() // 60)
+
+
+_POLICIES = {LRU: LruPolicy, LFU: LfuPolicy, RANDOM: RandomPolicy}
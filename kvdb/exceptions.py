@@ -23,3 +23,51 @@ class InvalidKeyException(KvdbException):
 class KeyNotFoundException(KvdbException):
     """Should be raised in case the referred key is not found."""
     rpc_message = rpc.KEY_NOT_FOUND
+
+
+class InvalidFrameException(InvalidCommandException):
+    """Should be raised in case a frame can not be read,
+      after which the stream can not be resynchronised."""
+
+
+class SaveInProgressException(KvdbException):
+    """Should be raised in case a snapshot is requested
+      while an other one is being saved."""
+    rpc_message = rpc.SAVE_IN_PROGRESS
+
+
+class SnapshotsDisabledException(KvdbException):
+    """Should be raised in case a snapshot is requested,
+      but no snapshot file is configured."""
+    rpc_message = rpc.SNAPSHOTS_DISABLED
+
+
+class IndexDisabledException(KvdbException):
+    """Should be raised in case keys are scanned,
+      but the sorted index or the cursor table is not enabled."""
+    rpc_message = rpc.INDEX_DISABLED
+
+
+class EventsLostException(KvdbException):
+    """Should be raised in case a watch is resumed after events
+      that are not kept any more."""
+    rpc_message = rpc.EVENTS_LOST
+
+
+class CorruptedSnapshotException(KvdbException):
+    """Should be raised in case a snapshot file can not be loaded."""
+
+
+class ForwardedCommandException(KvdbException):
+    """Should be raised in case an other worker failed
+      executing a forwarded command."""
+
+    def __init__(self, rpc_message) -> None:
+        super().__init__(rpc_message)
+        self.rpc_message = rpc_message
+
+
+class WorkerUnavailableException(KvdbException):
+    """Should be raised in case a command can not be forwarded
+      to the worker owning the key."""
+    rpc_message = rpc.WORKER_UNAVAILABLE
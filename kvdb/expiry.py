@@ -0,0 +1,104 @@
+"""Key expiry for kvdb.
+
+Deadlines are unix timestamps kept in a dict, that is the source of truth,
+and in a heap ordered by deadline, that lets the sweeper find the expired keys
+without walking the keyspace. Heap entries of keys whose deadline was changed
+or removed since are dropped when they are popped."""
+import asyncio
+import heapq
+import logging
+import math
+import time
+from kvdb.exceptions import InvalidCommandException
+
+LOG = logging.getLogger(__name__)
+SWEEP_INTERVAL = 0.1
+# Maximum number of heap entries popped before yielding to the event loop.
+SWEEP_SLICE = 256
+# The heap is rebuilt when it has this many times as many entries as keys
+# with a deadline, so overwritten deadlines don't pile up.
+HEAP_COMPACTION_RATIO = 4
+
+
+class Expiry():
+    """Deadlines of the keys of a storage."""
+
+    def __init__(self, deadlines=None) -> None:
+        self.deadlines = dict(deadlines) if deadlines else {}
+        self._heap = [(deadline, key)
+                      for key, deadline in self.deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def set(self, key, deadline):
+        """Sets the deadline of a key."""
+        self.deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if len(self._heap) > HEAP_COMPACTION_RATIO * len(self.deadlines) \
+                + SWEEP_SLICE:
+            self._heap = [(deadline, key)
+                          for key, deadline in self.deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def clear(self, key):
+        """Removes the deadline of a key, if it has one."""
+        self.deadlines.pop(key, None)
+
+    def is_expired(self, key):
+        """Checks if the deadline of a key has passed."""
+        deadline = self.deadlines.get(key)
+        return deadline is not None and deadline <= time.time()
+
+    def pop_expired(self, limit):
+        """Pops at most limit heap entries whose deadline has passed.
+          Returns the expired keys, and whether more entries have passed."""
+        now = time.time()
+        heap = self._heap
+        expired = []
+        for _ in range(limit):
+            if not heap or heap[0][0] > now:
+                return expired, False
+            deadline, key = heapq.heappop(heap)
+            if self.deadlines.get(key) == deadline:
+                expired.append(key)
+        return expired, bool(heap) and heap[0][0] <= now
+
+
+def drop_expired(contents, deadlines):
+    """Removes the keys past their deadline from restored contents,
+      and the deadlines of keys missing from them."""
+    now = time.time()
+    for key, deadline in list(deadlines.items()):
+        if deadline <= now or key not in contents:
+            del deadlines[key]
+            contents.pop(key, None)
+
+
+def parse_ttl(raw):
+    """Parses a time to live in whole seconds, that has to be positive."""
+    try:
+        ttl = int(raw)
+    except ValueError as exc:
+        raise InvalidCommandException() from exc
+    if ttl < 1:
+        raise InvalidCommandException()
+    return ttl
+
+
+def parse_deadline(raw):
+    """Parses a deadline given as a unix timestamp."""
+    try:
+        deadline = float(raw)
+    except ValueError as exc:
+        raise InvalidCommandException() from exc
+    if not math.isfinite(deadline):
+        raise InvalidCommandException()
+    return deadline
+
+
+async def sweep_periodically(storage):
+    """Deletes the expired keys of the storage in bounded slices,
+      yielding to the event loop between the slices."""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        while storage.delete_expired(SWEEP_SLICE):
+            await asyncio.sleep(0)
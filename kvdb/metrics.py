@@ -0,0 +1,143 @@
+"""HTTP endpoint exposing the server metrics to Prometheus.
+
+Serves GET /metrics in the Prometheus text exposition format, on a port
+separate from the kvdb protocol. Only HTTP/1.0 style requests are handled,
+every response closes the connection, which is how Prometheus scrapes."""
+import asyncio
+import logging
+from kvdb.stats import LATENCY_BUCKETS, STATS
+
+LOG = logging.getLogger(__name__)
+METRICS_PATH = b"/metrics"
+REQUEST_TIMEOUT = 10
+MAX_REQUEST_SIZE = 8 * 1024
+# Interval of the event loop lag measurement in seconds.
+LAG_INTERVAL = 0.5
+CONTENT_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+# The event loop only keeps weak references to the tasks.
+_MONITORS = set()
+
+
+async def start(host, port, storage, kvdb_server, stats=STATS):
+    """Starts the metrics endpoint of the kvdb server, and the monitoring
+      of the event loop lag. Both are stopped after the kvdb server."""
+    LOG.info('Starting metrics endpoint on %s %s', host, port)
+    server = await asyncio.start_server(lambda reader, writer:
+                                        _handler(reader, writer, storage,
+                                                 stats),
+                                        host, port, limit=MAX_REQUEST_SIZE)
+    monitor = asyncio.create_task(_monitor(kvdb_server, server, stats))
+    _MONITORS.add(monitor)
+    monitor.add_done_callback(_MONITORS.discard)
+    return server
+
+
+async def _monitor(kvdb_server, server, stats):
+    try:
+        await monitor_loop_lag(kvdb_server, stats)
+    finally:
+        server.close()
+
+
+async def monitor_loop_lag(kvdb_server, stats, interval=None):
+    """Measures how late the event loop wakes up from a sleep, that is how
+      long callbacks wait for the loop because of busy ones,
+      while the kvdb server is serving."""
+    interval = LAG_INTERVAL if interval is None else interval
+    loop = asyncio.get_running_loop()
+    while kvdb_server.is_serving():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        stats.loop_lag = max(loop.time() - expected, 0.0)
+
+
+def render(stats, storage):
+    """Renders the metrics in the Prometheus text format."""
+    lines = []
+    _add_metric(lines, "kvdb_commands_total", "counter",
+                "Number of executed commands.",
+                [(_command_label(command), command_stats[0])
+                 for command, command_stats in stats.by_wire_name()])
+    lines += _histogram_lines(stats)
+    for name, metric_type, help_text, value in (
+            ("kvdb_connections_total", "counter",
+             "Number of accepted connections.", stats.connections_received),
+            ("kvdb_connected_clients", "gauge",
+             "Number of open connections.", stats.connected_clients),
+            ("kvdb_keyspace_hits_total", "counter",
+             "Number of GET commands that found the key.",
+             stats.keyspace_hits),
+            ("kvdb_keyspace_misses_total", "counter",
+             "Number of GET commands that did not find the key.",
+             stats.keyspace_misses),
+            ("kvdb_keys", "gauge", "Number of keys in the storage.",
+             len(storage)),
+            ("kvdb_used_memory_bytes", "gauge",
+             "Estimated memory used by the keys and values.",
+             storage.used_memory),
+            ("kvdb_evicted_keys_total", "counter",
+             "Number of keys evicted because of the memory limit.",
+             storage.evicted_keys),
+            ("kvdb_event_loop_lag_seconds", "gauge",
+             "Delay of the last scheduled wake up of the event loop.",
+             stats.loop_lag)):
+        _add_metric(lines, name, metric_type, help_text, [("", value)])
+    return "".join(line + "\n" for line in lines).encode()
+
+
+def _histogram_lines(stats):
+    name = "kvdb_command_duration_seconds"
+    lines = [f"# HELP {name} Latency of the executed commands.",
+             f"# TYPE {name} histogram"]
+    for command, (calls, nanoseconds, buckets) in stats.by_wire_name():
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{{command="{command}",'
+                         f'le="{bound / 1e9:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{command="{command}",le="+Inf"}} '
+                     f'{calls}')
+        lines.append(f'{name}_sum{_command_label(command)} '
+                     f'{nanoseconds / 1e9}')
+        lines.append(f'{name}_count{_command_label(command)} {calls}')
+    return lines
+
+
+def _add_metric(lines, name, metric_type, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+
+
+def _command_label(command):
+    return f'{{command="{command}"}}'
+
+
+async def _handler(reader, writer, storage, stats):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                         REQUEST_TIMEOUT)
+        method, path, *_ = request.split(b"\r\n", 1)[0].split(b" ")
+        if method != b"GET":
+            writer.write(_response(b"405 Method Not Allowed", b""))
+        elif path.split(b"?", 1)[0] != METRICS_PATH:
+            writer.write(_response(b"404 Not Found", b""))
+        else:
+            writer.write(_response(b"200 OK", render(stats, storage)))
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            asyncio.exceptions.TimeoutError, ValueError,
+            ConnectionResetError) as err:
+        LOG.warning("Invalid metrics request: %s", err)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (BrokenPipeError, ConnectionResetError) as err:
+        LOG.warning("Was not able to send metrics due to %s", err)
+
+
+def _response(status, body):
+    return (b"HTTP/1.0 " + status + b"\r\nContent-Type: " + CONTENT_TYPE +
+            b"\r\nContent-Length: " + str(len(body)).encode() +
+            b"\r\nConnection: close\r\n\r\n" + body)
@@ -1,89 +1,619 @@
 """Handler for RPC messages"""
 import asyncio
 import logging
-from kvdb import rpc
-from kvdb.exceptions import KvdbException
-from kvdb.naive_parser import parse_message
+import time
+from kvdb import binary_parser, rpc, sorted_index
+from kvdb.access_log import ACCESS_LOG
+from kvdb.exceptions import (EventsLostException, IndexDisabledException,
+                             InvalidCommandException, InvalidFrameException,
+                             InvalidKeyException, KeyNotFoundException,
+                             KvdbException, SaveInProgressException,
+                             SnapshotsDisabledException)
+from kvdb.naive_parser import next_frame, parse_frame, parse_message
+from kvdb.pubsub import PUBSUB, Subscriber
+from kvdb.slowlog import SLOWLOG
+from kvdb.stats import STATS
+from kvdb.tracking import TRACKING, pusher
+from kvdb.watch import WATCH
 
 LOG = logging.getLogger(__name__)
 REQUEST_TIMEOUT = 200
+READ_BUFFER_SIZE = 64 * 1024
+# Longest command kept while waiting for its end, enough for the largest
+# value of the binary framing.
+MAX_LINE_LENGTH = 512 * 1024 * 1024
+# Errors of the requests, that are expected while serving, unlike faults
+# of the server, like an unreachable worker.
+CLIENT_ERRORS = (InvalidCommandException, InvalidKeyException,
+                 KeyNotFoundException, IndexDisabledException,
+                 SnapshotsDisabledException, SaveInProgressException,
+                 EventsLostException)
+# Commands that would only see the keys or the subscribers
+# of the worker serving them.
+LOCAL_COMMANDS = (rpc.SCAN_CURSOR, rpc.PUBLISH)
+STREAMED_COMMANDS = (rpc.RANGE, rpc.SCAN)
+# Number of keys in a chunk of a streamed response.
+STREAM_CHUNK_SIZE = 1000
+# Commands allowed on a connection subscribed to channels or watching
+# prefixes, whose responses can be told apart from the pushed lines.
+SUBSCRIBED_COMMANDS = (b"SUBSCRIBE ", b"UNSUBSCRIBE ", b"UNSUBSCRIBE",
+                       b"WATCH ", b"UNWATCH ", b"UNWATCH")
 
 
-async def handler(reader, writer, storage):
-    """Routes messages to the specific handlers, and handles error scenarios"""
-    connection_getting_reused = False
-    first_message_parsed = True
-    while connection_getting_reused or first_message_parsed:
-        first_message_parsed = False
-        try:
-            end_bytes = rpc.encode_response_message(
-                rpc.NEWLINE) if connection_getting_reused else None
-
-            message = await asyncio.wait_for(parse_message(reader, end_bytes),
-                                             REQUEST_TIMEOUT)
-            LOG.info("%s", message)
-            match message[0]:
-                case rpc.DELETE:
-                    _delete_handler(message, writer, storage)
-                case rpc.GET:
-                    _get_handler(message, writer, storage)
-                case rpc.SET:
-                    _set_handler(message, writer, storage)
-                case rpc.REUSECONN:
-                    LOG.info("Upgrading connection for multiple commands")
-                    _reuseconn_handler(writer)
-                    connection_getting_reused = True
-                case "CLOSE":
-                    LOG.info("Connection closed by client")
-                    break
-            await writer.drain()
-        except KvdbException as err:
-            LOG.warning(err.rpc_message)
-            writer.write(err.rpc_message.encode() +
-                         rpc.encode_response_message(
-                rpc.NEWLINE))
-        except asyncio.exceptions.TimeoutError as err:
-            LOG.error(err)
-            LOG.error("Terminating connection due to timeout")
-            writer.write(rpc.TIMEOUT_ERROR.encode())
-            break
-        except ConnectionResetError as err:
-            LOG.error(err)
-            break
-        # pylint: disable-next=broad-exception-caught
-        except Exception as err:
-            LOG.error(err)
-            writer.write(KvdbException().rpc_message.encode())
+class Session():
+    """State of a reused connection."""
+
+    def __init__(self, transport) -> None:
+        self.transport = transport
+        # Client whose reads are tracked, if TRACKING was sent.
+        self.tracking_id = None
+        # Subscriptions and watched prefixes of the connection,
+        # once SUBSCRIBE or WATCH was sent.
+        self.subscriber = None
+
+    def is_subscribed(self):
+        """Checks if the connection is subscribed to any channel,
+          or watches any prefix."""
+        return self.subscriber is not None and bool(
+            self.subscriber.channels or self.subscriber.prefixes)
+
+    def close(self):
+        """Drops the subscriptions and watches of the closed connection."""
+        if self.subscriber is not None:
+            PUBSUB.unsubscribe(self.subscriber)
+            WATCH.unwatch(self.subscriber)
+
+    def get_subscriber(self):
+        """Returns the subscriber of the connection, creating it
+          on the first subscription."""
+        if self.subscriber is None:
+            self.subscriber = Subscriber(self.transport, PUBSUB.output_limit)
+        return self.subscriber
+
+
+async def handler(reader, writer, storage, forwarder=None, peer=False):
+    """Routes messages to the specific handlers, and handles error scenarios.
+        Commands on keys owned by other workers are sent to the forwarder.
+        Binary connections of peer workers, that forward commands, are kept
+        open while they are idle."""
+    binary_framing = False
+    STATS.connected()
+    try:
+        message = await asyncio.wait_for(parse_message(reader, None),
+                                         REQUEST_TIMEOUT)
+        if ACCESS_LOG.enabled:
+            ACCESS_LOG.record(message)
+        match message[0]:
+            case rpc.REUSECONN:
+                LOG.info("Upgrading connection for multiple commands")
+                writer.write(_encode_response(_reuseconn_handler(), False))
+                await writer.drain()
+                await _pipelined_handler(reader, writer, storage, forwarder)
+            case rpc.BINARY:
+                LOG.info("Upgrading connection to binary framing")
+                # The handshake itself is answered in text framing.
+                writer.write(_encode_response(_reuseconn_handler(), False))
+                await writer.drain()
+                binary_framing = True
+                await _binary_handler(reader, writer, storage, forwarder,
+                                      None if peer else REQUEST_TIMEOUT)
+            case rpc.INVALIDATIONS:
+                await _invalidations_handler(reader, writer, forwarder)
+            case "CLOSE":
+                LOG.info("Connection closed by client")
+            case _:
+                await _send(writer, [await _execute_routed(
+                    message, storage, forwarder, False)])
+    except KvdbException as err:
+        _log_error(err)
+        writer.write(_encode_error(err.rpc_message, binary_framing))
+    except asyncio.exceptions.TimeoutError as err:
+        LOG.error(err)
+        LOG.error("Terminating connection due to timeout")
+        writer.write(_encode_error(rpc.TIMEOUT_ERROR, binary_framing,
+                                   newline=False))
+    except ConnectionResetError as err:
+        LOG.error(err)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        LOG.error(err)
+        writer.write(_encode_error(KvdbException().rpc_message,
+                                   binary_framing, newline=False))
     try:
         await writer.drain()
         writer.close()
         await writer.wait_closed()
     except (BrokenPipeError, ConnectionResetError) as err:
         LOG.error("Was not able to send message due to %s", err)
+    STATS.disconnected()
+
+
+async def _pipelined_handler(reader, writer, storage, forwarder):
+    """Executes every complete command that arrived so far,
+      and sends all of their responses with a single write.
+      A streamed response is sent before the next command is executed."""
+    end_bytes = rpc.encode_response_message(rpc.NEWLINE)
+    buffer = bytearray()
+    session = Session(writer.transport)
+    try:
+        while True:
+            # Subscribers wait for messages and events without sending
+            # anything.
+            data = await asyncio.wait_for(
+                reader.read(READ_BUFFER_SIZE),
+                None if session.is_subscribed() else REQUEST_TIMEOUT)
+            if not data:
+                LOG.info("Connection closed by client")
+                return
+            buffer += data
+            responses = []
+            offset = 0
+            while (frame := next_frame(buffer, offset, end_bytes)) \
+                    is not None:
+                command, body, offset = frame
+                if responses and command in SUBSCRIBED_COMMANDS:
+                    # Sends the earlier responses before anything is pushed.
+                    await _send(writer, responses)
+                    responses = []
+                response = execute_pipelined_frame(command, body, storage,
+                                                   session, forwarder)
+                responses.append(response)
+                if not isinstance(response, (bytes, asyncio.Future)):
+                    # The commands after a streamed response are executed
+                    # once it is sent, so they don't change its keys.
+                    await _send(writer, responses)
+                    responses = []
+            del buffer[:offset]
+            if responses:
+                await _send(writer, responses)
+            _raise_line_too_long(len(buffer))
+    finally:
+        session.close()
+
+
+async def _send(writer, responses):
+    """Writes the responses in order, with as few writes as possible.
+      Responses of forwarded commands are awaited, and streamed responses
+      are written chunk by chunk, draining after every chunk."""
+    pending = []
+    for response in responses:
+        if isinstance(response, bytes):
+            pending.append(response)
+        elif isinstance(response, asyncio.Future):
+            pending.append(await response)
+        else:
+            if pending:
+                writer.write(b''.join(pending))
+                pending.clear()
+            for chunk in response:
+                writer.write(chunk)
+                await writer.drain()
+    if pending:
+        writer.write(b''.join(pending))
+        await writer.drain()
+
+
+async def _binary_handler(reader, writer, storage, forwarder, timeout):
+    while True:
+        try:
+            message = await asyncio.wait_for(
+                binary_parser.parse_message(reader), timeout)
+        except InvalidFrameException:
+            raise
+        except KvdbException as err:
+            _log_error(err)
+            writer.write(_encode_error(err.rpc_message, True))
+            continue
+        if ACCESS_LOG.enabled:
+            ACCESS_LOG.record(message)
+        if message[0] == "CLOSE":
+            LOG.info("Connection closed by client")
+            return
+        writer.write(await _execute_routed(message, storage, forwarder, True))
+        await writer.drain()
+
+
+async def _invalidations_handler(reader, writer, forwarder):
+    """Registers a tracking client, and pushes the invalidations of the keys
+      it reads until it closes the connection. The handshake is answered
+      with the id of the client on a second line."""
+    # Keys read from a worker may be modified by an other one.
+    if forwarder is not None:
+        raise InvalidCommandException()
+    LOG.info("Upgrading connection to push invalidations")
+    client_id = TRACKING.register(pusher(writer.write))
+    try:
+        writer.write(_encode_response(_reuseconn_handler(), False) +
+                     _encode_response(str(client_id).encode(), False))
+        await writer.drain()
+        # Nothing is expected from the client, until it closes.
+        while await reader.read(READ_BUFFER_SIZE):
+            pass
+        LOG.info("Connection closed by client")
+    finally:
+        TRACKING.unregister(client_id)
+
+
+def execute_pipelined_frame(command, body, storage, session,
+                            forwarder=None):
+    """Executes a complete command of a reused connection, with the commands
+      changing the state of the connection: TRACKING <id> makes the server
+      track the keys read by GET for the client, SUBSCRIBE and UNSUBSCRIBE
+      change the channels whose messages are sent on the connection.
+      Returns the response, like execute_frame."""
+    try:
+        if session.is_subscribed() and command not in SUBSCRIBED_COMMANDS:
+            raise InvalidCommandException()
+        match command:
+            case b"TRACKING ":
+                # Keys read from a worker may be modified by an other one.
+                if forwarder is not None:
+                    raise InvalidCommandException()
+                session.tracking_id = TRACKING.client_id(body)
+                return _encode_response(_reuseconn_handler(), False)
+            case b"SUBSCRIBE " | b"UNSUBSCRIBE " | b"UNSUBSCRIBE":
+                return _subscription_handler(command, body, session,
+                                             forwarder)
+            case b"WATCH " | b"UNWATCH " | b"UNWATCH":
+                return _watch_handler(command, body, session, forwarder)
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, False)
+    if session.tracking_id is not None and command == b"GET " and body:
+        # Tracked before it is read, so a modification in between
+        # is pushed too.
+        TRACKING.track(session.tracking_id, body)
+    return execute_frame(command, body, storage, forwarder)
+
+
+def _subscription_handler(command, body, session, forwarder):
+    """Responds with SUBSCRIBE or UNSUBSCRIBE and the number of channels
+      the connection is subscribed to. UNSUBSCRIBE without channels
+      unsubscribes from every channel."""
+    # Messages are only published to the subscribers of the same worker.
+    if forwarder is not None:
+        raise InvalidCommandException()
+    channels = None if body is None else body.split(b' ')
+    if channels is not None and not all(channels):
+        raise InvalidKeyException()
+    if command == b"SUBSCRIBE ":
+        count = PUBSUB.subscribe(session.get_subscriber(), channels)
+        response = rpc.SUBSCRIBE
+    else:
+        count = 0 if session.subscriber is None else \
+            PUBSUB.unsubscribe(session.subscriber, channels)
+        response = rpc.UNSUBSCRIBE
+    return _encode_response(f"{response} {count}".encode(), False)
+
+
+def _watch_handler(command, body, session, forwarder):
+    """Responds to WATCH <prefix> [<sequence>] with WATCH and the sequence
+      number of the last event, followed by the kept events after the given
+      sequence number, and to UNWATCH [<prefix> ...] with UNWATCH and the
+      number of prefixes left. UNWATCH without prefixes stops every watch."""
+    # Every worker numbers the modifications of its own keys.
+    if forwarder is not None:
+        raise InvalidCommandException()
+    if command == b"WATCH ":
+        prefix, _, since = body.partition(b' ')
+        if since and not since.isdigit():
+            raise InvalidCommandException()
+        sequence, replayed = WATCH.watch(session.get_subscriber(), prefix,
+                                         int(since) if since else None)
+        return _encode_response(f"{rpc.WATCH} {sequence}".encode(), False) \
+            + b''.join(replayed)
+    count = 0 if session.subscriber is None else \
+        WATCH.unwatch(session.subscriber,
+                      None if body is None else body.split(b' '))
+    return _encode_response(f"{rpc.UNWATCH} {count}".encode(), False)
+
+
+def execute_frame(command, body, storage, forwarder=None):
+    """Parses and executes a complete text command,
+      and returns its encoded response. If the command is forwarded
+      to an other worker, returns a task resolving to the response.
+      Streamed responses are returned as an iterator of chunks."""
+    try:
+        message = parse_frame(command, body)
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, False)
+    if ACCESS_LOG.enabled:
+        ACCESS_LOG.record(message)
+    if message[0] == rpc.REUSECONN:
+        return _encode_response(_reuseconn_handler(), False)
+    if forwarder is not None and message[0] in LOCAL_COMMANDS:
+        return _encode_error(rpc.INVALID_COMMAND, False)
+    if forwarder is not None and forwarder.forwards(message):
+        return asyncio.ensure_future(_route(message, storage, forwarder,
+                                            False))
+    if message[0] in STREAMED_COMMANDS:
+        return stream_response(message, storage)
+    return execute_and_encode(message, storage, False)
+
+
+def execute_binary_frame(opcode, key, value, storage):
+    """Parses and executes a complete binary frame,
+      and returns its encoded response."""
+    try:
+        message = binary_parser.parse_frame(opcode, key, value)
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, True)
+    if ACCESS_LOG.enabled:
+        ACCESS_LOG.record(message)
+    return execute_and_encode(message, storage, True)
+
+
+async def _execute_routed(message, storage, forwarder, binary_framing):
+    if forwarder is not None and message[0] in LOCAL_COMMANDS:
+        return _encode_error(rpc.INVALID_COMMAND, binary_framing)
+    if forwarder is not None and forwarder.forwards(message):
+        return await _route(message, storage, forwarder, binary_framing)
+    if message[0] in STREAMED_COMMANDS:
+        return stream_response(message, storage)
+    return execute_and_encode(message, storage, binary_framing)
+
+
+def _route(message, storage, forwarder, binary_framing):
+    """Executes the local part of a forwarded command, and sends the rest
+      to the workers owning its keys before returning, so the commands of
+      a connection reach every worker in order. Returns the awaitable
+      encoded response."""
+    try:
+        match message[0]:
+            case rpc.MGET:
+                pending = forwarder.get_many(storage, message[1])
+            case rpc.MSET:
+                pending = forwarder.set_many(storage, message[1])
+            case rpc.MDELETE:
+                pending = forwarder.delete_many(storage, message[1])
+            case _:
+                pending = forwarder.forward(message)
+    except KvdbException as err:
+        pending = asyncio.get_running_loop().create_future()
+        pending.set_exception(err)
+    return _routed_response(message[0], pending, binary_framing)
+
+
+async def _routed_response(command, pending, binary_framing):
+    try:
+        result = await pending
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, binary_framing)
+    match command:
+        case rpc.MGET:
+            return _encode_response(_encode_values(result), binary_framing)
+        case rpc.MSET | rpc.MDELETE:
+            return _encode_response(rpc.encode_response_message(rpc.OK),
+                                    binary_framing)
+    status, payload = result
+    if status == binary_parser.STATUS_OK:
+        return _encode_response(payload, binary_framing)
+    return _encode_error(payload.decode(), binary_framing)
+
+
+def execute_and_encode(message, storage, binary_framing):
+    """Executes a parsed command, and returns its encoded response,
+      or the encoded error if the command failed."""
+    start = time.perf_counter_ns()
+    try:
+        return _encode_response(execute(message, storage), binary_framing)
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, binary_framing)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as err:
+        LOG.error(err)
+        return _encode_error(KvdbException().rpc_message, binary_framing)
+    finally:
+        duration = time.perf_counter_ns() - start
+        STATS.record(message[0], duration)
+        if duration > SLOWLOG.threshold_ns:
+            SLOWLOG.add(message, duration)
+
+
+def stream_response(message, storage):
+    """Executes a scan, and returns the iterator of the chunks of its
+      response: the keys one per line, closed by an empty line.
+      Every chunk is read from the storage when it is sent, so the keys
+      of a large scan are never held in memory at once."""
+    if message[0] == rpc.SCAN:
+        start, end = message[1], sorted_index.prefix_end(message[1])
+    else:
+        start, end = message[1], message[2]
+    limit = message[-1]
+    # Only the first chunk is timed, the rest is read as it is sent.
+    started = time.perf_counter_ns()
+    try:
+        first_chunk = storage.range(start, end, _chunk_size(limit))
+    except KvdbException as err:
+        _log_error(err)
+        return _encode_error(err.rpc_message, False)
+    finally:
+        duration = time.perf_counter_ns() - started
+        STATS.record(message[0], duration)
+        if duration > SLOWLOG.threshold_ns:
+            SLOWLOG.add(message, duration)
+    return _stream_chunks(storage, first_chunk, end, limit)
+
+
+def _stream_chunks(storage, keys, end, limit):
+    newline = rpc.encode_response_message(rpc.NEWLINE)
+    while keys:
+        yield newline.join(keys) + newline
+        if limit is not None:
+            limit -= len(keys)
+            if limit == 0:
+                break
+        keys = storage.range(keys[-1] + b'\x00', end, _chunk_size(limit))
+    yield newline
+
+
+def _chunk_size(limit):
+    return STREAM_CHUNK_SIZE if limit is None \
+        else min(limit, STREAM_CHUNK_SIZE)
+
+
+def execute(message, storage):
+    """Executes a parsed storage command and returns the response payload."""
+    command_handler = _COMMAND_HANDLERS.get(message[0])
+    if command_handler is None:
+        raise InvalidCommandException()
+    return command_handler(message, storage)
+
+
+def _encode_response(payload, binary_framing):
+    if binary_framing:
+        return binary_parser.encode_response(payload)
+    return payload + rpc.encode_response_message(rpc.NEWLINE)
 
 
-def _get_handler(message, writer, storage):
-    value = storage.get(message[1])
-    writer.write(value + rpc.encode_response_message(
-                rpc.NEWLINE))
-    LOG.info("Sending %s", value[0:64])
+def _raise_line_too_long(length):
+    """Fails a connection sending an unterminated command longer than
+      MAX_LINE_LENGTH, instead of buffering it without a limit."""
+    if length > MAX_LINE_LENGTH:
+        LOG.error("Terminating connection due to a command of over %s bytes",
+                  MAX_LINE_LENGTH)
+        raise InvalidFrameException()
 
 
-def _set_handler(message, writer: asyncio.StreamWriter, storage):
-    storage.set(message[1], message[2])
-    writer.write(rpc.OK.encode() + rpc.encode_response_message(
-                rpc.NEWLINE))
-    LOG.info("Sending %s", rpc.OK)
+def _log_error(err):
+    """Logs a failed request. Client errors are only logged at debug level,
+      they would slow down every request on missing keys otherwise."""
+    if isinstance(err, CLIENT_ERRORS):
+        LOG.debug(err.rpc_message)
+    else:
+        LOG.warning(err.rpc_message)
 
 
-def _delete_handler(message, writer, storage):
+def _encode_error(rpc_message, binary_framing, newline=True):
+    if binary_framing:
+        return binary_parser.encode_error(rpc_message)
+    if newline:
+        return rpc_message.encode() + rpc.encode_response_message(rpc.NEWLINE)
+    return rpc_message.encode()
+
+
+def _encode_values(values):
+    """Encodes the values of a batch, one per line."""
+    missing = rpc.encode_response_message(rpc.KEY_NOT_FOUND)
+    return rpc.encode_response_message(rpc.NEWLINE).join(
+        missing if value is None else value for value in values)
+
+
+def _get_handler(message, storage):
+    try:
+        value = storage.get(message[1])
+    except KeyNotFoundException:
+        STATS.keyspace_misses += 1
+        raise
+    STATS.keyspace_hits += 1
+    return value
+
+
+def _set_handler(message, storage):
+    storage.set(*message[1:])
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _delete_handler(message, storage):
     storage.delete(message[1])
-    writer.write(rpc.OK.encode() + rpc.encode_response_message(
-                rpc.NEWLINE))
-    LOG.info("Sending %s", rpc.OK)
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _expire_handler(message, storage):
+    storage.expire(message[1], message[2])
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _expireat_handler(message, storage):
+    storage.expire_at(message[1], message[2])
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _mget_handler(message, storage):
+    return _encode_values(storage.get_many(message[1]))
+
+
+def _mset_handler(message, storage):
+    storage.set_many(message[1])
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _mdelete_handler(message, storage):
+    storage.delete_many(message[1])
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _scan_cursor_handler(message, storage):
+    """Responds with the next cursor, then the keys one per line,
+    closed by an empty line."""
+    cursor, keys = storage.scan(message[1], message[2])
+    newline = rpc.encode_response_message(rpc.NEWLINE)
+    return b''.join(key + newline for key in [str(cursor).encode(), *keys])
+
+
+def _save_handler(_, storage):
+    storage.save()
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _bgsave_handler(_, storage):
+    storage.bgsave()
+    return rpc.encode_response_message(rpc.OK)
+
+
+def _info_handler(_, storage):
+    """Responds with the metrics of the server, closed by an empty line."""
+    return STATS.info(storage)
+
+
+def _slowlog_handler(message, _):
+    """Responds to SLOWLOG GET with the entries one per line, closed by
+    an empty line, the key is the last field, escaped like a bytes literal."""
+    match message[1]:
+        case "LEN":
+            return str(len(SLOWLOG.entries)).encode()
+        case "RESET":
+            SLOWLOG.reset()
+            return rpc.encode_response_message(rpc.OK)
+    newline = rpc.encode_response_message(rpc.NEWLINE)
+    return b''.join(
+        f"{entry_id} {timestamp:.6f} {microseconds} {command} {value_size} "
+        f"{_escape(key)}".encode() + newline
+        for entry_id, timestamp, microseconds, command, key, value_size
+        in SLOWLOG.get(message[2]))
+
+
+def _escape(key):
+    if isinstance(key, bytes):
+        return repr(key)[2:-1]
+    return key
+
+
+def _publish_handler(message, _):
+    return str(PUBSUB.publish(message[1], message[2])).encode()
+
+
+def _reuseconn_handler():
+    return rpc.encode_response_message(rpc.OK)
 
 
-def _reuseconn_handler(writer):
-    writer.write(rpc.OK.encode() + rpc.encode_response_message(
-                rpc.NEWLINE))
-    LOG.info("Sending %s", rpc.OK)
+_COMMAND_HANDLERS = {
+    rpc.GET: _get_handler,
+    rpc.SET: _set_handler,
+    rpc.DELETE: _delete_handler,
+    rpc.EXPIRE: _expire_handler,
+    rpc.EXPIREAT: _expireat_handler,
+    rpc.MGET: _mget_handler,
+    rpc.MSET: _mset_handler,
+    rpc.MDELETE: _mdelete_handler,
+    rpc.SCAN_CURSOR: _scan_cursor_handler,
+    rpc.SAVE: _save_handler,
+    rpc.BGSAVE: _bgsave_handler,
+    rpc.INFO: _info_handler,
+    rpc.SLOWLOG: _slowlog_handler,
+    rpc.PUBLISH: _publish_handler,
+}
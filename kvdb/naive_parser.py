@@ -1,9 +1,13 @@
 """Parser for the KVDB RPC commands."""
 import asyncio
 import logging
+from kvdb import expiry, rpc
 from .exceptions import InvalidCommandException, InvalidKeyException
 LOG = logging.getLogger(__name__)
 
+# Commands that are not followed by arguments or closing bytes.
+_STANDALONE_COMMANDS = (b"REUSECONN ", b"BINARY ", b"INVALIDATIONS ")
+
 
 async def parse_message(reader: asyncio.StreamReader, end_bytes=None):
     """Parses a command from the incoming TCP stream.
@@ -11,55 +15,235 @@ async def parse_message(reader: asyncio.StreamReader, end_bytes=None):
             By default it reads until EOF."""
     try:
         if reader.at_eof():
-            return await _parse_close()
-        command = await reader.readuntil(b' ')
-        match command:
-            case b"REUSECONN ":
-                return await _parse_reuseconn()
-            case b"SET ":
-                return await _parse_set(reader, end_bytes)
-            case b"DELETE ":
-                return await _parse_delete(reader, end_bytes)
-            case b"GET ":
-                return await _parse_get(reader, end_bytes)
-            case _:
-                LOG.error("Command %s is invalid", command)
-                raise InvalidCommandException()
+            return _parse_close()
+        try:
+            command = await reader.readuntil(b' ')
+        except asyncio.IncompleteReadError as exc:
+            # Commands without arguments are closed by EOF.
+            return parse_frame(exc.partial, None)
+        if command in _STANDALONE_COMMANDS:
+            return parse_frame(command, None)
+        body = await _read_until_end_bytes(reader, end_bytes)
+        return parse_frame(command, body)
     except EOFError as exc:
         raise InvalidCommandException() from exc
 
 
-async def _parse_set(reader, end_bytes):
-    key = await reader.readuntil(b' ')
-    key = key[:-1]
+def next_frame(buffer: bytearray, start, end_bytes, length=None):
+    """Finds the next complete command in a buffer of pipelined commands.
+        Only the first length bytes of the buffer are considered,
+        by default the whole buffer.
+        Returns the command, its arguments and the offset after the command,
+        or None if the buffer doesn't hold a complete command yet."""
+    if length is None:
+        length = len(buffer)
+    end = buffer.find(end_bytes, start, length)
+    command_end = buffer.find(b' ', start, length if end == -1 else end)
+    with memoryview(buffer) as view:
+        if command_end == -1:
+            if end == -1:
+                return None
+            return (bytes(view[start:end]), None, end + len(end_bytes))
+        command = bytes(view[start:command_end + 1])
+        if command in _STANDALONE_COMMANDS:
+            return (command, None, command_end + 1)
+        if end == -1:
+            return None
+        return (command, bytes(view[command_end + 1:end]),
+                end + len(end_bytes))
+
+
+def parse_frame(command: bytes, body):
+    """Parses the arguments of a command that is already read in full."""
+    parser = _PARSERS.get(command)
+    if parser is None:
+        LOG.debug("Command %s is invalid", command)
+        raise InvalidCommandException()
+    return parser(body)
+
+
+def _parse_set(body):
+    key, separator, value = body.partition(b' ')
+    if not separator:
+        raise InvalidCommandException()
     if len(key) == 0:
         raise InvalidKeyException()
-    value = await _read_until_end_bytes(reader, end_bytes)
-    return ("SET", key, value)
+    return (rpc.SET, key, value)
+
+
+def _parse_setex(body):
+    # The time to live comes before the value, that can contain spaces.
+    key, arguments = _parse_key_and_argument(body)
+    ttl, separator, value = arguments.partition(b' ')
+    if not separator:
+        raise InvalidCommandException()
+    return (rpc.SET, key, value, expiry.parse_ttl(ttl))
 
 
-async def _parse_delete(reader, end_bytes):
-    key = await _read_until_end_bytes(reader, end_bytes)
+def _parse_expire(body):
+    key, ttl = _parse_key_and_argument(body)
+    return (rpc.EXPIRE, key, expiry.parse_ttl(ttl))
+
+
+def _parse_expireat(body):
+    key, deadline = _parse_key_and_argument(body)
+    return (rpc.EXPIREAT, key, expiry.parse_deadline(deadline))
+
+
+def _parse_key_and_argument(body):
+    key, separator, argument = body.partition(b' ')
+    if not separator:
+        raise InvalidCommandException()
     if len(key) == 0:
         raise InvalidKeyException()
-    return ("DELETE", key)
+    return key, argument
 
 
-async def _parse_get(reader, end_bytes):
-    key = await _read_until_end_bytes(reader, end_bytes)
-    if len(key) == 0:
+def _parse_delete(body):
+    if len(body) == 0:
+        raise InvalidKeyException()
+    return (rpc.DELETE, body)
+
+
+def _parse_get(body):
+    if len(body) == 0:
+        raise InvalidKeyException()
+    return (rpc.GET, body)
+
+
+def _parse_mget(body):
+    return (rpc.MGET, _parse_keys(body))
+
+
+def _parse_mdelete(body):
+    return (rpc.MDELETE, _parse_keys(body))
+
+
+def _parse_keys(body):
+    keys = body.split(b' ')
+    if not all(keys):
+        raise InvalidKeyException()
+    return keys
+
+
+def _parse_mset(body):
+    arguments = body.split(b' ')
+    if len(arguments) % 2:
+        raise InvalidCommandException()
+    items = dict(zip(arguments[::2], arguments[1::2]))
+    if not all(items):
+        raise InvalidKeyException()
+    return (rpc.MSET, items)
+
+
+def _parse_range(body):
+    arguments = body.split(b' ')
+    if len(arguments) < 2:
+        raise InvalidCommandException()
+    start, end = arguments[:2]
+    if len(start) == 0 or len(end) == 0:
         raise InvalidKeyException()
-    return ("GET", key)
+    return (rpc.RANGE, start, end, _parse_limit(arguments[2:]))
+
+
+def _parse_scan(body):
+    """Parses both SCAN prefix [LIMIT n] and SCAN cursor COUNT n."""
+    arguments = body.split(b' ')
+    if len(arguments) == 3 and arguments[1] == b"COUNT":
+        return _parse_scan_cursor(arguments[0], arguments[2])
+    if len(arguments[0]) == 0:
+        raise InvalidKeyException()
+    return (rpc.SCAN, arguments[0], _parse_limit(arguments[1:]))
+
+
+def _parse_scan_cursor(cursor, count):
+    if not cursor.isdigit() or not count.isdigit() or int(count) < 1:
+        raise InvalidCommandException()
+    return (rpc.SCAN_CURSOR, int(cursor), int(count))
 
 
-async def _parse_reuseconn():
-    return ("REUSECONN", None)
+def _parse_limit(arguments):
+    """Parses the optional LIMIT n of the scans, None if it is missing."""
+    if not arguments:
+        return None
+    if len(arguments) != 2 or arguments[0] != b"LIMIT" \
+            or not arguments[1].isdigit() or int(arguments[1]) < 1:
+        raise InvalidCommandException()
+    return int(arguments[1])
 
 
-async def _parse_close():
+def _parse_publish(body):
+    channel, separator, payload = body.partition(b' ')
+    if not separator:
+        raise InvalidCommandException()
+    if len(channel) == 0:
+        raise InvalidKeyException()
+    return (rpc.PUBLISH, channel, payload)
+
+
+def _parse_close():
     return ("CLOSE", None)
 
 
+def _parse_save(_):
+    return (rpc.SAVE, None)
+
+
+def _parse_bgsave(_):
+    return (rpc.BGSAVE, None)
+
+
+def _parse_info(_):
+    return (rpc.INFO, None)
+
+
+def _parse_slowlog(body):
+    """Parses SLOWLOG GET [n], SLOWLOG LEN and SLOWLOG RESET."""
+    match body.split(b' '):
+        case [b"GET"]:
+            return (rpc.SLOWLOG, "GET", None)
+        case [b"GET", count] if count.isdigit():
+            return (rpc.SLOWLOG, "GET", int(count))
+        case [b"LEN" | b"RESET" as subcommand]:
+            return (rpc.SLOWLOG, subcommand.decode(), None)
+    raise InvalidCommandException()
+
+
+def _parse_reuseconn(_):
+    return (rpc.REUSECONN, None)
+
+
+def _parse_binary(_):
+    return (rpc.BINARY, None)
+
+
+def _parse_invalidations(_):
+    return (rpc.INVALIDATIONS, None)
+
+
+_PARSERS = {
+    b"REUSECONN ": _parse_reuseconn,
+    b"BINARY ": _parse_binary,
+    b"INVALIDATIONS ": _parse_invalidations,
+    b"SET ": _parse_set,
+    b"SETEX ": _parse_setex,
+    b"DELETE ": _parse_delete,
+    b"GET ": _parse_get,
+    b"EXPIRE ": _parse_expire,
+    b"EXPIREAT ": _parse_expireat,
+    b"MGET ": _parse_mget,
+    b"MSET ": _parse_mset,
+    b"MDELETE ": _parse_mdelete,
+    b"RANGE ": _parse_range,
+    b"SCAN ": _parse_scan,
+    b"SAVE": _parse_save,
+    b"BGSAVE": _parse_bgsave,
+    b"INFO": _parse_info,
+    b"SLOWLOG ": _parse_slowlog,
+    b"PUBLISH ": _parse_publish,
+}
+
+
 async def _read_until_end_bytes(reader:  asyncio.StreamReader, end_bytes=None):
     if end_bytes is not None:
         read_bytes = await reader.readuntil(end_bytes)
@@ -1,32 +1,278 @@
 """Simple set based storage for kvdb."""
-from kvdb.exceptions import InvalidKeyException, KeyNotFoundException
+import asyncio
+import time
+from kvdb import eviction, expiry, rpc
+from kvdb.exceptions import (IndexDisabledException, InvalidKeyException,
+                             KeyNotFoundException,
+                             SnapshotsDisabledException)
+from kvdb.cursor import CursorTable
+from kvdb.sorted_index import SortedIndex
+from kvdb.tracking import TRACKING
+from kvdb.watch import WATCH
+
+_MISSING = object()
 
 
 class NaiveStorage():
     """Simple set based storage for kvdb."""
+    # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, init_dict=None) -> None:
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self, init_dict=None, aof=None, snapshotter=None,
+                 deadlines=None, maxmemory=None,
+                 eviction_policy=eviction.LRU, sorted_index=False,
+                 cursor_table=False) -> None:
         if init_dict:
             self.dict = init_dict
         else:
             self.dict = {}
+        # Append-only file logging the mutations, if persistence is enabled.
+        self.aof = aof
+        # Saves snapshots of the contents, if snapshots are enabled.
+        self.snapshotter = snapshotter
+        # Deadlines of the keys with a time to live.
+        self.expiry = expiry.Expiry(deadlines)
+        self._sweeper_task = None
+        # Keys in order, if range and prefix scans are enabled.
+        self.index = SortedIndex(self.dict) if sorted_index else None
+        # Keys in buckets, if iterating the keyspace with a cursor is enabled.
+        self.cursor_table = CursorTable(self.dict) if cursor_table else None
+        # Memory limit in bytes, and the policy choosing the evicted keys.
+        self.maxmemory = maxmemory
+        self.eviction = None
+        self.used_memory = 0
+        if self.cursor_table is not None:
+            self.used_memory = self.cursor_table.size
+        self.evicted_keys = 0
+        if maxmemory is not None:
+            self.eviction = eviction.create_policy(eviction_policy)
+        for key, value in self.dict.items():
+            self.used_memory += eviction.entry_size(key, value)
+            if self.eviction is not None:
+                self.eviction.added(key)
+        self._evict_if_needed()
+
+    def __len__(self):
+        return len(self.dict)
 
     def get(self, key):
         """Get value from db."""
         self._raise__key_invalid(key)
+        self._expire_if_needed(key)
         self._raise_key_not_found(key)
+        if self.eviction is not None:
+            self.eviction.accessed(key)
         return self.dict[key]
 
-    def set(self, key, value):
-        """Set value in db."""
+    def set(self, key, value, ttl=None):
+        """Set value in db, expiring after ttl seconds if it is given.
+        Setting a value without ttl clears the previous time to live."""
         self._raise__key_invalid(key)
-        self.dict[key] = value
+        self._store(key, value)
+        if self.aof is not None:
+            self.aof.log_set(key, value)
+        if ttl is not None:
+            self._set_deadline(key, time.time() + ttl)
+        elif self.expiry.deadlines:
+            self.expiry.clear(key)
+        self._evict_if_needed((key,))
 
     def delete(self, key):
         """Delete value from db."""
         self._raise__key_invalid(key)
+        self._expire_if_needed(key)
+        self._raise_key_not_found(key)
+        self._remove(key)
+        if self.aof is not None:
+            self.aof.log_delete(key)
+
+    def expire(self, key, ttl):
+        """Expire an existing value after ttl seconds."""
+        self.expire_at(key, time.time() + ttl)
+
+    def expire_at(self, key, deadline):
+        """Expire an existing value at a unix timestamp."""
+        self._raise__key_invalid(key)
+        self._expire_if_needed(key)
         self._raise_key_not_found(key)
-        del self.dict[key]
+        self._set_deadline(key, deadline)
+
+    def delete_expired(self, limit):
+        """Delete at most limit values whose time to live has passed.
+        Returns whether more of them are left."""
+        expired, more_left = self.expiry.pop_expired(limit)
+        for key in expired:
+            self._delete_expired(key)
+        return more_left
+
+    def range(self, start, end, limit):
+        """Get at most limit keys from start, inclusive, to end, exclusive,
+        in order. An end of None is unbounded."""
+        if self.index is None:
+            raise IndexDisabledException()
+        keys = []
+        while len(keys) < limit:
+            batch = self.index.range(start, end, limit - len(keys))
+            if not batch:
+                break
+            # The successor of the last key in the byte order.
+            start = batch[-1] + b'\x00'
+            for key in batch:
+                if self.expiry.deadlines and self.expiry.is_expired(key):
+                    self._delete_expired(key)
+                else:
+                    keys.append(key)
+        return keys
+
+    def scan(self, cursor, count):
+        """Get about count keys starting at the cursor,
+        and the cursor to continue from, 0 when every key is returned.
+        Every key present during the whole iteration is returned."""
+        if self.cursor_table is None:
+            raise IndexDisabledException()
+        cursor, keys = self.cursor_table.scan(cursor, count)
+        if self.expiry.deadlines:
+            for key in keys:
+                self._expire_if_needed(key)
+            keys = [key for key in keys if key in self.dict]
+        return cursor, keys
+
+    def start_expiry(self):
+        """Start deleting the expired values in the background,
+        unless it is already started. Has to be called from the event loop."""
+        if self._sweeper_task is None:
+            self._sweeper_task = asyncio.create_task(
+                expiry.sweep_periodically(self))
+
+    def save(self):
+        """Save a snapshot of the db, blocking until it is written."""
+        self._raise_snapshots_disabled()
+        self.snapshotter.save(self.dict, self.expiry.deadlines)
+
+    def bgsave(self):
+        """Start saving a snapshot of the db in the background."""
+        self._raise_snapshots_disabled()
+        self.snapshotter.bgsave(self.dict, self.expiry.deadlines)
+
+    def get_many(self, keys):
+        """Get values of multiple keys from db, None for missing keys."""
+        self._raise_keys_invalid(keys)
+        if self.expiry.deadlines:
+            for key in keys:
+                self._expire_if_needed(key)
+        get = self.dict.get
+        values = [get(key) for key in keys]
+        if self.eviction is not None:
+            for key, value in zip(keys, values):
+                if value is not None:
+                    self.eviction.accessed(key)
+        return values
+
+    def set_many(self, items):
+        """Set multiple values in db from a key to value mapping."""
+        self._raise_keys_invalid(items)
+        old_values = [self.dict.get(key, _MISSING) for key in items]
+        self.dict.update(items)
+        for (key, value), old_value in zip(items.items(), old_values):
+            self._stored(key, value, old_value)
+        if self.expiry.deadlines:
+            for key in items:
+                self.expiry.clear(key)
+        if self.aof is not None:
+            self.aof.log_set_many(items)
+        self._evict_if_needed(items)
+
+    def delete_many(self, keys):
+        """Delete multiple values from db, skipping missing keys.
+        Returns the number of deleted values."""
+        self._raise_keys_invalid(keys)
+        if self.expiry.deadlines:
+            for key in keys:
+                self._expire_if_needed(key)
+        deleted = [key for key in keys if self._remove(key)
+                   is not _MISSING]
+        if self.aof is not None:
+            self.aof.log_delete_many(deleted)
+        return len(deleted)
+
+    def _expire_if_needed(self, key):
+        if self.expiry.deadlines and self.expiry.is_expired(key):
+            self._delete_expired(key)
+
+    def _delete_expired(self, key):
+        self._remove(key)
+        if self.aof is not None:
+            self.aof.log_delete(key)
+
+    def _store(self, key, value):
+        old_value = self.dict.get(key, _MISSING)
+        self.dict[key] = value
+        self._stored(key, value, old_value)
+
+    def _stored(self, key, value, old_value):
+        """Updates the bookkeeping of a key just set, from its old value."""
+        if TRACKING.keys:
+            TRACKING.invalidate(key)
+        if WATCH.enabled:
+            WATCH.notify(rpc.SET, key, value)
+        if old_value is _MISSING:
+            self.used_memory += eviction.entry_size(key, value)
+            if self.eviction is not None:
+                self.eviction.added(key)
+            if self.index is not None:
+                self.index.add(key)
+            if self.cursor_table is not None:
+                self.used_memory += self.cursor_table.add(key)
+        else:
+            self.used_memory += (eviction.entry_size(key, value) -
+                                 eviction.entry_size(key, old_value))
+            if self.eviction is not None:
+                self.eviction.accessed(key)
+
+    def _remove(self, key):
+        value = self.dict.pop(key, _MISSING)
+        if value is not _MISSING:
+            if TRACKING.keys:
+                TRACKING.invalidate(key)
+            if WATCH.enabled:
+                WATCH.notify(rpc.DELETE, key)
+            self.used_memory -= eviction.entry_size(key, value)
+            self.expiry.clear(key)
+            if self.eviction is not None:
+                self.eviction.removed(key)
+            if self.index is not None:
+                self.index.remove(key)
+            if self.cursor_table is not None:
+                self.used_memory -= self.cursor_table.remove(key)
+        return value
+
+    def _evict_if_needed(self, excluded=()):
+        """Evicts keys until the memory usage is under the limit.
+        The excluded keys, that were just set, are not evicted."""
+        if self.maxmemory is None:
+            return
+        while self.used_memory > self.maxmemory:
+            victim = self.eviction.victim(excluded)
+            if victim is None:
+                return
+            self._remove(victim)
+            self.evicted_keys += 1
+            if self.aof is not None:
+                self.aof.log_delete(victim)
+
+    def _set_deadline(self, key, deadline):
+        self.expiry.set(key, deadline)
+        if self.aof is not None:
+            self.aof.log_expire_at(key, deadline)
+
+    def _raise_keys_invalid(self, keys):
+        # None and empty keys are both falsy.
+        if not all(keys):
+            raise InvalidKeyException()
+
+    def _raise_snapshots_disabled(self):
+        if self.snapshotter is None:
+            raise SnapshotsDisabledException()
 
     def _raise__key_invalid(self, key):
         if key is None or len(key) < 1:
@@ -0,0 +1,262 @@
+"""Handler for RPC messages built on asyncio.BufferedProtocol.
+
+Data is received into a preallocated per-connection buffer, commands are
+parsed in place and executed synchronously, without a coroutine
+or a future per connection or per request."""
+import asyncio
+import logging
+from kvdb import binary_parser, rpc
+from kvdb.exceptions import InvalidFrameException
+from kvdb.naive_handler import (MAX_LINE_LENGTH, REQUEST_TIMEOUT, Session,
+                                execute_binary_frame, execute_frame,
+                                execute_pipelined_frame)
+from kvdb.naive_parser import next_frame
+from kvdb.stats import STATS
+from kvdb.tracking import TRACKING, pusher
+
+LOG = logging.getLogger(__name__)
+INITIAL_BUFFER_SIZE = 64 * 1024
+
+# Waiting for the first command of the connection.
+_COMMAND = 0
+# Waiting for EOF, that closes the single message of the connection.
+_SINGLE_MESSAGE = 1
+_PIPELINED = 2
+_BINARY = 3
+# Pushing invalidations to a tracking client, ignoring what it sends.
+_INVALIDATIONS = 4
+# Modes buffering commands closed by a newline or EOF, whose length is
+# capped by MAX_LINE_LENGTH.
+_TEXT_MODES = (_COMMAND, _SINGLE_MESSAGE, _PIPELINED)
+
+
+class KvdbProtocol(asyncio.BufferedProtocol):
+    """Serves RPC messages of a single connection."""
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, storage, socket_options=None) -> None:
+        self.storage = storage
+        # Options of the accepted connection, asyncio overrides some of
+        # the ones inherited from the listening socket.
+        self._socket_options = socket_options
+        self.transport = None
+        self._loop = None
+        self._buffer = bytearray(INITIAL_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self._mode = _COMMAND
+        self._last_activity = 0
+        self._timeout_handle = None
+        # Chunks of the streamed response being sent, if there is one.
+        # Commands received in the meantime wait in the buffer.
+        self._stream = None
+        self._writing_paused = False
+        # State of a reused connection.
+        self._session = None
+        # Client registered by an invalidation connection.
+        self._tracking_id = None
+
+    def connection_made(self, transport):
+        STATS.connected()
+        self.transport = transport
+        if self._socket_options is not None:
+            self._socket_options.configure(transport)
+        self._session = Session(transport)
+        self._loop = asyncio.get_running_loop()
+        self._last_activity = self._loop.time()
+        self._timeout_handle = self._loop.call_later(REQUEST_TIMEOUT,
+                                                     self._check_timeout)
+
+    def connection_lost(self, exc):
+        STATS.disconnected()
+        if exc is not None:
+            LOG.error(exc)
+        self._timeout_handle.cancel()
+        if self._mode == _INVALIDATIONS:
+            TRACKING.unregister(self._tracking_id)
+        self._session.close()
+
+    def pause_writing(self):
+        # Stop reading new commands until the client reads the responses.
+        self._writing_paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self.transport.resume_reading()
+        if self._stream is not None:
+            self._send_stream()
+
+    def get_buffer(self, sizehint):
+        if self._length == len(self._buffer):
+            self._grow()
+        return self._view[self._length:]
+
+    def buffer_updated(self, nbytes):
+        self._length += nbytes
+        self._last_activity = self._loop.time()
+        if self._mode == _COMMAND:
+            self._read_command()
+        if self._mode == _PIPELINED:
+            self._execute_pipelined()
+        elif self._mode == _BINARY:
+            self._execute_binary()
+        elif self._mode == _INVALIDATIONS:
+            self._length = 0
+        if self._mode in _TEXT_MODES and self._length > MAX_LINE_LENGTH:
+            self._close_line_too_long()
+
+    def eof_received(self):
+        LOG.info("Connection closed by client")
+        if self._mode in (_COMMAND, _SINGLE_MESSAGE) and self._length:
+            response = self._execute_single_message()
+            if not isinstance(response, bytes):
+                # The transport is closed once the stream is sent.
+                self._stream = response
+                self._send_stream()
+                return True
+            self.transport.write(response)
+        # The transport closes itself once the responses are sent.
+        return False
+
+    def _read_command(self):
+        command_end = self._buffer.find(b' ', 0, self._length)
+        if command_end == -1:
+            return
+        command = bytes(self._view[:command_end + 1])
+        match command:
+            case b"REUSECONN ":
+                LOG.info("Upgrading connection for multiple commands")
+                self._mode = _PIPELINED
+            case b"BINARY ":
+                LOG.info("Upgrading connection to binary framing")
+                self._mode = _BINARY
+            case b"INVALIDATIONS ":
+                LOG.info("Upgrading connection to push invalidations")
+                self._mode = _INVALIDATIONS
+                self._tracking_id = TRACKING.register(
+                    pusher(self.transport.write))
+                self.transport.write(
+                    rpc.encode_response_message(rpc.OK) +
+                    rpc.encode_response_message(rpc.NEWLINE) +
+                    str(self._tracking_id).encode() +
+                    rpc.encode_response_message(rpc.NEWLINE))
+                self._consume(command_end + 1)
+                return
+            case _:
+                self._mode = _SINGLE_MESSAGE
+                return
+        self.transport.write(rpc.encode_response_message(rpc.OK) +
+                             rpc.encode_response_message(rpc.NEWLINE))
+        self._consume(command_end + 1)
+
+    def _execute_single_message(self):
+        command_end = self._buffer.find(b' ', 0, self._length)
+        if command_end == -1:
+            return execute_frame(bytes(self._view[:self._length]), None,
+                                 self.storage)
+        return execute_frame(bytes(self._view[:command_end + 1]),
+                             bytes(self._view[command_end + 1:self._length]),
+                             self.storage)
+
+    def _execute_pipelined(self):
+        if self._stream is not None:
+            return
+        end_bytes = rpc.encode_response_message(rpc.NEWLINE)
+        responses = []
+        offset = 0
+        while (frame := next_frame(self._buffer, offset, end_bytes,
+                                   self._length)) is not None:
+            command, body, offset = frame
+            response = execute_pipelined_frame(command, body, self.storage,
+                                               self._session)
+            if not isinstance(response, bytes):
+                self._respond(responses, offset)
+                self._stream = response
+                self._send_stream()
+                return
+            responses.append(response)
+        self._respond(responses, offset)
+
+    def _send_stream(self):
+        """Writes the chunks of the streamed response until the transport
+          asks to pause writing, and continues on resume_writing.
+          Executes the commands received in the meantime once it is sent."""
+        for chunk in self._stream:
+            self.transport.write(chunk)
+            if self._writing_paused:
+                return
+        self._stream = None
+        if self._mode == _PIPELINED:
+            self._execute_pipelined()
+        else:
+            self.transport.close()
+
+    def _execute_binary(self):
+        responses = []
+        offset = 0
+        try:
+            while (frame := binary_parser.next_frame(
+                    self._buffer, offset, self._length)) is not None:
+                opcode, key, value, offset = frame
+                responses.append(execute_binary_frame(opcode, key, value,
+                                                      self.storage))
+        except InvalidFrameException as err:
+            LOG.error("Terminating connection due to unreadable frame")
+            responses.append(binary_parser.encode_error(err.rpc_message))
+            self.transport.write(b''.join(responses))
+            self.transport.close()
+            return
+        self._respond(responses, offset)
+
+    def _respond(self, responses, offset):
+        if responses:
+            self.transport.write(b''.join(responses))
+        self._consume(offset)
+
+    def _consume(self, offset):
+        """Drops the first offset bytes, moving the rest of the data
+          to the start of the buffer."""
+        remaining = self._length - offset
+        if remaining and offset:
+            self._view[:remaining] = self._view[offset:self._length]
+        self._length = remaining
+
+    def _grow(self):
+        size = len(self._buffer) * 2
+        if self._mode in _TEXT_MODES:
+            # Just enough to notice a command over the limit.
+            size = min(size, MAX_LINE_LENGTH + 1)
+        buffer = bytearray(size)
+        buffer[:self._length] = self._view[:self._length]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+
+    def _close_line_too_long(self):
+        """Fails a connection sending an unterminated command longer than
+          MAX_LINE_LENGTH, instead of buffering it without a limit."""
+        LOG.error("Terminating connection due to a command of over %s bytes",
+                  MAX_LINE_LENGTH)
+        self.transport.write(
+            rpc.encode_response_message(InvalidFrameException.rpc_message) +
+            rpc.encode_response_message(rpc.NEWLINE))
+        self.transport.close()
+
+    def _check_timeout(self):
+        idle = self._loop.time() - self._last_activity
+        # Invalidation connections are idle until a tracked key changes,
+        # and subscribers until a message is published or a watched key
+        # is modified.
+        if self._mode == _INVALIDATIONS or self._session.is_subscribed():
+            idle = 0
+        if idle < REQUEST_TIMEOUT:
+            self._timeout_handle = self._loop.call_later(
+                REQUEST_TIMEOUT - idle, self._check_timeout)
+            return
+        LOG.error("Terminating connection due to timeout")
+        if self._mode == _BINARY:
+            self.transport.write(binary_parser.encode_error(
+                rpc.TIMEOUT_ERROR))
+        else:
+            self.transport.write(rpc.TIMEOUT_ERROR.encode())
+        self.transport.close()
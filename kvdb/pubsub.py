@@ -0,0 +1,91 @@
+"""Publish/subscribe of messages on channels.
+
+A published message is encoded once into a MESSAGE line, and the same bytes
+object is written to the transport of every subscriber of the channel.
+A subscriber that doesn't read its messages as fast as they are published
+is disconnected once its transport buffers more than the output limit,
+so slow subscribers can't make the server run out of memory."""
+import logging
+import threading
+from kvdb import rpc
+from kvdb.tracking import pusher
+
+LOG = logging.getLogger(__name__)
+DEFAULT_OUTPUT_LIMIT = 8 * 1024 * 1024
+
+
+# pylint: disable-next=too-few-public-methods
+class Subscriber():
+    """Connection subscribed to channels, or watching key prefixes."""
+
+    def __init__(self, transport, output_limit) -> None:
+        self.transport = transport
+        self.output_limit = output_limit
+        self.channels = set()
+        self.prefixes = set()
+        # Writes from other event loop threads are scheduled on the loop
+        # of the connection.
+        self.deliver = pusher(self._write)
+
+    def _write(self, message):
+        if self.transport.is_closing():
+            return
+        if self.transport.get_write_buffer_size() + len(message) > \
+                self.output_limit:
+            LOG.warning("Disconnecting subscriber over the output limit")
+            # Drops the buffered messages right away.
+            self.transport.abort()
+            return
+        self.transport.write(message)
+
+
+class PubSub():
+    """Subscribers of every channel."""
+
+    def __init__(self, output_limit=DEFAULT_OUTPUT_LIMIT) -> None:
+        # Bytes buffered for a subscriber at most.
+        self.output_limit = output_limit
+        self.channels = {}
+        # Subscriptions change rarely, they are locked between event loop
+        # threads, publishing only reads the subscribers.
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscriber, channels):
+        """Subscribes to the channels, and returns the number of channels
+          the subscriber is subscribed to."""
+        with self._lock:
+            for channel in channels:
+                self.channels.setdefault(channel, set()).add(subscriber)
+                subscriber.channels.add(channel)
+        return len(subscriber.channels)
+
+    def unsubscribe(self, subscriber, channels=None):
+        """Unsubscribes from the channels, or from every channel,
+          and returns the number of channels left."""
+        with self._lock:
+            for channel in list(subscriber.channels if channels is None
+                                else channels):
+                subscriber.channels.discard(channel)
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.channels[channel]
+        return len(subscriber.channels)
+
+    def publish(self, channel, payload):
+        """Sends the message to the subscribers of the channel,
+          and returns their number."""
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            return 0
+        message = (rpc.encode_response_message(rpc.MESSAGE + " ") + channel +
+                   b" " + payload + rpc.encode_response_message(rpc.NEWLINE))
+        # Copied in a single step, subscriptions may change meanwhile.
+        subscribers = tuple(subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(message)
+        return len(subscribers)
+
+
+PUBSUB = PubSub()
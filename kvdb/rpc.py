@@ -5,13 +5,45 @@ from functools import cache
 SET = "SET"
 GET = "GET"
 DELETE = "DELETE"
+EXPIRE = "EXPIRE"
+EXPIREAT = "EXPIREAT"
+MGET = "MGET"
+MSET = "MSET"
+MDELETE = "MDELETE"
+RANGE = "RANGE"
+SCAN = "SCAN"
+# Parsed form of SCAN with a cursor, sent as SCAN on the wire.
+SCAN_CURSOR = "SCAN_CURSOR"
+# Commands reported under the name they are sent with on the wire.
+WIRE_NAMES = {SCAN_CURSOR: SCAN}
+SAVE = "SAVE"
+BGSAVE = "BGSAVE"
+INFO = "INFO"
+SLOWLOG = "SLOWLOG"
 REUSECONN = "REUSECONN"
+# Opens the connection pushing the invalidations of a tracking client.
+INVALIDATIONS = "INVALIDATIONS"
+TRACKING = "TRACKING"
+INVALIDATE = "INVALIDATE"
+SUBSCRIBE = "SUBSCRIBE"
+UNSUBSCRIBE = "UNSUBSCRIBE"
+PUBLISH = "PUBLISH"
+MESSAGE = "MESSAGE"
+WATCH = "WATCH"
+UNWATCH = "UNWATCH"
+EVENT = "EVENT"
+BINARY = "BINARY"
 OK = "100:OK"
 UNKNOWN_ERROR = "000:UnknownError"
 INVALID_COMMAND = "401:Invalid Command"
 INVALID_KEY = "402:Invalid_Key"
 KEY_NOT_FOUND = "403:Key_Not_Found"
 TIMEOUT_ERROR = "405:TimeoutError"
+WORKER_UNAVAILABLE = "406:Worker_Unavailable"
+SAVE_IN_PROGRESS = "407:Save_In_Progress"
+SNAPSHOTS_DISABLED = "408:Snapshots_Disabled"
+INDEX_DISABLED = "409:Index_Disabled"
+EVENTS_LOST = "410:Events_Lost"
 NEWLINE = '\n'
 
 
@@ -2,37 +2,553 @@
 import argparse
 import asyncio
 import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from . import aof, event_loop, eviction, metrics, snapshot
+from .access_log import ACCESS_LOG
+from .slowlog import DEFAULT_MAX_LENGTH, DEFAULT_THRESHOLD, SLOWLOG
+from .cluster import Forwarder, worker_socket_path
 from .naive_handler import handler
 from .naive_storage import NaiveStorage
+from .protocol_handler import KvdbProtocol
+from .pubsub import DEFAULT_OUTPUT_LIMIT, PUBSUB
+from .sharded_storage import DEFAULT_SHARDS, ShardedStorage
+from .watch import DEFAULT_BACKLOG as DEFAULT_WATCH_BACKLOG, WATCH
 
 LOG = logging.getLogger()
+STREAMS_CORE = "streams"
+PROTOCOL_CORE = "protocol"
+# Like the tcp-backlog of Redis, the kernel caps it at net.core.somaxconn.
+DEFAULT_BACKLOG = 511
+# Seconds a worker waits for the others to listen before it accepts commands.
+PEER_STARTUP_TIMEOUT = 10
 
 
-async def start(host, port):
-    """Starts kvdb server"""
-    LOG.info('Starting server on %s %s', host, port)
-    storage = NaiveStorage()
-    server = await asyncio.start_server(lambda reader, writer:
-                                        handler(reader, writer, storage),
-                                        host, port)
+# pylint: disable-next=too-few-public-methods
+class SocketOptions():
+    """Options of the sockets of the server. Accepted connections inherit
+      the buffer sizes from the listening socket, but asyncio sets
+      TCP_NODELAY on every accepted connection, so it is cleared
+      per connection if it is disabled."""
 
+    def __init__(self, backlog=DEFAULT_BACKLOG, nodelay=True, rcvbuf=None,
+                 sndbuf=None) -> None:
+        self.backlog = backlog
+        # Responses are small, so Nagle's algorithm would only delay them.
+        self.nodelay = nodelay
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+
+    def apply(self, server):
+        """Sets the options on the listening sockets of the server."""
+        for sock in server.sockets:
+            if self.rcvbuf is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                self.rcvbuf)
+            if self.sndbuf is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                self.sndbuf)
+
+    def configure(self, transport):
+        """Sets the options on an accepted connection."""
+        if self.nodelay:
+            return
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def start(host, port, server_core=STREAMS_CORE, storage=None,
+                reuse_port=False, socket_options=None, metrics_port=None):
+    """Starts kvdb server, and its Prometheus metrics endpoint
+      on the metrics port, if it is given."""
+    LOG.info('Starting %s server on %s %s', server_core, host, port)
+    if storage is None:
+        storage = NaiveStorage()
+    server = await _start_server(server_core, storage, socket_options,
+                                 host=host, port=port, reuse_port=reuse_port)
+    if metrics_port is not None:
+        await metrics.start(host, metrics_port, storage, server)
+    return server
+
+
+async def start_unix(path, server_core=STREAMS_CORE, storage=None,
+                     socket_options=None):
+    """Starts kvdb server on a unix domain socket,
+      that is cheaper than loopback TCP for clients on the same host."""
+    LOG.info('Starting %s server on %s', server_core, path)
+    if storage is None:
+        storage = NaiveStorage()
+    return await _start_server(server_core, storage, socket_options,
+                               path=path)
+
+
+async def _start_server(server_core, storage, socket_options, **address):
+    if socket_options is None:
+        socket_options = SocketOptions()
+    storage.start_expiry()
+    unix = "path" in address
+    if server_core == PROTOCOL_CORE:
+        loop = asyncio.get_running_loop()
+        create_server = loop.create_unix_server if unix \
+            else loop.create_server
+        server = await create_server(lambda: KvdbProtocol(storage,
+                                                          socket_options),
+                                     backlog=socket_options.backlog,
+                                     **address)
+    else:
+        start_server = asyncio.start_unix_server if unix \
+            else asyncio.start_server
+        server = await start_server(_connection_handler(storage,
+                                                        socket_options),
+                                    backlog=socket_options.backlog,
+                                    **address)
+    socket_options.apply(server)
     return server
 
 
-def _parse_cli_args():
+def _connection_handler(storage, socket_options, forwarder=None):
+    """Returns the callback of the streams core, serving an accepted
+      connection."""
+    def serve(reader, writer):
+        socket_options.configure(writer.transport)
+        return handler(reader, writer, storage, forwarder)
+    return serve
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def run_threads(host, port, threads, server_core=STREAMS_CORE,
+                      storage=None, socket_options=None, metrics_port=None):
+    """Runs kvdb on the running event loop and on threads - 1 more threads
+      with their own event loops, all of them listening on the port with
+      SO_REUSEPORT and sharing the storage, that has to be thread-safe.
+      The metrics endpoint runs on the running event loop.
+      Returns when the server is stopped by SIGTERM."""
+    if storage is None:
+        storage = ShardedStorage()
+    server_args = (host, port, server_core, storage, True, socket_options)
+    server = await start(*server_args, metrics_port)
+    loop_threads = [_start_loop_thread(server_args)
+                    for _ in range(threads - 1)]
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  server.close)
+    try:
+        return await server.serve_forever()
+    except asyncio.CancelledError:
+        LOG.info("Server stopped")
+        return None
+    finally:
+        LOG.info("Stopping server threads")
+        for loop, task, _ in loop_threads:
+            loop.call_soon_threadsafe(task.cancel)
+        for _, _, thread in loop_threads:
+            await asyncio.to_thread(thread.join)
+
+
+def _start_loop_thread(server_args):
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(_serve_in_thread(server_args))
+    thread = threading.Thread(target=_run_loop, args=(loop, task),
+                              daemon=True)
+    thread.start()
+    return loop, task, thread
+
+
+def _run_loop(loop, task):
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        LOG.info("Server thread stopped")
+    finally:
+        # Like asyncio.run, the connections still open are cancelled.
+        pending = asyncio.all_tasks(loop)
+        for pending_task in pending:
+            pending_task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending,
+                                               return_exceptions=True))
+        loop.close()
+
+
+async def _serve_in_thread(server_args):
+    server = await start(*server_args)
+    return await server.serve_forever()
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def open_storage(aof_path=None, fsync_policy=aof.EVERYSEC,
+                 snapshot_path=None, maxmemory=None,
+                 eviction_policy=eviction.LRU, sorted_index=False,
+                 cursor_table=False):
+    """Creates the storage, restoring its contents if persistence is enabled.
+      The append-only file is more recent than the snapshot, so it is
+      preferred if both are present. Has to be called from the event loop."""
+    contents = deadlines = None
+    append_only_file = None
+    snapshotter = None
+    if snapshot_path is not None:
+        snapshotter = snapshot.Snapshotter(snapshot_path)
+        if os.path.exists(snapshot_path) and (
+                aof_path is None or not os.path.exists(aof_path)):
+            contents, deadlines = snapshot.load(snapshot_path)
+    if aof_path is not None:
+        aof_exists = os.path.exists(aof_path)
+        if aof_exists:
+            contents, deadlines = aof.replay(aof_path)
+        append_only_file = aof.AppendOnlyFile(aof_path, fsync_policy)
+        if not aof_exists and contents:
+            # A new append-only file starts from the loaded snapshot.
+            append_only_file.log_set_many(contents)
+            for key, deadline in deadlines.items():
+                append_only_file.log_expire_at(key, deadline)
+            append_only_file.flush()
+    storage = NaiveStorage(contents, append_only_file, snapshotter,
+                           deadlines, maxmemory, eviction_policy,
+                           sorted_index, cursor_table)
+    if append_only_file is not None:
+        append_only_file.start(storage.dict, storage.expiry.deadlines)
+    return storage
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def start_worker(host, port, worker, workers, socket_dir,
+                       storage=None, socket_options=None):
+    """Starts a kvdb worker owning a partition of the keyspace.
+      The worker shares the TCP port with the other workers,
+      and accepts forwarded commands on its own unix socket."""
+    LOG.info('Starting worker %s/%s on %s %s', worker, workers, host, port)
+    if storage is None:
+        storage = NaiveStorage()
+    if socket_options is None:
+        socket_options = SocketOptions()
+    storage.start_expiry()
+    forwarder = Forwarder(worker, workers, socket_dir)
+    await asyncio.start_unix_server(lambda reader, writer:
+                                    handler(reader, writer, storage,
+                                            peer=True),
+                                    worker_socket_path(socket_dir, worker))
+    # Commands accepted before the other workers listen could not be
+    # forwarded to them.
+    await _wait_for_peers(socket_dir, worker, workers)
+    server = await asyncio.start_server(_connection_handler(storage,
+                                                            socket_options,
+                                                            forwarder),
+                                        host, port, reuse_port=True,
+                                        backlog=socket_options.backlog)
+    socket_options.apply(server)
+    return server
+
+
+async def _wait_for_peers(socket_dir, worker, workers):
+    deadline = time.monotonic() + PEER_STARTUP_TIMEOUT
+    for peer in range(workers):
+        path = worker_socket_path(socket_dir, peer)
+        while peer != worker and not os.path.exists(path):
+            if time.monotonic() > deadline:
+                LOG.error("Worker %s is not listening on %s", peer, path)
+                break
+            await asyncio.sleep(0.01)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def run_workers(host, port, workers, log_level=None, maxmemory=None,
+                      eviction_policy=eviction.LRU, loop=event_loop.ASYNCIO,
+                      socket_options=None, access_log_args=None,
+                      slowlog_args=None):
+    """Runs kvdb in worker processes sharing the port,
+      returns when all of the workers are stopped or SIGTERM is received.
+      The memory limit is split evenly between the workers."""
+    # pylint: disable=too-many-locals
+    socket_dir = tempfile.mkdtemp(prefix="kvdb-")
+    context = multiprocessing.get_context("spawn")
+    worker_maxmemory = None if maxmemory is None else maxmemory // workers
+    process_settings = (log_level, loop, access_log_args, slowlog_args)
+    processes = [context.Process(target=_run_worker,
+                                 args=(process_settings,
+                                       (host, port, worker, workers,
+                                        socket_dir, worker_maxmemory,
+                                        eviction_policy, socket_options)),
+                                 daemon=True)
+                 for worker in range(workers)]
+    stopped = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  stopped.set)
+    for process in processes:
+        process.start()
+    try:
+        await asyncio.wait(
+            [asyncio.create_task(stopped.wait()),
+             asyncio.create_task(asyncio.to_thread(_join, processes))],
+            return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        LOG.info("Stopping workers")
+        for process in processes:
+            process.terminate()
+        await asyncio.to_thread(_join, processes)
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def _join(processes):
+    for process in processes:
+        process.join()
+
+
+def _run_worker(process_settings, worker_args):
+    log_level, loop, access_log_args, slowlog_args = process_settings
+    logging.basicConfig(level=log_level)
+    event_loop.install(loop)
+    if slowlog_args is not None:
+        SLOWLOG.configure(*slowlog_args)
+    if access_log_args is not None:
+        ACCESS_LOG.configure(*access_log_args)
+    try:
+        asyncio.run(_serve_worker(*worker_args))
+    finally:
+        ACCESS_LOG.close()
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def _serve_worker(host, port, worker, workers, socket_dir, maxmemory,
+                        eviction_policy, socket_options):
+    storage = NaiveStorage(maxmemory=maxmemory,
+                           eviction_policy=eviction_policy)
+    server = await start_worker(host, port, worker, workers, socket_dir,
+                                storage, socket_options)
+    return await server.serve_forever()
+
+
+def parse_cli_args(argv=None):
+    """Parses the command line arguments of kvdb,
+      by default the ones of the process."""
     parser = argparse.ArgumentParser()
-    parser.add_argument('-t', '--host', required=True, dest="host", type=str)
-    parser.add_argument('-p', '--port', required=True, dest="port", type=int)
+    parser.add_argument('-t', '--host', required=False, dest="host",
+                        type=str)
+    parser.add_argument('-p', '--port', required=False, dest="port",
+                        type=int)
+    parser.add_argument('-u', '--unix-socket', required=False,
+                        dest="unix_socket",
+                        help="Unix domain socket to listen on, "
+                        "besides or instead of the TCP port.")
     parser.add_argument("-l", "--log-level", required=False,
                         dest="log_level", type=int)
-    parser.add_argument("-f", "--multiplex")
-    return parser.parse_args()
+    parser.add_argument("-f", "--workers", "--multiplex", required=False,
+                        dest="workers", type=int, default=1,
+                        help="Number of worker processes sharing the port.")
+    parser.add_argument("-c", "--server-core", required=False,
+                        dest="server_core", default=STREAMS_CORE,
+                        choices=(STREAMS_CORE, PROTOCOL_CORE))
+    parser.add_argument("-a", "--aof", required=False, dest="aof_path",
+                        help="Append-only file persisting the mutations.")
+    parser.add_argument("--appendfsync", required=False,
+                        dest="fsync_policy", default=aof.EVERYSEC,
+                        choices=aof.FSYNC_POLICIES)
+    parser.add_argument("-s", "--snapshot", required=False,
+                        dest="snapshot_path",
+                        help="Snapshot file loaded on startup, "
+                        "written by SAVE, BGSAVE and on shutdown.")
+    parser.add_argument("-m", "--maxmemory", required=False,
+                        dest="maxmemory", type=eviction.parse_memory,
+                        help="Memory limit of the stored keys and values, "
+                        "like 100mb or 2gb. Keys are evicted above it.")
+    parser.add_argument("--maxmemory-policy", required=False,
+                        dest="eviction_policy", default=eviction.LRU,
+                        choices=eviction.POLICIES)
+    parser.add_argument("-i", "--sorted-index", required=False,
+                        dest="sorted_index", action="store_true",
+                        help="Keep the keys in order for RANGE and SCAN.")
+    parser.add_argument("--cursor-table", required=False,
+                        dest="cursor_table", action="store_true",
+                        help="Keep the keys in hash buckets for SCAN with "
+                        "a cursor.")
+    parser.add_argument("--shards", required=False, dest="shards", type=int,
+                        default=1,
+                        help="Number of lock-striped shards of the storage, "
+                        "for sharing it between threads.")
+    parser.add_argument("--threads", required=False, dest="threads",
+                        type=int, default=1,
+                        help="Number of threads with their own event loop "
+                        "sharing the port and the storage.")
+    parser.add_argument("--loop", required=False, dest="loop",
+                        default=event_loop.ASYNCIO, choices=event_loop.LOOPS,
+                        help="Event loop implementation, uvloop falls back "
+                        "to asyncio if it is not installed.")
+    parser.add_argument("--backlog", required=False, dest="backlog",
+                        type=int, default=DEFAULT_BACKLOG,
+                        help="Length of the queue of pending connections.")
+    parser.add_argument("--no-tcp-nodelay", required=False, dest="nodelay",
+                        action="store_false",
+                        help="Keep Nagle's algorithm enabled.")
+    parser.add_argument("--rcvbuf", required=False, dest="rcvbuf",
+                        type=eviction.parse_memory,
+                        help="SO_RCVBUF of the sockets, like 256kb.")
+    parser.add_argument("--sndbuf", required=False, dest="sndbuf",
+                        type=eviction.parse_memory,
+                        help="SO_SNDBUF of the sockets, like 256kb.")
+    parser.add_argument("--access-log", required=False, dest="access_log",
+                        help="File of the access log, - for stderr. "
+                        "The access log is disabled if not given.")
+    parser.add_argument("--access-log-sample", required=False,
+                        dest="access_log_sample", type=int, default=1,
+                        help="Log 1 in every N requests.")
+    parser.add_argument("--slowlog-log-slower-than", required=False,
+                        dest="slowlog_threshold", type=int,
+                        default=DEFAULT_THRESHOLD,
+                        help="Microseconds above which commands are logged "
+                        "in the slow log, negative to disable it.")
+    parser.add_argument("--slowlog-max-len", required=False,
+                        dest="slowlog_max_length", type=int,
+                        default=DEFAULT_MAX_LENGTH,
+                        help="Number of entries kept in the slow log.")
+    parser.add_argument("--metrics-port", required=False,
+                        dest="metrics_port", type=int,
+                        help="Port of the Prometheus metrics endpoint, "
+                        "on the same host. Disabled if not given.")
+    parser.add_argument("--pubsub-output-limit", required=False,
+                        dest="pubsub_output_limit",
+                        type=eviction.parse_memory,
+                        default=DEFAULT_OUTPUT_LIMIT,
+                        help="Bytes buffered for a subscriber, like 8mb. "
+                        "Slower subscribers are disconnected.")
+    parser.add_argument("--watch-backlog", required=False,
+                        dest="watch_backlog", type=eviction.parse_memory,
+                        default=DEFAULT_WATCH_BACKLOG,
+                        help="Bytes of the events kept for resuming WATCH, "
+                        "like 16mb.")
+    args = parser.parse_args(argv)
+    for option, value in (("--workers", args.workers),
+                          ("--shards", args.shards),
+                          ("--threads", args.threads),
+                          ("--maxmemory", args.maxmemory),
+                          ("--backlog", args.backlog),
+                          ("--rcvbuf", args.rcvbuf),
+                          ("--sndbuf", args.sndbuf),
+                          ("--access-log-sample", args.access_log_sample),
+                          ("--slowlog-max-len", args.slowlog_max_length),
+                          ("--pubsub-output-limit",
+                           args.pubsub_output_limit),
+                          ("--watch-backlog", args.watch_backlog)):
+        if value is not None and value < 1:
+            parser.error(f"{option} has to be at least 1")
+    if args.port is None and args.unix_socket is None:
+        parser.error("--port or --unix-socket is required")
+    if args.port is not None and args.host is None:
+        parser.error("--host is required with --port")
+    if args.metrics_port is not None and args.port is None:
+        parser.error("--metrics-port needs --port")
+    if args.unix_socket is not None and (args.workers > 1
+                                         or args.threads > 1):
+        parser.error("--unix-socket is not supported with --workers "
+                     "and --threads")
+    if args.workers > 1:
+        _check_workers_args(parser, args)
+    if args.shards > 1 or args.threads > 1:
+        if args.aof_path or args.snapshot_path:
+            parser.error("--aof and --snapshot are not supported "
+                         "with --shards and --threads")
+    return args
+
 
+def _check_workers_args(parser, args):
+    if args.server_core != STREAMS_CORE:
+        parser.error("--workers is only supported by the streams core")
+    if args.aof_path or args.snapshot_path:
+        parser.error("--aof and --snapshot are not supported with --workers")
+    if args.sorted_index:
+        parser.error("--sorted-index is not supported with --workers")
+    if args.cursor_table:
+        parser.error("--cursor-table is not supported with --workers")
+    if args.threads > 1:
+        parser.error("--threads and --workers can not be combined")
+    if args.metrics_port is not None:
+        parser.error("--metrics-port is not supported with --workers")
 
-async def run_from_cli_args():
+
+async def run_from_cli_args(args=None):
     """Starts the server based on cli args and
       returns a coroutine that will only finish if the server is shut down."""
-    args = _parse_cli_args()
+    if args is None:
+        args = parse_cli_args()
     logging.basicConfig(level=args.log_level)
-    server = await start(args.host, args.port)
-    return await server.serve_forever()
+    socket_options = SocketOptions(args.backlog, args.nodelay, args.rcvbuf,
+                                   args.sndbuf)
+    access_log_args = None
+    if args.access_log is not None:
+        access_log_args = (args.access_log, args.access_log_sample)
+    slowlog_args = (args.slowlog_threshold, args.slowlog_max_length)
+    if args.workers > 1:
+        return await run_workers(args.host, args.port, args.workers,
+                                 args.log_level, args.maxmemory,
+                                 args.eviction_policy, args.loop,
+                                 socket_options, access_log_args,
+                                 slowlog_args)
+    SLOWLOG.configure(*slowlog_args)
+    PUBSUB.output_limit = args.pubsub_output_limit
+    WATCH.resize(args.watch_backlog)
+    if access_log_args is not None:
+        ACCESS_LOG.configure(*access_log_args)
+    try:
+        return await _serve_from_cli_args(args, socket_options)
+    finally:
+        ACCESS_LOG.close()
+
+
+async def _serve_from_cli_args(args, socket_options):
+    if args.shards > 1 or args.threads > 1:
+        # Threads can only share the storage if it is sharded.
+        shards = args.shards if args.shards > 1 else DEFAULT_SHARDS
+        storage = ShardedStorage(shards, maxmemory=args.maxmemory,
+                                 eviction_policy=args.eviction_policy,
+                                 sorted_index=args.sorted_index,
+                                 cursor_table=args.cursor_table)
+    else:
+        storage = open_storage(args.aof_path, args.fsync_policy,
+                               args.snapshot_path, args.maxmemory,
+                               args.eviction_policy, args.sorted_index,
+                               args.cursor_table)
+    if args.threads > 1:
+        return await run_threads(args.host, args.port, args.threads,
+                                 args.server_core, storage, socket_options,
+                                 args.metrics_port)
+    servers = []
+    if args.port is not None:
+        servers.append(await start(args.host, args.port, args.server_core,
+                                   storage, socket_options=socket_options,
+                                   metrics_port=args.metrics_port))
+    if args.unix_socket is not None:
+        servers.append(await start_unix(args.unix_socket, args.server_core,
+                                        storage, socket_options))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  _close_servers, servers)
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+        return None
+    except asyncio.CancelledError:
+        LOG.info("Server stopped")
+        return None
+    finally:
+        if args.unix_socket is not None:
+            _remove_unix_socket(args.unix_socket)
+        if storage.aof is not None:
+            await storage.aof.close()
+        if storage.snapshotter is not None:
+            storage.save()
+
+
+def _close_servers(servers):
+    for server in servers:
+        server.close()
+
+
+def _remove_unix_socket(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,175 @@
+"""Lock-striped storage for kvdb, safe to share between threads.
+
+The keyspace is split between shards by the hash of the key. Every shard
+is a NaiveStorage with its own lock, so threads working on different shards
+don't wait for each other. Commands on multiple keys lock one shard at a time,
+so they are atomic per shard, but not as a whole."""
+import asyncio
+import heapq
+import itertools
+import sys
+import threading
+from kvdb import eviction, expiry
+from kvdb.exceptions import InvalidKeyException, SnapshotsDisabledException
+from kvdb.naive_storage import NaiveStorage
+
+DEFAULT_SHARDS = 16
+# The shard is picked by the high bits of the hash, since the dict and the
+# cursor table of the shard bucket its keys by the low bits.
+_SHARD_HASH_SHIFT = sys.hash_info.width // 2
+
+
+class ShardedStorage():
+    """Storage split between shards with their own locks."""
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self, shards=DEFAULT_SHARDS, init_dict=None, maxmemory=None,
+                 eviction_policy=eviction.LRU, sorted_index=False,
+                 cursor_table=False) -> None:
+        shard_maxmemory = None if maxmemory is None else maxmemory // shards
+        self.shards = [NaiveStorage(maxmemory=shard_maxmemory,
+                                    eviction_policy=eviction_policy,
+                                    sorted_index=sorted_index,
+                                    cursor_table=cursor_table)
+                       for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        # Persistence needs a single ordered log of the mutations,
+        # so it is not supported.
+        self.aof = None
+        self.snapshotter = None
+        self._sweeper_task = None
+        if init_dict:
+            self.set_many(init_dict)
+
+    @property
+    def used_memory(self):
+        """Approximate memory used by the keys and values of every shard."""
+        return sum(shard.used_memory for shard in self.shards)
+
+    @property
+    def evicted_keys(self):
+        """Number of keys evicted from every shard."""
+        return sum(shard.evicted_keys for shard in self.shards)
+
+    def __len__(self):
+        return sum(len(shard.dict) for shard in self.shards)
+
+    def get(self, key):
+        """Get value from db."""
+        shard = self._shard_of(key)
+        with self.locks[shard]:
+            return self.shards[shard].get(key)
+
+    def set(self, key, value, ttl=None):
+        """Set value in db, expiring after ttl seconds if it is given."""
+        shard = self._shard_of(key)
+        with self.locks[shard]:
+            self.shards[shard].set(key, value, ttl)
+
+    def delete(self, key):
+        """Delete value from db."""
+        shard = self._shard_of(key)
+        with self.locks[shard]:
+            self.shards[shard].delete(key)
+
+    def expire(self, key, ttl):
+        """Expire an existing value after ttl seconds."""
+        shard = self._shard_of(key)
+        with self.locks[shard]:
+            self.shards[shard].expire(key, ttl)
+
+    def expire_at(self, key, deadline):
+        """Expire an existing value at a unix timestamp."""
+        shard = self._shard_of(key)
+        with self.locks[shard]:
+            self.shards[shard].expire_at(key, deadline)
+
+    def get_many(self, keys):
+        """Get values of multiple keys from db, None for missing keys."""
+        self._raise_keys_invalid(keys)
+        values = {}
+        for shard, shard_keys in self._group_by_shard(keys).items():
+            with self.locks[shard]:
+                values.update(zip(shard_keys,
+                                  self.shards[shard].get_many(shard_keys)))
+        return [values[key] for key in keys]
+
+    def set_many(self, items):
+        """Set multiple values in db from a key to value mapping."""
+        self._raise_keys_invalid(items)
+        for shard, shard_keys in self._group_by_shard(items).items():
+            with self.locks[shard]:
+                self.shards[shard].set_many(
+                    {key: items[key] for key in shard_keys})
+
+    def delete_many(self, keys):
+        """Delete multiple values from db, skipping missing keys.
+        Returns the number of deleted values."""
+        self._raise_keys_invalid(keys)
+        deleted = 0
+        for shard, shard_keys in self._group_by_shard(keys).items():
+            with self.locks[shard]:
+                deleted += self.shards[shard].delete_many(shard_keys)
+        return deleted
+
+    def range(self, start, end, limit):
+        """Get at most limit keys from start, inclusive, to end, exclusive,
+        in order, merged from the shards."""
+        ranges = []
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                ranges.append(shard.range(start, end, limit))
+        return list(itertools.islice(heapq.merge(*ranges), limit))
+
+    def scan(self, cursor, count):
+        """Get about count keys starting at the cursor, and the cursor
+        to continue from, 0 when every key is returned. The shards are
+        scanned one after the other, the cursor holds the current shard."""
+        shard, shard_cursor = cursor % len(self.shards), \
+            cursor // len(self.shards)
+        with self.locks[shard]:
+            shard_cursor, keys = self.shards[shard].scan(shard_cursor, count)
+        if shard_cursor == 0:
+            shard += 1
+            if shard == len(self.shards):
+                return 0, keys
+        return shard_cursor * len(self.shards) + shard, keys
+
+    def delete_expired(self, limit):
+        """Delete at most limit expired values, split between the shards.
+        Returns whether more of them are left."""
+        shard_limit = max(limit // len(self.shards), 1)
+        more_left = False
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                more_left |= shard.delete_expired(shard_limit)
+        return more_left
+
+    def start_expiry(self):
+        """Start deleting the expired values in the background,
+        unless it is already started. Has to be called from an event loop."""
+        if self._sweeper_task is None:
+            self._sweeper_task = asyncio.create_task(
+                expiry.sweep_periodically(self))
+
+    def save(self):
+        """Snapshots are not supported by sharded storage."""
+        raise SnapshotsDisabledException()
+
+    def bgsave(self):
+        """Snapshots are not supported by sharded storage."""
+        raise SnapshotsDisabledException()
+
+    def _shard_of(self, key):
+        return (hash(key) >> _SHARD_HASH_SHIFT) % len(self.shards)
+
+    def _raise_keys_invalid(self, keys):
+        # Checked before any of the shards is changed.
+        if not all(keys):
+            raise InvalidKeyException()
+
+    def _group_by_shard(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._shard_of(key), []).append(key)
+        return groups
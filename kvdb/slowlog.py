@@ -0,0 +1,61 @@
+"""Log of the commands slower than a threshold, like the SLOWLOG of Redis.
+
+The entries are kept in a ring buffer, the oldest entry is dropped when
+it is full. Commands are timed once for the metrics, and the slow log
+only compares that duration to the precomputed threshold."""
+import collections
+import itertools
+import math
+import time
+from kvdb import rpc
+from kvdb.access_log import key_fields
+
+DEFAULT_THRESHOLD = 10000
+DEFAULT_MAX_LENGTH = 128
+
+
+class SlowLog():
+    """Ring buffer of the slow commands."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD,
+                 max_length=DEFAULT_MAX_LENGTH) -> None:
+        self.threshold_ns = math.inf
+        self.entries = collections.deque()
+        self._ids = itertools.count()
+        self.configure(threshold, max_length)
+
+    def configure(self, threshold, max_length):
+        """Logs the commands slower than threshold microseconds, keeping
+          the last max_length of them. A negative threshold disables it."""
+        self.threshold_ns = math.inf if threshold < 0 else threshold * 1000
+        # The newest entries are kept, they are at the left.
+        self.entries = collections.deque(
+            itertools.islice(self.entries, max_length), maxlen=max_length)
+
+    def add(self, message, nanoseconds):
+        """Logs a parsed command that took the given time."""
+        key, _ = key_fields(message)
+        # deque.appendleft is safe to share between event loop threads.
+        self.entries.appendleft((next(self._ids), time.time(),
+                                 nanoseconds // 1000, message[0], key,
+                                 _value_size(message)))
+
+    def get(self, count=None):
+        """Returns the last count entries, newest first, as tuples of
+          id, unix timestamp, microseconds, command, key and value size."""
+        return list(itertools.islice(self.entries, count))
+
+    def reset(self):
+        """Drops every entry."""
+        self.entries.clear()
+
+
+def _value_size(message):
+    if message[0] == rpc.SET:
+        return len(message[2])
+    if message[0] == rpc.MSET:
+        return sum(map(len, message[1].values()))
+    return 0
+
+
+SLOWLOG = SlowLog()
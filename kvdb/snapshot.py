@@ -0,0 +1,162 @@
+"""Point-in-time binary snapshots of the storage contents.
+
+A snapshot is a header, the length-prefixed records, the deadlines
+and a checksum:
+    magic (8 bytes) | version (2 bytes) | number of keys (8 bytes)
+    key length (4 bytes) | value length (4 bytes) | key | value ...
+    number of deadlines (8 bytes)
+    key length (4 bytes) | unix timestamp (8 byte double) | key ...
+    crc32 of the records and the deadlines (4 bytes)
+All integers are unsigned big-endian."""
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from kvdb import expiry
+from kvdb.exceptions import (CorruptedSnapshotException,
+                             SaveInProgressException)
+
+LOG = logging.getLogger(__name__)
+MAGIC = b"KVDBSNAP"
+VERSION = 2
+HEADER = struct.Struct("!8sHQ")
+RECORD_HEADER = struct.Struct("!II")
+DEADLINES_HEADER = struct.Struct("!Q")
+DEADLINE_HEADER = struct.Struct("!Id")
+TRAILER = struct.Struct("!I")
+WRITE_BATCH_SIZE = 1024
+
+
+class Snapshotter():
+    """Saves snapshots of the storage contents to a file."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.last_save_time = None
+        self._bgsave_task = None
+
+    def save(self, contents, deadlines=None):
+        """Saves a snapshot, blocking until it is written."""
+        self._raise_save_in_progress()
+        save(self.path, contents, deadlines)
+        self.last_save_time = time.time()
+
+    def bgsave(self, contents, deadlines=None):
+        """Starts saving a snapshot in the background. Only the shallow copy
+          of the contents is taken on the event loop, the snapshot
+          is written by a worker thread."""
+        self._raise_save_in_progress()
+        snapshot = contents.copy()
+        self._bgsave_task = asyncio.create_task(
+            asyncio.to_thread(save, self.path, snapshot,
+                              dict(deadlines or {})))
+        self._bgsave_task.add_done_callback(self._bgsave_done)
+
+    def _bgsave_done(self, task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            LOG.error("Background save failed: %s", task.exception())
+            return
+        self.last_save_time = time.time()
+
+    def _raise_save_in_progress(self):
+        if self._bgsave_task is not None and not self._bgsave_task.done():
+            raise SaveInProgressException()
+
+
+def save(path, contents, deadlines=None):
+    """Writes a snapshot of the contents and the deadlines of their keys,
+      replacing the file atomically."""
+    deadlines = deadlines or {}
+    temporary_path = f"{path}.tmp"
+    checksum = 0
+    pack = RECORD_HEADER.pack
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(contents)))
+        batch = []
+        for key, value in contents.items():
+            batch += (pack(len(key), len(value)), key, value)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                checksum = _write(file, batch, checksum)
+        batch.append(DEADLINES_HEADER.pack(len(deadlines)))
+        pack = DEADLINE_HEADER.pack
+        for key, deadline in deadlines.items():
+            batch += (pack(len(key), deadline), key)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                checksum = _write(file, batch, checksum)
+        checksum = _write(file, batch, checksum)
+        file.write(TRAILER.pack(checksum))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    LOG.info("Saved %s keys to %s", len(contents), path)
+
+
+def load(path):
+    """Loads the contents and the deadlines from a snapshot.
+      The file is memory mapped, and keys and values are sliced directly
+      from the mapping. Keys past their deadline are left out."""
+    if os.path.getsize(path) < HEADER.size + TRAILER.size:
+        raise CorruptedSnapshotException()
+    with open(path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        magic, version, count = HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC or version != VERSION:
+            LOG.error("%s is not a version %s snapshot", path, VERSION)
+            raise CorruptedSnapshotException()
+        records_end = len(mapping) - TRAILER.size
+        (checksum,) = TRAILER.unpack_from(mapping, records_end)
+        with memoryview(mapping) as view:
+            if zlib.crc32(view[HEADER.size:records_end]) != checksum:
+                LOG.error("Checksum of %s does not match", path)
+                raise CorruptedSnapshotException()
+        try:
+            contents, offset = _read_records(mapping, count)
+            deadlines, offset = _read_deadlines(mapping, offset)
+        except struct.error as exc:
+            raise CorruptedSnapshotException() from exc
+        if offset != records_end:
+            raise CorruptedSnapshotException()
+    expiry.drop_expired(contents, deadlines)
+    LOG.info("Loaded %s keys from %s", len(contents), path)
+    return contents, deadlines
+
+
+def _read_records(mapping, count):
+    contents = {}
+    unpack = RECORD_HEADER.unpack_from
+    record_header_size = RECORD_HEADER.size
+    offset = HEADER.size
+    for _ in range(count):
+        key_length, value_length = unpack(mapping, offset)
+        key_start = offset + record_header_size
+        value_start = key_start + key_length
+        offset = value_start + value_length
+        contents[mapping[key_start:value_start]] = \
+            mapping[value_start:offset]
+    return contents, offset
+
+
+def _read_deadlines(mapping, offset):
+    deadlines = {}
+    (count,) = DEADLINES_HEADER.unpack_from(mapping, offset)
+    offset += DEADLINES_HEADER.size
+    unpack = DEADLINE_HEADER.unpack_from
+    deadline_header_size = DEADLINE_HEADER.size
+    for _ in range(count):
+        key_length, deadline = unpack(mapping, offset)
+        key_start = offset + deadline_header_size
+        offset = key_start + key_length
+        deadlines[mapping[key_start:offset]] = deadline
+    return deadlines, offset
+
+
+def _write(file, batch, checksum):
+    data = b''.join(batch)
+    batch.clear()
+    file.write(data)
+    return zlib.crc32(data, checksum)
@@ -0,0 +1,82 @@
+"""Ordered index of the keys of a storage, for range and prefix scans.
+
+Keys are kept in sorted chunks of at most 2 * CHUNK_SIZE keys, along with
+the largest key of every chunk. Finding a key bisects the chunk maxima, then
+the chunk, and inserting or removing a key only moves the keys of one chunk."""
+from bisect import bisect_left, insort
+
+CHUNK_SIZE = 1000
+
+
+def prefix_end(prefix: bytes):
+    """Returns the smallest key that is larger than all keys
+      starting with the prefix, None if there is no such key."""
+    stripped = prefix.rstrip(b'\xff')
+    if not stripped:
+        return None
+    return stripped[:-1] + bytes([stripped[-1] + 1])
+
+
+class SortedIndex():
+    """Sorted set of keys, stored in sorted chunks."""
+
+    def __init__(self, keys=()) -> None:
+        keys = sorted(keys)
+        self._chunks = [keys[start:start + CHUNK_SIZE]
+                        for start in range(0, len(keys), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+
+    def __len__(self):
+        return sum(map(len, self._chunks))
+
+    def add(self, key):
+        """Adds a key, that is not in the index yet."""
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        position = bisect_left(self._maxes, key)
+        if position == len(self._maxes):
+            position -= 1
+            chunk = self._chunks[position]
+            chunk.append(key)
+            self._maxes[position] = key
+        else:
+            chunk = self._chunks[position]
+            insort(chunk, key)
+        if len(chunk) > 2 * CHUNK_SIZE:
+            second_half = chunk[CHUNK_SIZE:]
+            del chunk[CHUNK_SIZE:]
+            self._chunks.insert(position + 1, second_half)
+            self._maxes[position] = chunk[-1]
+            self._maxes.insert(position + 1, second_half[-1])
+
+    def remove(self, key):
+        """Removes a key, that is in the index."""
+        position = bisect_left(self._maxes, key)
+        chunk = self._chunks[position]
+        del chunk[bisect_left(chunk, key)]
+        if not chunk:
+            del self._chunks[position]
+            del self._maxes[position]
+        else:
+            self._maxes[position] = chunk[-1]
+
+    def range(self, start, end, limit):
+        """Returns at most limit keys from start, inclusive, to end,
+          exclusive, in order. An end of None is unbounded."""
+        keys = []
+        position = bisect_left(self._maxes, start)
+        if position == len(self._maxes):
+            return keys
+        offset = bisect_left(self._chunks[position], start)
+        while position < len(self._chunks) and len(keys) < limit:
+            chunk = self._chunks[position]
+            stop = len(chunk) if end is None \
+                else bisect_left(chunk, end, offset)
+            keys += chunk[offset:min(stop, offset + limit - len(keys))]
+            if stop < len(chunk):
+                break
+            position += 1
+            offset = 0
+        return keys
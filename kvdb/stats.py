@@ -0,0 +1,92 @@
+"""Server metrics, reported by the INFO command and the metrics endpoint.
+
+The counters are plain integers incremented in the request path, without
+locks. On a single event loop the increments never interleave, when event
+loop threads share the counters a few increments may be lost."""
+import resource
+import time
+from bisect import bisect_left
+from kvdb import rpc
+
+# Upper bounds of the latency histogram buckets in nanoseconds, log-linear:
+# 1, 2 and 5 times every power of 10 from 1 microsecond to 10 seconds.
+LATENCY_BUCKETS = tuple(multiplier * 10 ** exponent
+                        for exponent in range(3, 10)
+                        for multiplier in (1, 2, 5)) + (10 ** 10,)
+
+
+class Stats():
+    """Counters of the commands and connections of the server."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        # Number of calls, total nanoseconds spent, and the number of calls
+        # in every latency bucket, the last one above the largest bound.
+        self.commands = {}
+        self.connections_received = 0
+        self.connected_clients = 0
+        self.keyspace_hits = 0
+        self.keyspace_misses = 0
+        # Seconds the event loop was late to wake up, if it is monitored.
+        self.loop_lag = 0.0
+
+    def record(self, command, nanoseconds):
+        """Counts an executed command and the time it took."""
+        command_stats = self.commands.get(command)
+        if command_stats is None:
+            command_stats = self.commands[command] = [
+                0, 0, [0] * (len(LATENCY_BUCKETS) + 1)]
+        command_stats[0] += 1
+        command_stats[1] += nanoseconds
+        command_stats[2][bisect_left(LATENCY_BUCKETS, nanoseconds)] += 1
+
+    def by_wire_name(self):
+        """Returns the counters of the commands sorted by the name they are
+          sent with, summing the ones sent with the same name."""
+        merged = {}
+        for command, (calls, nanoseconds, buckets) in self.commands.items():
+            name = rpc.WIRE_NAMES.get(command, command)
+            if name in merged:
+                merged_stats = merged[name]
+                merged[name] = [merged_stats[0] + calls,
+                                merged_stats[1] + nanoseconds,
+                                [merged_count + count for merged_count, count
+                                 in zip(merged_stats[2], buckets)]]
+            else:
+                merged[name] = [calls, nanoseconds, buckets]
+        return sorted(merged.items())
+
+    def connected(self):
+        """Counts a new connection."""
+        self.connections_received += 1
+        self.connected_clients += 1
+
+    def disconnected(self):
+        """Counts a closed connection."""
+        self.connected_clients -= 1
+
+    def info(self, storage):
+        """Returns the metrics as name:value lines, closed by an empty line,
+          like the INFO of Redis."""
+        fields = [
+            ("uptime_in_seconds", int(time.monotonic() - self.started)),
+            ("connected_clients", self.connected_clients),
+            ("total_connections_received", self.connections_received),
+            ("keys", len(storage)),
+            ("used_memory", storage.used_memory),
+            # Linux reports the peak resident set size in kilobytes.
+            ("used_memory_peak_rss",
+             resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024),
+            ("evicted_keys", storage.evicted_keys),
+            ("keyspace_hits", self.keyspace_hits),
+            ("keyspace_misses", self.keyspace_misses),
+        ]
+        for command, (calls, nanoseconds, _) in self.by_wire_name():
+            usec = nanoseconds // 1000
+            fields.append((f"cmdstat_{command.lower()}",
+                           f"calls={calls},usec={usec},"
+                           f"usec_per_call={usec / calls:.2f}"))
+        return "".join(f"{name}:{value}\n" for name, value in fields).encode()
+
+
+STATS = Stats()
@@ -0,0 +1,104 @@
+"""Tracking of the keys read by clients that cache them, like the client
+side caching of Redis.
+
+A client opens an invalidation connection with INVALIDATIONS, that is given
+a client id, and declares that id with TRACKING <id> on the connections it
+reads from. The keys read by GET on those connections are remembered, and
+the next modification of a key pushes INVALIDATE <key> to every client
+that read it, which forgets them. Clients read the key again to keep
+tracking it.
+
+The table maps a key to the id of the client that read it, or to the set of
+ids if more clients did, so a key read by a single client costs an int.
+The storage only calls the table if it tracks any key."""
+import asyncio
+import itertools
+import threading
+from kvdb import rpc
+from kvdb.exceptions import InvalidCommandException
+
+# Keys tracked at most, the oldest ones are invalidated to make room.
+DEFAULT_MAX_KEYS = 1000000
+
+
+class TrackingTable():
+    """Clients that read every tracked key."""
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS) -> None:
+        self.max_keys = max_keys
+        # Tracked key to a client id, or a set of them.
+        self.keys = {}
+        self._clients = {}
+        # itertools.count is safe to share between event loop threads.
+        self._ids = itertools.count(1)
+
+    def register(self, push):
+        """Registers a client, that is pushed the invalidation messages
+          by the push callable. Returns the id of the client."""
+        client_id = next(self._ids)
+        self._clients[client_id] = push
+        return client_id
+
+    def unregister(self, client_id):
+        """Stops pushing to a client. Its ids left in the table
+          are dropped when their keys are invalidated."""
+        self._clients.pop(client_id, None)
+
+    def client_id(self, raw):
+        """Parses the id of a registered client."""
+        if not raw.isdigit() or int(raw) not in self._clients:
+            raise InvalidCommandException()
+        return int(raw)
+
+    def track(self, client_id, key):
+        """Remembers that the client read the key."""
+        clients = self.keys.get(key)
+        if clients is None:
+            if len(self.keys) >= self.max_keys:
+                self._invalidate_oldest()
+            self.keys[key] = client_id
+        elif isinstance(clients, int):
+            if clients != client_id:
+                self.keys[key] = {clients, client_id}
+        else:
+            clients.add(client_id)
+
+    def invalidate(self, key):
+        """Pushes the invalidation of a modified key to the clients
+          that read it, and forgets them."""
+        clients = self.keys.pop(key, None)
+        if clients is None:
+            return
+        message = (rpc.encode_response_message(rpc.INVALIDATE + " ") + key +
+                   rpc.encode_response_message(rpc.NEWLINE))
+        if isinstance(clients, int):
+            clients = (clients,)
+        for client_id in clients:
+            push = self._clients.get(client_id)
+            if push is not None:
+                push(message)
+
+    def _invalidate_oldest(self):
+        try:
+            key = next(iter(self.keys))
+        except (StopIteration, RuntimeError):
+            # Empty, or changed by an other event loop thread.
+            return
+        self.invalidate(key)
+
+
+def pusher(write):
+    """Returns a push callable writing to a connection of the running
+      event loop, that is safe to call from other event loop threads."""
+    loop = asyncio.get_running_loop()
+    thread = threading.get_ident()
+
+    def push(message):
+        if threading.get_ident() == thread:
+            write(message)
+        else:
+            loop.call_soon_threadsafe(write, message)
+    return push
+
+
+TRACKING = TrackingTable()
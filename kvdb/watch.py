@@ -0,0 +1,177 @@
+"""Streams of the modifications of the keys starting with watched prefixes.
+
+A connection sends WATCH <prefix>, and is then sent an EVENT line for every
+SET and DELETE of a matching key, numbered by a sequence that increases
+with every modification of the server. The last events are kept in
+a bounded backlog, so a consumer that lost its connection resumes with
+the sequence number of the last event it read. The backlog is bounded by
+its size in bytes, and is not counted in the memory limit of the storage.
+
+The watchers are stored in a trie of their prefixes, with a node per byte,
+so a write walks at most the bytes of its key, however many connections
+watch. Writes cost a flag check while nothing is watched: events are only
+numbered from the first WATCH, until nothing was watched for a while."""
+import collections
+import threading
+import time
+from kvdb import rpc
+from kvdb.exceptions import EventsLostException, InvalidCommandException
+
+# Bytes of the events kept for resuming consumers.
+DEFAULT_BACKLOG = 16 * 1024 * 1024
+# Seconds the events are still numbered and kept after the last watcher
+# left, so a consumer that lost its connection can resume.
+RESUME_WINDOW = 60
+
+
+# pylint: disable-next=too-few-public-methods
+class _Node():
+    __slots__ = ("children", "watchers")
+
+    def __init__(self) -> None:
+        # Byte of the prefix to the next node.
+        self.children = {}
+        self.watchers = set()
+
+
+class PrefixTrie():
+    """Watchers of every prefix."""
+
+    def __init__(self) -> None:
+        self.root = _Node()
+
+    def add(self, prefix, watcher):
+        """Adds a watcher of the prefix."""
+        node = self.root
+        for byte in prefix:
+            node = node.children.setdefault(byte, _Node())
+        node.watchers.add(watcher)
+
+    def remove(self, prefix, watcher):
+        """Removes a watcher of the prefix, and the nodes left empty."""
+        path = [self.root]
+        for byte in prefix:
+            node = path[-1].children.get(byte)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].watchers.discard(watcher)
+        for byte, parent, node in zip(reversed(prefix), reversed(path[:-1]),
+                                      reversed(path[1:])):
+            if node.watchers or node.children:
+                return
+            del parent.children[byte]
+
+    def match(self, key):
+        """Returns the watchers of the prefixes of the key."""
+        node = self.root
+        watchers = set(node.watchers)
+        for byte in key:
+            node = node.children.get(byte)
+            if node is None:
+                break
+            watchers.update(node.watchers)
+        return watchers
+
+
+class KeyspaceWatch():
+    """Watchers of the keyspace, and the backlog of its last events."""
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, backlog=DEFAULT_BACKLOG) -> None:
+        # Set while anything is watched, events are numbered and kept.
+        self.enabled = False
+        self.sequence = 0
+        self.trie = PrefixTrie()
+        # Sequence number, key and message of the last events,
+        # of backlog_size bytes at most.
+        self.events = collections.deque()
+        self.backlog = backlog
+        self.backlog_size = 0
+        self._watches = 0
+        # Time the last watcher left, while the events are still kept.
+        self._idle_since = None
+        # Taken by the writes of every event loop thread, so the events
+        # are numbered, kept and delivered in the same order.
+        self._lock = threading.Lock()
+
+    def resize(self, backlog):
+        """Changes the number of bytes of the events kept."""
+        with self._lock:
+            self.backlog = backlog
+            self._trim()
+
+    def watch(self, watcher, prefix, since=None):
+        """Starts sending the events of the keys starting with the prefix
+          to the watcher. Returns the sequence number of the last event,
+          and the kept events after the since sequence number, if it is
+          given. Raises EventsLostException if some of them are not kept."""
+        with self._lock:
+            replayed = []
+            if since is not None:
+                if since > self.sequence:
+                    raise InvalidCommandException()
+                oldest = self.events[0][0] if self.events \
+                    else self.sequence + 1
+                if since + 1 < oldest:
+                    raise EventsLostException()
+                replayed = [message for sequence, key, message in self.events
+                            if sequence > since and key.startswith(prefix)]
+            if prefix not in watcher.prefixes:
+                self._watches += 1
+                self.trie.add(prefix, watcher)
+                watcher.prefixes.add(prefix)
+            self.enabled = True
+            self._idle_since = None
+            return self.sequence, replayed
+
+    def unwatch(self, watcher, prefixes=None):
+        """Stops watching the prefixes, or every prefix,
+          and returns the number of prefixes left."""
+        with self._lock:
+            for prefix in list(watcher.prefixes if prefixes is None
+                               else prefixes):
+                if prefix in watcher.prefixes:
+                    watcher.prefixes.discard(prefix)
+                    self.trie.remove(prefix, watcher)
+                    self._watches -= 1
+            if not self._watches and self.enabled:
+                self._idle_since = time.monotonic()
+        return len(watcher.prefixes)
+
+    def notify(self, command, key, value=None):
+        """Numbers and keeps the event of a modified key, and sends it
+          to the watchers of its prefixes."""
+        with self._lock:
+            if self._idle_since is not None and \
+                    time.monotonic() - self._idle_since > RESUME_WINDOW:
+                self._disable()
+                return
+            self.sequence += 1
+            message = (rpc.encode_response_message(rpc.EVENT + " ") +
+                       str(self.sequence).encode() + b" " +
+                       rpc.encode_response_message(command + " ") + key +
+                       (b"" if value is None else b" " + value) +
+                       rpc.encode_response_message(rpc.NEWLINE))
+            self.events.append((self.sequence, key, message))
+            self.backlog_size += len(message)
+            self._trim()
+            for watcher in self.trie.match(key):
+                watcher.deliver(message)
+
+    def _trim(self):
+        while self.backlog_size > self.backlog:
+            self.backlog_size -= len(self.events.popleft()[2])
+
+    def _disable(self):
+        """Stops numbering the modifications once nothing was watched for
+          the resume window. The sequence number skipped marks the gap,
+          resuming from before it raises EventsLostException."""
+        self.enabled = False
+        self._idle_since = None
+        self.events.clear()
+        self.backlog_size = 0
+        self.sequence += 1
+
+
+WATCH = KeyspaceWatch()
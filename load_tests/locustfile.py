@@ -1,18 +1,18 @@
-"""Benchmarking script for KVDB."""
+"""Benchmarking script for KVDB.
+Run from the repository root with PYTHONPATH=. so kvdb can be imported."""
 import random
 
 import socket
 import time
 from locust import task, User
-
-# Should not be in this file, but locust doesn't seem
-# to handle relative module imports correctly
+from kvdb.client import SyncClient
+from kvdb.exceptions import KvdbException
 
 
 class KvdbClient():
-    """Client for kvdb.
-    Should not be in this file, but locust doesn't seem
-      to handle relative module imports correctly"""
+    """Client for kvdb, reporting the requests to locust.
+    Every request opens a new connection to the server."""
+    request_type = "kvdbrpc"
 
     def __init__(self, host, port, request_event):
         self.host = host
@@ -34,8 +34,22 @@ class KvdbClient():
         return self._exchange(b'DELETE ' + bytes(key, 'utf-8'), "delete")
 
     def _exchange(self, message, command_meta):
+        return self._report(self._send, (message,), command_meta)
+
+    def _send(self, message):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect((self.host, self.port))
+            sock.settimeout(3)
+            sock.sendall(message)
+            sock.shutdown(socket.SHUT_WR)
+            response = sock.recv(2048)
+        if response.startswith(b"40"):
+            raise ValueError(response)
+        return response
+
+    def _report(self, command, arguments, command_meta):
         request_meta = {
-            "request_type": "kvdbrpc",
+            "request_type": self.request_type,
             "name": command_meta,
             "start_time": time.time(),
             "response_length": 0,
@@ -43,22 +57,14 @@ class KvdbClient():
             "context": {},
             "exception": None,
         }
-        response = ""
+        response = None
         start_perf_counter = time.perf_counter()
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.host, self.port))
-            sock.settimeout(3)
-            sock.sendall(message)
-            sock.shutdown(socket.SHUT_WR)
-            response = sock.recv(2048).decode()
-            sock.close()
-            request_meta["response_length"] = len(response)
+            response = command(*arguments)
+            request_meta["response_length"] = len(response or b"")
             request_meta["response"] = response
-
-            if response.startswith("40"):
-                raise ValueError(response)
-        except (ConnectionError, ValueError, TimeoutError) as exc:
+        except (ConnectionError, KvdbException, ValueError,
+                TimeoutError) as exc:
             request_meta["exception"] = exc
         request_meta["response_time"] = (
             time.perf_counter() - start_perf_counter) * 1000
@@ -66,6 +72,28 @@ class KvdbClient():
         return response
 
 
+class PooledKvdbClient(KvdbClient):
+    """Client for kvdb, reporting the requests to locust.
+    Every user keeps its own connection to the server."""
+    request_type = "kvdbpool"
+
+    def __init__(self, host, port, request_event):
+        super().__init__(host, port, request_event)
+        self._client = SyncClient(host, port, max_connections=1, timeout=3)
+
+    def get(self, key):
+        """Get value from kvdb."""
+        return self._report(self._client.get, (key,), "get")
+
+    def set(self, key, value):
+        """Set value in kvdb."""
+        return self._report(self._client.set, (key, value), "set")
+
+    def delete(self, key):
+        """Delete value from kvdb."""
+        return self._report(self._client.delete, (key,), "delete")
+
+
 class KvDbUser(User):
     """Locust abstract user for kvdb.
     Should not be in this file, but locust doesn't seem
@@ -73,15 +101,17 @@ class KvDbUser(User):
     abstract = True
     host = None
     port = None
+    client_class = KvdbClient
 
     def __init__(self, environment):
         super().__init__(environment)
-        self.client = KvdbClient(self.host, self.port,
-                                 request_event=environment.events.request)
+        self.client = self.client_class(
+            self.host, self.port, request_event=environment.events.request)
 
 
 class TestUser(KvDbUser):
-    """Locust user for running benchmark steps."""
+    """Locust user for running benchmark steps,
+    with a connection per request."""
     host = "127.0.0.1"
     port = 1024
 
@@ -92,3 +122,10 @@ class TestUser(KvDbUser):
         self.client.set(target_key, str(random.randbytes(3)))
         self.client.get(target_key)
         self.client.delete(target_key)
+
+
+# pylint: disable-next=too-few-public-methods
+class PooledTestUser(TestUser):
+    """Locust user for running benchmark steps,
+    on a connection kept open by the SyncClient."""
+    client_class = PooledKvdbClient
@@ -0,0 +1,110 @@
+"""Benchmark of the single event loop server against the threaded server,
+and of loopback TCP against a unix domain socket.
+
+Starts a server for every mode, and runs concurrent clients against it,
+each of them sending pipelined SET and GET commands on a reused connection
+for a fixed time. Prints the requests per second of every mode.
+
+Usage: python -m load_tests.loop_benchmark [--threads N] [--clients N]
+  [--pipeline N] [--unix-socket PATH]"""
+import argparse
+import asyncio
+import functools
+import os
+import subprocess
+import sys
+import time
+
+HOST = "127.0.0.1"
+
+
+async def run_client(connect, client_id, deadline, pipeline):
+    """Sends batches of pipelined commands until the deadline,
+      returns the number of completed requests."""
+    reader, writer = await connect()
+    writer.write(b"REUSECONN ")
+    await reader.readline()
+    requests = 0
+    batch = b"".join(
+        f"SET key{client_id}-{i} value{i}\nGET key{client_id}-{i}\n".encode()
+        for i in range(max(pipeline // 2, 1)))
+    batch_size = batch.count(b"\n")
+    while time.monotonic() < deadline:
+        writer.write(batch)
+        for _ in range(batch_size):
+            await reader.readline()
+        requests += batch_size
+    writer.close()
+    await writer.wait_closed()
+    return requests
+
+
+async def run_clients(connect, clients, duration, pipeline):
+    """Runs the clients against the server, returns requests per second."""
+    deadline = time.monotonic() + duration
+    requests = await asyncio.gather(*(run_client(connect, client_id,
+                                                 deadline, pipeline)
+                                      for client_id in range(clients)))
+    return sum(requests) / duration
+
+
+def benchmark(server_args, connect, args):
+    """Starts a server with the given arguments, and benchmarks it."""
+    with subprocess.Popen([sys.executable, "-m", "kvdb", "-l", "40",
+                           *server_args],
+                          stderr=subprocess.DEVNULL) as server_process:
+        try:
+            asyncio.run(_wait_for_server(connect))
+            return asyncio.run(run_clients(connect, args.clients,
+                                           args.duration, args.pipeline))
+        finally:
+            server_process.terminate()
+
+
+async def _wait_for_server(connect, tries=50):
+    for _ in range(tries):
+        try:
+            _, writer = await connect()
+        except (ConnectionRefusedError, FileNotFoundError):
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+    raise TimeoutError("Couldn't connect to the server in time")
+
+
+def main():
+    """Benchmarks every mode, and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-p", "--port", type=int, default=1026)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--pipeline", type=int, default=16,
+                        help="Number of commands sent in a batch, "
+                        "in pairs of SET and GET.")
+    parser.add_argument("--unix-socket",
+                        help="Also benchmark a unix domain socket server "
+                        "listening on this path.")
+    args = parser.parse_args()
+    tcp_args = ["-t", HOST, "-p", str(args.port)]
+    connect_tcp = functools.partial(asyncio.open_connection, HOST, args.port)
+    modes = {
+        "single loop": (tcp_args, connect_tcp),
+        f"{args.threads} threads": (tcp_args + ["--threads",
+                                                str(args.threads)],
+                                    connect_tcp),
+    }
+    if args.unix_socket is not None:
+        if os.path.exists(args.unix_socket):
+            parser.error(f"{args.unix_socket} already exists")
+        modes["unix socket"] = (["-u", args.unix_socket], functools.partial(
+            asyncio.open_unix_connection, args.unix_socket))
+    for name, (server_args, connect) in modes.items():
+        rate = benchmark(server_args, connect, args)
+        print(f"{name}: {rate:.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+source "${BASH_SOURCE%/*}/../.venv/bin/activate"
+cd "${BASH_SOURCE%/*}/.."
+python -m load_tests.loop_benchmark "$@"
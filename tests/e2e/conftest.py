@@ -4,34 +4,58 @@ import asyncio
 from time import sleep
 from multiprocessing import Process
 import pytest
-from kvdb import server
+from kvdb import binary_parser, server
 
 LOCALHOST = "127.0.0.1"
 
 
-@pytest.fixture
-def host_port():
+@pytest.fixture(params=[server.STREAMS_CORE, server.PROTOCOL_CORE])
+def host_port(request):
     """Sets up a server to be tested in an other process,
-      and provides host and port to where the server is available."""
+      and provides host and port to where the server is available.
+      Every test runs against each server core."""
+    yield from _serve(["--server-core", request.param, "--sorted-index",
+                       "--cursor-table"])
+
+
+@pytest.fixture
+def sharded_host_port():
+    """Sets up a server with lock-striped sharded storage."""
+    yield from _serve(["--shards", "4", "--sorted-index",
+                       "--cursor-table"])
+
+
+@pytest.fixture
+def threads_host_port():
+    """Sets up a server with multiple event loop threads."""
+    yield from _serve(["--threads", "3", "--shards", "4", "--sorted-index",
+                       "--cursor-table"])
+
+
+@pytest.fixture
+def workers_host_port():
+    """Sets up a server with multiple worker processes."""
+    yield from _serve(["--workers", "3"], tries=30)
+
+
+def _serve(cli_args, tries=5):
+    """Runs the server with the extra command line arguments
+      in an other process, and provides host and port to where
+      the server is available until it is stopped by SIGTERM."""
     port = _next_free_port()
-    host_port_tuple = (LOCALHOST, port)
-    server_process = Process(target=_run_server_in_process,
-                             args=host_port_tuple)
+    server_process = Process(
+        target=_run_server_in_process,
+        args=(["--host", LOCALHOST, "--port", str(port)] + cli_args,))
     server_process.start()
-    wait_for_socket(LOCALHOST, port)
-    yield host_port_tuple
+    wait_for_socket(LOCALHOST, port, tries)
+    yield (LOCALHOST, port)
     server_process.terminate()
+    server_process.join()
 
 
-def _run_server_in_process(host, port):
+def _run_server_in_process(cli_args):
     """Server main function to be executed in a subprocess."""
-    asyncio.run(_run_server(host, port))
-
-
-async def _run_server(host, port):
-    """Starts the server that will only return if the server is stopped."""
-    test_server = await server.start(host, port)
-    return await test_server.serve_forever()
+    asyncio.run(server.run_from_cli_args(server.parse_cli_args(cli_args)))
 
 
 def _next_free_port(port=1024, max_port=65535):
@@ -110,3 +134,13 @@ class Client():
         await self.writer.drain()
         data = await self.reader.readuntil(bytes("\n", "utf-8"))
         return data.decode()
+
+    async def send_binary(self, command, key, value=b''):
+        """Sends a binary frame to the server,
+          returns the status and the payload of the response."""
+        self.writer.write(binary_parser.encode_request(command, key, value))
+        await self.writer.drain()
+        header = await self.reader.readexactly(
+            binary_parser.RESPONSE_HEADER.size)
+        status, length = binary_parser.RESPONSE_HEADER.unpack(header)
+        return status, await self.reader.readexactly(length)
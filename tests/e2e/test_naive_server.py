@@ -83,3 +83,224 @@ async def _reused_connection_flow(seed, host_port):
         assert get_resp == value + "\n"
         delete_resp = await client.send("DELETE " + key)
         assert delete_resp == "100:OK\n"
+
+
+@pytest.mark.asyncio
+async def test_binary_framing(host_port):
+    """Test binary framing with values containing delimiters."""
+    key = b"binary key"
+    value = b"value with spaces\nand newlines\x00"
+    async with Client(host_port) as client:
+        binary_resp = await client.send("BINARY ", True)
+        assert binary_resp == "100:OK\n"
+        assert await client.send_binary("SET", key, value) == (0, b"100:OK")
+        assert await client.send_binary("GET", key) == (0, value)
+        assert await client.send_binary("DELETE", key) == (0, b"100:OK")
+        assert await client.send_binary("GET", key) == (
+            1, b"403:Key_Not_Found")
+
+
+@pytest.mark.asyncio
+async def test_pipelined_commands(host_port):
+    """Test sending many commands before reading any of the responses."""
+    number_of_keys = 100
+    async with Client(host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        for i in range(number_of_keys):
+            client.writer.write(f"SET key{i} value{i}\n".encode())
+            client.writer.write(f"GET key{i}\n".encode())
+        await client.writer.drain()
+        for i in range(number_of_keys):
+            assert await client.reader.readline() == b"100:OK\n"
+            assert await client.reader.readline() == f"value{i}\n".encode()
+
+
+@pytest.mark.asyncio
+async def test_workers(workers_host_port):
+    """Test that keys are reachable through any of the workers."""
+    number_of_keys = 20
+    for i in range(number_of_keys):
+        response = await send_message(workers_host_port, f"SET key{i} {i}")
+        assert response == "100:OK\n"
+    async with Client(workers_host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        for i in range(number_of_keys):
+            client.writer.write(f"GET key{i}\n".encode())
+        await client.writer.drain()
+        for i in range(number_of_keys):
+            assert await client.reader.readline() == f"{i}\n".encode()
+
+
+@pytest.mark.asyncio
+async def test_batch_commands(host_port):
+    """Test setting, getting and deleting multiple keys at once."""
+    await _batch_flow(host_port)
+
+
+@pytest.mark.asyncio
+async def test_batch_commands_on_workers(workers_host_port):
+    """Test batches of keys owned by different workers."""
+    await _batch_flow(workers_host_port)
+
+
+async def _batch_flow(host_port):
+    keys = [f"batch{i}" for i in range(10)]
+    async with Client(host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send(
+            "MSET " + " ".join(f"{key} v{key}" for key in keys)) == "100:OK\n"
+        assert await client.send("MDELETE " + keys[0]) == "100:OK\n"
+        client.writer.write(f"MGET {' '.join(keys)}\n".encode())
+        await client.writer.drain()
+        assert await client.reader.readline() == b"403:Key_Not_Found\n"
+        for key in keys[1:]:
+            assert await client.reader.readline() == f"v{key}\n".encode()
+        # Commands pipelined after a batch see its writes.
+        client.writer.write(
+            f"MSET {' '.join(f'{key} new' for key in keys[1:])}\n".encode() +
+            b"".join(f"GET {key}\n".encode() for key in keys[1:]))
+        await client.writer.drain()
+        assert await client.reader.readline() == b"100:OK\n"
+        for key in keys[1:]:
+            assert await client.reader.readline() == b"new\n"
+
+
+@pytest.mark.asyncio
+async def test_scan_cursor_on_workers(workers_host_port):
+    """Test that iterating the keyspace is rejected, instead of returning
+      only the keys of one worker."""
+    assert await send_message(workers_host_port, "SCAN 0 COUNT 10") == \
+        "401:Invalid Command\n"
+    async with Client(workers_host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send("SCAN 0 COUNT 10") == \
+            "401:Invalid Command\n"
+
+
+@pytest.mark.asyncio
+async def test_publish_on_workers(workers_host_port):
+    """Test that publishing is rejected, like subscribing, instead of
+      only reaching the subscribers of one worker."""
+    assert await send_message(workers_host_port, "PUBLISH news hello") == \
+        "401:Invalid Command\n"
+    async with Client(workers_host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send("PUBLISH news hello") == \
+            "401:Invalid Command\n"
+
+
+@pytest.mark.asyncio
+async def test_save_without_snapshot_file(host_port):
+    """Check that SAVE fails if no snapshot file is configured."""
+    response = await send_message(host_port, "SAVE")
+    assert response == "408:Snapshots_Disabled\n"
+
+
+@pytest.mark.asyncio
+async def test_expiry(host_port):
+    """Test that values are gone after their time to live."""
+    await _expiry_flow(host_port)
+
+
+@pytest.mark.asyncio
+async def test_expiry_on_workers(workers_host_port):
+    """Test time to live of keys owned by other workers."""
+    await _expiry_flow(workers_host_port)
+
+
+async def _expiry_flow(host_port):
+    async with Client(host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send("SETEX session 1 value") == "100:OK\n"
+        assert await client.send("SET other value") == "100:OK\n"
+        assert await client.send("EXPIRE other 1") == "100:OK\n"
+        assert await client.send("GET session") == "value\n"
+        assert await client.send("EXPIRE missing 1") == \
+            "403:Key_Not_Found\n"
+        await asyncio.sleep(1.1)
+        assert await client.send("GET session") == "403:Key_Not_Found\n"
+        assert await client.send("GET other") == "403:Key_Not_Found\n"
+
+
+@pytest.mark.asyncio
+async def test_range_and_scan(host_port):
+    """Test listing keys in order, by range and by prefix."""
+    async with Client(host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send(
+            "MSET user:42:b 1 user:42:a 2 user:43:a 3 other 4") == "100:OK\n"
+        client.writer.write(b"SCAN user:42:\nRANGE other user:43 LIMIT 2\n")
+        await client.writer.drain()
+        lines = [await client.reader.readline() for _ in range(6)]
+        assert lines == [b"user:42:a\n", b"user:42:b\n", b"\n",
+                         b"other\n", b"user:42:a\n", b"\n"]
+
+
+@pytest.mark.asyncio
+async def test_scan_cursor(host_port):
+    """Test iterating every key in bounded batches."""
+    keys = {f"key{i}".encode() for i in range(50)}
+    scanned = set()
+    async with Client(host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        assert await client.send(
+            "MSET " + " ".join(f"{key.decode()} v" for key in keys)) == \
+            "100:OK\n"
+        cursor = b"0"
+        while True:
+            client.writer.write(b"SCAN " + cursor + b" COUNT 10\n")
+            await client.writer.drain()
+            cursor = (await client.reader.readline()).strip()
+            while line := (await client.reader.readline()).strip():
+                scanned.add(line)
+            if cursor == b"0":
+                break
+    assert scanned == keys
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage(sharded_host_port):
+    """Test batches and scans on a server with sharded storage."""
+    await _batch_flow(sharded_host_port)
+    async with Client(sharded_host_port) as client:
+        assert await client.send("REUSECONN ", True) == "100:OK\n"
+        client.writer.write(b"SCAN batch LIMIT 3\n")
+        await client.writer.drain()
+        lines = [await client.reader.readline() for _ in range(4)]
+        assert lines == [b"batch1\n", b"batch2\n", b"batch3\n", b"\n"]
+
+
+@pytest.mark.asyncio
+async def test_threads(threads_host_port):
+    """Test connections spread between the event loop threads,
+      sharing the same storage."""
+    await asyncio.gather(*(_reused_connection_flow(str(seed),
+                                                   threads_host_port)
+                           for seed in range(12)))
+    responses = await asyncio.gather(*(send_message(threads_host_port,
+                                                    f"SET key{seed} v{seed}")
+                                       for seed in range(12)))
+    assert responses == ["100:OK\n"] * 12
+    responses = await asyncio.gather(*(send_message(threads_host_port,
+                                                    f"GET key{seed}")
+                                       for seed in range(12)))
+    assert responses == [f"v{seed}\n" for seed in range(12)]
+    await _batch_flow(threads_host_port)
+
+
+@pytest.mark.asyncio
+async def test_info(host_port):
+    """Test that INFO reports the commands and keys of the server."""
+    assert await send_message(host_port, "SET info-key value") == "100:OK\n"
+    assert await send_message(host_port, "GET info-key") == "value\n"
+    assert await send_message(host_port, "GET missing") == \
+        "403:Key_Not_Found\n"
+    response = await send_message(host_port, "INFO")
+    assert response.endswith("\n\n")
+    fields = dict(line.split(":", 1) for line in response.split("\n")[:-2])
+    assert fields["keys"] == "1"
+    assert fields["connected_clients"] == "1"
+    assert fields["keyspace_hits"] == "1"
+    assert fields["keyspace_misses"] == "1"
+    assert fields["cmdstat_get"].startswith("calls=2,")
+    assert fields["cmdstat_set"].startswith("calls=1,")
@@ -0,0 +1,38 @@
+"""Tests for the access log."""
+from kvdb.access_log import ACCESS_LOG, KEY_LENGTH, AccessLog
+
+
+def test_access_log_disabled_by_default():
+    """Test that requests are not logged unless it is configured."""
+    assert not ACCESS_LOG.enabled
+
+
+def test_access_log_sampled(tmp_path):
+    """Test that 1 in every sample requests is written."""
+    path = tmp_path / "access.log"
+    access_log = AccessLog()
+    access_log.configure(str(path), sample=2)
+    assert access_log.enabled
+    for i in range(4):
+        access_log.record(("GET", f"key{i}".encode()))
+    access_log.close()
+    assert not access_log.enabled
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("command=GET key=b'key0' keys=1")
+    assert lines[1].endswith("command=GET key=b'key2' keys=1")
+
+
+def test_access_log_fields(tmp_path):
+    """Test that keys are truncated, and batches are logged by size."""
+    path = tmp_path / "access.log"
+    access_log = AccessLog()
+    access_log.configure(str(path))
+    access_log.record(("SET", b"k" * 100, b"value", None))
+    access_log.record(("MSET", {b"a": b"1", b"b": b"2"}))
+    access_log.record(("SAVE",))
+    access_log.close()
+    lines = path.read_text().splitlines()
+    assert lines[0].endswith(f"key={b'k' * KEY_LENGTH!r} keys=1")
+    assert lines[1].endswith("command=MSET key=None keys=2")
+    assert lines[2].endswith("command=SAVE key=None keys=0")
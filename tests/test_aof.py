@@ -0,0 +1,152 @@
+"""Unit tests for append-only file persistence."""
+import asyncio
+import threading
+import time
+import pytest
+import kvdb.aof
+from kvdb.aof import ALWAYS, EVERYSEC, NO, AppendOnlyFile, replay
+from kvdb.naive_storage import NaiveStorage
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fsync_policy", [ALWAYS, EVERYSEC, NO])
+async def test_replay(tmp_path, fsync_policy):
+    """Check that replaying the log restores the storage contents."""
+    path = tmp_path / "kvdb.aof"
+    storage = NaiveStorage(aof=AppendOnlyFile(path, fsync_policy))
+    storage.set(b'key', b'value with\nnewline')
+    storage.set(b'deleted', b'value')
+    storage.set_many({b'a': b'1', b'b': b'2'})
+    storage.delete(b'deleted')
+    storage.delete_many([b'a', b'missing'])
+    await storage.aof.close()
+
+    assert replay(path) == ({b'key': b'value with\nnewline', b'b': b'2'}, {})
+
+
+def test_replay_missing_file(tmp_path):
+    """Check that a missing log is an empty storage."""
+    assert replay(tmp_path / "kvdb.aof") == ({}, {})
+
+
+@pytest.mark.asyncio
+async def test_replay_drops_incomplete_mutation(tmp_path, monkeypatch):
+    """Check that a mutation cut short by a crash is dropped."""
+    monkeypatch.setattr(kvdb.aof, "READ_CHUNK_SIZE", 7)
+    path = tmp_path / "kvdb.aof"
+    aof = AppendOnlyFile(path, NO)
+    aof.log_set(b'key', b'value')
+    await aof.close()
+    complete_size = path.stat().st_size
+    with open(path, "ab") as file:
+        file.write(b'\x02\x00\x00')
+
+    assert replay(path) == ({b'key': b'value'}, {})
+    assert path.stat().st_size == complete_size
+
+
+@pytest.mark.asyncio
+async def test_background_flush(tmp_path, monkeypatch):
+    """Check that buffered mutations are written by the background task."""
+    monkeypatch.setattr(kvdb.aof, "FLUSH_INTERVAL", 0.01)
+    path = tmp_path / "kvdb.aof"
+    aof = AppendOnlyFile(path, EVERYSEC)
+    aof.start({}, {})
+    aof.log_set(b'key', b'value')
+    assert path.stat().st_size == 0
+    await asyncio.sleep(0.1)
+    assert replay(path) == ({b'key': b'value'}, {})
+    await aof.close()
+
+
+@pytest.mark.asyncio
+async def test_close_waits_for_background_write(tmp_path, monkeypatch):
+    """Check that closing waits for the write of the background task,
+      instead of closing the file while it is written."""
+    monkeypatch.setattr(kvdb.aof, "FLUSH_INTERVAL", 0.01)
+    # pylint: disable-next=protected-access
+    write = AppendOnlyFile._write
+    writing = threading.Event()
+
+    def slow_write(self, data):
+        writing.set()
+        time.sleep(0.05)
+        write(self, data)
+
+    monkeypatch.setattr(AppendOnlyFile, "_write", slow_write)
+    path = tmp_path / "kvdb.aof"
+    aof = AppendOnlyFile(path, EVERYSEC)
+    aof.start({}, {})
+    aof.log_set(b'key', b'value')
+    await asyncio.to_thread(writing.wait)
+    aof.log_set(b'other_key', b'value')
+    await aof.close()
+    assert replay(path) == ({b'key': b'value', b'other_key': b'value'}, {})
+
+
+@pytest.mark.asyncio
+async def test_rewrite(tmp_path, monkeypatch):
+    """Check that the rewritten log holds the live contents only,
+      including mutations logged while the rewrite was in progress."""
+    # pylint: disable-next=protected-access
+    write_snapshot = AppendOnlyFile._write_snapshot
+
+    def slow_write_snapshot(path, snapshot, deadlines):
+        time.sleep(0.05)
+        write_snapshot(path, snapshot, deadlines)
+
+    monkeypatch.setattr(AppendOnlyFile, "_write_snapshot",
+                        staticmethod(slow_write_snapshot))
+    path = tmp_path / "kvdb.aof"
+    storage = NaiveStorage(aof=AppendOnlyFile(path, EVERYSEC))
+    for i in range(100):
+        storage.set(b'key', bytes([i]))
+        storage.set(b'churn', bytes([i]))
+        storage.delete(b'churn')
+    storage.aof.flush()
+    size_before_rewrite = path.stat().st_size
+
+    storage.set(b'expiring', b'value', 100)
+    rewrite = asyncio.create_task(storage.aof.rewrite(
+        storage.dict, storage.expiry.deadlines))
+    await asyncio.sleep(0.01)
+    storage.set(b'during_rewrite', b'value')
+    storage.delete(b'key')
+    await rewrite
+    await storage.aof.close()
+
+    assert path.stat().st_size < size_before_rewrite
+    assert replay(path) == (
+        {b'during_rewrite': b'value', b'expiring': b'value'},
+        storage.expiry.deadlines)
+
+
+@pytest.mark.asyncio
+async def test_replay_expiry(tmp_path):
+    """Check that deadlines are replayed as absolute timestamps,
+      and that keys past their deadline are left out."""
+    path = tmp_path / "kvdb.aof"
+    storage = NaiveStorage(aof=AppendOnlyFile(path, NO))
+    storage.set(b'expiring', b'value', 100)
+    storage.set(b'expired', b'value')
+    storage.expire_at(b'expired', time.time() - 1)
+    storage.set(b'persisted', b'value', 100)
+    storage.set(b'persisted', b'value')
+    await storage.aof.close()
+
+    contents, deadlines = replay(path)
+    assert contents == {b'expiring': b'value', b'persisted': b'value'}
+    assert deadlines == {b'expiring': storage.expiry.deadlines[b'expiring']}
+
+
+@pytest.mark.asyncio
+async def test_needs_rewrite(tmp_path, monkeypatch):
+    """Check that rewrites are triggered by the growth of the log."""
+    monkeypatch.setattr(kvdb.aof, "REWRITE_MIN_SIZE", 10)
+    aof = AppendOnlyFile(tmp_path / "kvdb.aof", NO)
+    # pylint: disable=protected-access
+    assert not aof._needs_rewrite()
+    aof.log_set(b'key', b'value')
+    aof.flush()
+    assert aof._needs_rewrite()
+    await aof.close()
@@ -0,0 +1,83 @@
+"""Unit tests for binary parser."""
+import asyncio
+import pytest
+from kvdb import binary_parser
+from kvdb.exceptions import (InvalidCommandException, InvalidFrameException,
+                             InvalidKeyException)
+from kvdb.binary_parser import encode_request, parse_message
+from .utils import get_random_bytes
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("command,key,value", [
+    ("GET", get_random_bytes(2), None),
+    ("SET", get_random_bytes(8), get_random_bytes(32)),
+    ("SET", b'key with spaces', b'value with\nnewlines and spaces'),
+    ("SET", get_random_bytes(8), b''),
+    ("DELETE", get_random_bytes(3), None),
+])
+async def test_positive_message(command, key, value):
+    """Check positive cases for parsing binary frames."""
+    stream = _stream(encode_request(command, key, value or b''))
+
+    parsed = await parse_message(stream)
+    if value is None:
+        assert parsed == (command, key)
+    else:
+        assert parsed == (command, key, value)
+    assert await parse_message(stream) == ("CLOSE", None)
+
+
+@pytest.mark.asyncio
+async def test_multiple_frames():
+    """Check that consecutive frames are parsed one by one."""
+    stream = _stream(encode_request("SET", b'key', b'value') +
+                     encode_request("GET", b'key'))
+    assert await parse_message(stream) == ("SET", b'key', b'value')
+    assert await parse_message(stream) == ("GET", b'key')
+
+
+@pytest.mark.asyncio
+async def test_expire_frames():
+    """Check that expiry values are parsed as numbers."""
+    stream = _stream(encode_request("EXPIRE", b'key', b'10') +
+                     encode_request("EXPIREAT", b'key', b'1700000000.5'))
+    assert await parse_message(stream) == ("EXPIRE", b'key', 10)
+    assert await parse_message(stream) == ("EXPIREAT", b'key', 1700000000.5)
+    with pytest.raises(InvalidCommandException):
+        await parse_message(_stream(encode_request("EXPIRE", b'key', b'x')))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("message,ex_type", [
+    (binary_parser.REQUEST_HEADER.pack(99, 1, 0) + b'k',
+     InvalidCommandException),
+    (binary_parser.REQUEST_HEADER.pack(binary_parser.OPCODE_GET, 0, 0),
+     InvalidKeyException),
+    (binary_parser.REQUEST_HEADER.pack(binary_parser.OPCODE_SET, 10, 10) +
+     b'short', InvalidFrameException),
+    (binary_parser.REQUEST_HEADER.pack(binary_parser.OPCODE_SET, 1,
+                                       binary_parser.MAX_VALUE_SIZE + 1),
+     InvalidFrameException),
+    (b'\x01\x00', InvalidFrameException),
+])
+async def test_negative_cases(message, ex_type):
+    """Check negative cases for parsing binary frames."""
+    with pytest.raises(ex_type):
+        await parse_message(_stream(message))
+
+
+def test_encode_response():
+    """Check the status byte and length prefix of response frames."""
+    assert binary_parser.encode_response(b'a\nb') == (
+        b'\x00\x00\x00\x00\x03a\nb')
+    error = binary_parser.encode_error("403:Key_Not_Found")
+    assert error[0] == binary_parser.STATUS_ERROR
+    assert error[5:] == b'403:Key_Not_Found'
+
+
+def _stream(data):
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return stream
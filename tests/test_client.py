@@ -0,0 +1,324 @@
+"""Tests for the asyncio and blocking clients."""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from kvdb import client as client_module
+from kvdb import server
+from kvdb.client import Client, SyncClient
+from kvdb.exceptions import IndexDisabledException
+from kvdb.naive_storage import NaiveStorage
+from kvdb.stats import STATS
+from .utils import LOCALHOST, next_free_port
+
+
+async def _start(storage=None):
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port, storage=storage)
+    return server_instance, Client(LOCALHOST, port, max_connections=2)
+
+
+async def _stop(server_instance, client):
+    await client.close()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_commands():
+    """Test the commands on a single key, and the batches."""
+    server_instance, client = await _start(
+        NaiveStorage(sorted_index=True, cursor_table=True))
+    await client.set("key", "a value", ttl=60)
+    assert await client.get("key") == b"a value"
+    assert await client.get("missing") is None
+    await client.delete("key")
+    assert await client.get("key") is None
+    await client.set_many({"a1": "1", b"a2": b"2", "b1": "3"})
+    assert await client.get_many(["a1", "missing", "b1"]) == \
+        [b"1", None, b"3"]
+    assert await client.scan("a") == [b"a1", b"a2"]
+    assert await client.range("a2", "c", limit=1) == [b"a2"]
+    assert sorted([key async for key in client.scan_iter(count=1)]) == \
+        [b"a1", b"a2", b"b1"]
+    await client.delete_many(["a1", "missing"])
+    assert await client.get_many(["a1", "a2"]) == [None, b"2"]
+    assert (await client.info())["keys"] == "2"
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_pipelining():
+    """Test that concurrent requests share the bounded pool
+      and get their own responses."""
+    server_instance, client = await _start()
+    await asyncio.gather(*(client.set(f"key{i}", f"value{i}")
+                           for i in range(100)))
+    values = await asyncio.gather(*(client.get(f"key{i}")
+                                    for i in range(100)))
+    assert values == [f"value{i}".encode() for i in range(100)]
+    info = await client.info()
+    assert info["connected_clients"] == "2"
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_errors():
+    """Test that errors are raised, and fail only their own request."""
+    server_instance, client = await _start()
+    with pytest.raises(IndexDisabledException):
+        await client.scan("a")
+    with pytest.raises(ValueError):
+        await client.set("a key", "value")
+    with pytest.raises(ValueError):
+        await client.set_many({"key": "a value"})
+    await client.set("key", "value EX 10")
+    assert await client.get("key") == b"value EX 10"
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_connection_lost():
+    """Test that pending requests fail when the connection is lost,
+      and that the next request reconnects."""
+    async def close_after_handshake(reader, writer):
+        await reader.readexactly(len(b"REUSECONN "))
+        writer.write(b"100:OK\n")
+        await reader.readline()
+        writer.close()
+
+    port = next_free_port()
+    server_instance = await asyncio.start_server(close_after_handshake,
+                                                 LOCALHOST, port)
+    client = Client(LOCALHOST, port, max_connections=1)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await client.get("key")
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_large_values():
+    """Test values longer than the default line limit of StreamReader."""
+    server_instance, client = await _start()
+    value = b"x" * (1024 * 1024)
+    await client.set("key", value)
+    assert await client.get("key") == value
+    assert await client.get_many(["key", "key"]) == [value, value]
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_unexpected_response():
+    """Test that a connection receiving a response to no request is closed,
+      and that the next request opens a new one."""
+    connections = []
+
+    async def timeout_when_idle(reader, writer):
+        connections.append(writer)
+        await reader.readexactly(len(b"REUSECONN "))
+        writer.write(b"100:OK\n")
+        await reader.readline()
+        writer.write(b"value\n405:TimeoutError\n")
+        await reader.readline()
+        writer.write(b"value\n")
+        await reader.read()
+
+    port = next_free_port()
+    server_instance = await asyncio.start_server(timeout_when_idle,
+                                                 LOCALHOST, port)
+    client = Client(LOCALHOST, port, max_connections=1)
+    assert await client.get("key") == b"value"
+    await asyncio.sleep(0.05)
+    assert await client.get("key") == b"value"
+    assert len(connections) == 2
+    await _stop(server_instance, client)
+
+
+@pytest.mark.asyncio
+async def test_sync_client(monkeypatch):
+    """Test the blocking client from threads sharing its pool,
+      with receive buffers smaller than the responses."""
+    monkeypatch.setattr(client_module, "BUFFER_SIZE", 8)
+    port = next_free_port()
+    server_instance = await server.start(
+        LOCALHOST, port, storage=NaiveStorage(cursor_table=True))
+
+    def run():
+        with SyncClient(LOCALHOST, port, max_connections=2) as client:
+            connections = int(client.info()["total_connections_received"])
+            client.set("key", "a longer value than the buffer")
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(lambda i: client.set(f"key{i}", f"v{i}"),
+                                  range(100)))
+                values = list(executor.map(client.get, ["key", "missing"]))
+            assert values == [b"a longer value than the buffer", None]
+            assert client.get_many([f"key{i}" for i in range(3)]) == \
+                [b"v0", b"v1", b"v2"]
+            assert sorted(client.scan_iter(count=40))[:2] == [b"key", b"key0"]
+            with pytest.raises(IndexDisabledException):
+                client.scan("key")
+            info = client.info()
+            assert int(info["total_connections_received"]) - connections <= 1
+
+    await asyncio.to_thread(run)
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_sync_client_health_check():
+    """Test that idle connections closed by the server are replaced,
+      and that connections are dropped after a timeout."""
+    async def close_after_response(reader, writer):
+        await reader.readexactly(len(b"REUSECONN "))
+        writer.write(b"100:OK\n")
+        if await reader.readline() == b"GET slow\n":
+            await asyncio.sleep(1)
+        writer.write(b"value\n")
+        await writer.drain()
+        writer.close()
+
+    port = next_free_port()
+    server_instance = await asyncio.start_server(close_after_response,
+                                                 LOCALHOST, port)
+
+    def run():
+        client = SyncClient(LOCALHOST, port, max_connections=1, timeout=0.2,
+                            health_check_interval=0)
+        assert client.get("key") == b"value"
+        time.sleep(0.05)
+        assert client.get("key") == b"value"
+        time.sleep(0.05)
+        with pytest.raises(TimeoutError):
+            client.get("slow")
+        assert client.get("key") == b"value"
+        client.close()
+
+    await asyncio.to_thread(run)
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+async def _eventually(condition):
+    for _ in range(100):
+        if await condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_near_cache(server_core):
+    """Test that cached reads skip the server, and that modifications
+      by other clients and by the client itself invalidate them."""
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port, server_core)
+    client = Client(LOCALHOST, port, cache_size=2)
+    other = Client(LOCALHOST, port)
+    await other.set("key", "v1")
+    assert await client.get("key") == b"v1"
+    assert await client.get("missing") is None
+    gets = STATS.commands["GET"][0]
+    assert await client.get("key") == b"v1"
+    assert await client.get("missing") is None
+    assert STATS.commands["GET"][0] == gets
+    await other.set("key", "v2")
+    await other.set("missing", "found")
+    await _eventually(lambda: _has_value(client, "key", b"v2"))
+    await _eventually(lambda: _has_value(client, "missing", b"found"))
+    await client.set("key", "v3")
+    assert await client.get("key") == b"v3"
+    await client.delete("key")
+    assert await client.get("key") is None
+    await client.close()
+    await other.close()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+async def _has_value(client, key, value):
+    return await client.get(key) == value
+
+
+@pytest.mark.asyncio
+async def test_sync_near_cache():
+    """Test the near cache of the blocking client."""
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port)
+    other = Client(LOCALHOST, port)
+    client = SyncClient(LOCALHOST, port, cache_size=2)
+    await other.set("key", "v1")
+    assert await asyncio.to_thread(client.get, "key") == b"v1"
+    gets = STATS.commands["GET"][0]
+    assert await asyncio.to_thread(client.get, "key") == b"v1"
+    assert STATS.commands["GET"][0] == gets
+    await other.set("key", "v2")
+    await _eventually(lambda: asyncio.to_thread(
+        lambda: client.get("key") == b"v2"))
+    await asyncio.to_thread(client.close)
+    await other.close()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+def test_near_cache_reads():
+    """Test that values invalidated while they are read are not cached,
+      and that the least recently used value is dropped."""
+    # pylint: disable=protected-access
+    cache = client_module._NearCache(2)
+    cache.start_read(b"a")
+    cache.invalidate([b"a"])
+    cache.finish_read(b"a", b"1")
+    assert cache.get(b"a") is client_module._MISSING
+    for key in (b"a", b"b", b"c"):
+        cache.start_read(key)
+        cache.finish_read(key, key)
+        cache.get(b"a")
+    assert len(cache) == 2 and cache.get(b"b") is client_module._MISSING
+
+
+def test_modified_keys_leave_near_cache():
+    """Test that the keys set or deleted by the client are dropped from
+      its near cache by the request itself, also when they are str."""
+    # pylint: disable=protected-access
+    class Recording(client_module._Commands):
+        """Client dropping the modified keys, without a server."""
+
+        def __init__(self):
+            self._cache = client_module._NearCache(4)
+            self.requests = []
+
+        def _request(self, request, parser, keys=()):
+            self.requests.append(request)
+            self._cache.invalidate(keys)
+
+        def _cached_get(self, key):
+            return self._cache.get(key)
+
+    client = Recording()
+    for command in (lambda: client.set("key", "new"),
+                    lambda: client.set("key", "new", ttl=10),
+                    lambda: client.delete("key")):
+        client._cache.start_read(b"key")
+        client._cache.finish_read(b"key", b"old")
+        command()
+        assert client.get("key") is client_module._MISSING
+    assert client.requests == [b"SET key new", b"SETEX key 10 new",
+                               b"DELETE key"]
+
+
+def test_commands_need_request():
+    """Test that a client without its own _request can't be created."""
+    # pylint: disable=protected-access
+    class Incomplete(client_module._Commands):
+        """Client only reading through its near cache."""
+        # pylint: disable=abstract-method
+
+        def _cached_get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()  # pylint: disable=abstract-class-instantiated
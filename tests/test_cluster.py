@@ -0,0 +1,151 @@
+"""Unit tests for keyspace partitioning between workers."""
+import asyncio
+import pytest
+from kvdb import cluster, naive_handler
+from kvdb.binary_parser import STATUS_ERROR, STATUS_OK
+from kvdb.cluster import Forwarder, shard_of
+from kvdb.exceptions import WorkerUnavailableException
+from kvdb.naive_handler import handler
+from kvdb.naive_storage import NaiveStorage
+
+
+def test_shard_of_is_stable():
+    """Check that keys are assigned to shards independent of the process."""
+    assert shard_of(b'key', 4) == shard_of(b'key', 4)
+    assert {shard_of(bytes([i]), 4) for i in range(64)} == {0, 1, 2, 3}
+
+
+def test_forwards_only_foreign_keys(tmp_path):
+    """Check that only key based commands of other shards are forwarded."""
+    key = next(bytes([i]) for i in range(64) if shard_of(bytes([i]), 2) == 1)
+    assert Forwarder(0, 2, tmp_path).forwards(("GET", key))
+    assert not Forwarder(1, 2, tmp_path).forwards(("GET", key))
+    assert not Forwarder(0, 2, tmp_path).forwards(("REUSECONN", None))
+
+
+@pytest.mark.asyncio
+async def test_forward(tmp_path):
+    """Check that forwarded commands are pipelined to the owner."""
+    assert shard_of(b'key', 2) == 1
+    storage = NaiveStorage()
+    peer = await asyncio.start_unix_server(
+        lambda reader, writer: handler(reader, writer, storage),
+        cluster.worker_socket_path(tmp_path, 1))
+    forwarder = Forwarder(0, 2, tmp_path)
+
+    responses = await asyncio.gather(
+        forwarder.forward(("SET", b'key', b'value')),
+        forwarder.forward(("GET", b'key')),
+        forwarder.forward(("DELETE", b'key')),
+        forwarder.forward(("GET", b'key')))
+    assert responses == [(STATUS_OK, b'100:OK'), (STATUS_OK, b'value'),
+                         (STATUS_OK, b'100:OK'),
+                         (STATUS_ERROR, b'403:Key_Not_Found')]
+
+    forwarder.close()
+    peer.close()
+    await peer.wait_closed()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("connected", [False, True])
+async def test_batch_is_forwarded_before_next_command(tmp_path, connected):
+    """Check that the keys of a batch are sent to their owner before
+      a command scheduled after the batch."""
+    assert shard_of(b'key', 2) == 1
+    storage = NaiveStorage()
+    peer = await asyncio.start_unix_server(
+        lambda reader, writer: handler(reader, writer, storage),
+        cluster.worker_socket_path(tmp_path, 1))
+    forwarder = Forwarder(0, 2, tmp_path)
+    if connected:
+        await forwarder.forward(("SET", b'key', b'old'))
+
+    batch = asyncio.ensure_future(
+        forwarder.set_many(NaiveStorage(), {b'key': b'new'}))
+    get = asyncio.ensure_future(forwarder.forward(("GET", b'key')))
+    await batch
+    assert await get == (STATUS_OK, b'new')
+
+    forwarder.close()
+    peer.close()
+    await peer.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_set_with_ttl_is_forwarded_before_next_command(tmp_path):
+    """Check that a SET with time to live is sent to the owner before
+      a command forwarded after it."""
+    assert shard_of(b'key', 2) == 1
+    storage = NaiveStorage()
+    peer = await asyncio.start_unix_server(
+        lambda reader, writer: handler(reader, writer, storage),
+        cluster.worker_socket_path(tmp_path, 1))
+    forwarder = Forwarder(0, 2, tmp_path)
+
+    setex = forwarder.forward(("SET", b'key', b'value', 100))
+    get = forwarder.forward(("GET", b'key'))
+    assert await setex == (STATUS_OK, b'100:OK')
+    assert await get == (STATUS_OK, b'value')
+    assert storage.expiry.deadlines
+
+    forwarder.close()
+    peer.close()
+    await peer.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_forward_to_unavailable_worker(tmp_path):
+    """Check that commands to a stopped worker fail."""
+    forwarder = Forwarder(0, 2, tmp_path)
+    with pytest.raises(WorkerUnavailableException):
+        await forwarder.forward(("GET", b'key'))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("peer", [False, True])
+async def test_forward_after_idle_timeout(tmp_path, monkeypatch, peer):
+    """Check that forwarding works after the link was idle for longer than
+      the request timeout: peer links are kept open, and a link closed by
+      the owner is reopened by the next request."""
+    monkeypatch.setattr(naive_handler, "REQUEST_TIMEOUT", 0.1)
+    storage = NaiveStorage()
+    owner = await asyncio.start_unix_server(
+        lambda reader, writer: handler(reader, writer, storage, peer=peer),
+        cluster.worker_socket_path(tmp_path, 1))
+    forwarder = Forwarder(0, 2, tmp_path)
+    assert await forwarder.forward(("SET", b'key', b'value')) == \
+        (STATUS_OK, b'100:OK')
+    link = forwarder._peers[1]._writer  # pylint: disable=protected-access
+    await asyncio.sleep(0.3)
+    assert await forwarder.forward(("GET", b'key')) == (STATUS_OK, b'value')
+    # pylint: disable-next=protected-access
+    assert (forwarder._peers[1]._writer is link) == peer
+    forwarder.close()
+    owner.close()
+    await owner.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_forward_timeout(tmp_path, monkeypatch):
+    """Check that a forwarded command fails if the owner doesn't respond,
+      and that the next one is sent on a new connection."""
+    monkeypatch.setattr(cluster, "FORWARD_TIMEOUT", 0.1)
+    connections = []
+
+    async def unresponsive(reader, writer):
+        connections.append(writer)
+        await reader.readexactly(len(b"BINARY "))
+        writer.write(b"100:OK\n")
+        await reader.read()
+
+    owner = await asyncio.start_unix_server(
+        unresponsive, cluster.worker_socket_path(tmp_path, 1))
+    forwarder = Forwarder(0, 2, tmp_path)
+    for _ in range(2):
+        with pytest.raises(WorkerUnavailableException):
+            await forwarder.forward(("GET", b'key'))
+    assert len(connections) == 2
+    forwarder.close()
+    owner.close()
+    await owner.wait_closed()
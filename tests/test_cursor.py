@@ -0,0 +1,77 @@
+"""Unit tests for cursor based iteration."""
+import itertools
+import pytest
+import kvdb.cursor
+from kvdb.cursor import CursorTable
+
+
+def _scan_all(table, count, between_calls=None):
+    keys = []
+    cursor = 0
+    while True:
+        cursor, batch = table.scan(cursor, count)
+        keys += batch
+        if cursor == 0:
+            return keys
+        if between_calls is not None:
+            between_calls()
+
+
+@pytest.mark.parametrize("number_of_keys", [0, 1, 100, 1000])
+def test_scan(number_of_keys):
+    """Check that every key is returned exactly once."""
+    keys = [b'key%d' % i for i in range(number_of_keys)]
+    table = CursorTable(keys)
+    assert sorted(_scan_all(table, 10)) == sorted(keys)
+
+
+def test_scan_while_growing():
+    """Check that keys present during the whole scan are returned,
+      while the table grows between the calls."""
+    keys = [b'key%d' % i for i in range(200)]
+    table = CursorTable(keys)
+    added = iter(b'new%d' % i for i in range(2000))
+
+    def add_keys():
+        for key in itertools.islice(added, 20):
+            table.add(key)
+
+    scanned = _scan_all(table, 5, add_keys)
+    assert set(keys) <= set(scanned)
+    assert len(scanned) == len(set(scanned))
+
+
+def test_scan_while_removing():
+    """Check that removed keys don't break the iteration."""
+    keys = [b'key%d' % i for i in range(500)]
+    table = CursorTable(keys)
+    removed = iter(keys[250:])
+
+    def remove_keys():
+        for key in itertools.islice(removed, 5):
+            table.remove(key)
+
+    assert set(keys[:250]) <= set(_scan_all(table, 10, remove_keys))
+
+
+def test_scan_is_bounded(monkeypatch):
+    """Check that sparse tables are visited a few buckets at a time."""
+    monkeypatch.setattr(kvdb.cursor, "EMPTY_VISITS", 2)
+    table = CursorTable([b'key%d' % i for i in range(1000)])
+    for i in range(999):
+        table.remove(b'key%d' % i)
+    cursor, keys = table.scan(0, 1)
+    assert cursor != 0 or keys == [b'key999']
+    assert len(keys) <= 1
+
+
+def test_size():
+    """Check that the size follows the keys and buckets of the table."""
+    table = CursorTable()
+    empty = table.size
+    added = sum(table.add(b'key%d' % i) for i in range(1000))
+    assert table.size == empty + added
+    assert added > 1000 * kvdb.cursor.KEY_SIZE
+    removed = sum(table.remove(b'key%d' % i) for i in range(1000))
+    assert removed == 1000 * kvdb.cursor.KEY_SIZE
+    assert table.size == empty + added - removed
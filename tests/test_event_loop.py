@@ -0,0 +1,19 @@
+"""Tests for the choice of the event loop."""
+import asyncio
+import sys
+from kvdb import event_loop
+
+
+def test_install_asyncio():
+    """Test that the asyncio event loop is kept."""
+    policy = asyncio.get_event_loop_policy()
+    assert event_loop.install(event_loop.ASYNCIO) == event_loop.ASYNCIO
+    assert asyncio.get_event_loop_policy() is policy
+
+
+def test_install_uvloop_fallback(monkeypatch):
+    """Test that the asyncio event loop is used without uvloop."""
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    policy = asyncio.get_event_loop_policy()
+    assert event_loop.install(event_loop.UVLOOP) == event_loop.ASYNCIO
+    assert asyncio.get_event_loop_policy() is policy
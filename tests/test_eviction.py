@@ -0,0 +1,127 @@
+"""Unit tests for eviction policies."""
+import sys
+import pytest
+from kvdb import eviction
+from kvdb.eviction import LFU, LRU, POLICIES, create_policy
+from kvdb.naive_storage import NaiveStorage
+
+
+@pytest.fixture(autouse=True)
+def large_sample(monkeypatch):
+    """Samples with replacement from a few keys miss some of them
+      with small samples, so the tests use large ones."""
+    monkeypatch.setattr(eviction, "SAMPLE_SIZE", 200)
+
+
+def test_lru_victim():
+    """Check that the least recently used key is evicted."""
+    policy = create_policy(LRU)
+    for key in (b'a', b'b', b'c'):
+        policy.added(key)
+    policy.accessed(b'a')
+    assert policy.victim() == b'b'
+    assert policy.victim(excluded={b'b'}) == b'c'
+
+
+def test_lfu_victim():
+    """Check that the least frequently used key is evicted."""
+    policy = create_policy(LFU)
+    for key in (b'a', b'b', b'c'):
+        policy.added(key)
+    for _ in range(10):
+        policy.accessed(b'a')
+        policy.accessed(b'c')
+    assert policy.victim() == b'b'
+
+
+def test_lfu_decay(monkeypatch):
+    """Check that counters decay while the key is not accessed."""
+    policy = create_policy(LFU)
+    policy.added(b'a')
+    policy.added(b'b')
+    for _ in range(3):
+        policy.accessed(b'a')
+    monkeypatch.setattr(eviction, "_minutes", lambda: 10 ** 6)
+    policy.accessed(b'b')
+    assert policy.victim() == b'a'
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_removed_keys_are_not_victims(name):
+    """Check the bookkeeping of removed keys."""
+    policy = create_policy(name)
+    for key in (b'a', b'b', b'c'):
+        policy.added(key)
+    policy.removed(b'a')
+    policy.removed(b'c')
+    assert policy.victim() == b'b'
+    assert policy.victim(excluded={b'b'}) is None
+    policy.removed(b'b')
+    assert policy.victim() is None
+
+
+@pytest.mark.parametrize("raw,expected", [
+    ("1024", 1024), ("100kb", 100 * 1024), ("2GB", 2 * 1024 ** 3),
+    ("5m", 5 * 1000 ** 2),
+])
+def test_parse_memory(raw, expected):
+    """Check parsing memory limits with units."""
+    assert eviction.parse_memory(raw) == expected
+
+
+@pytest.mark.parametrize("key,value", [(b'a', b''), (b'key', b'v' * 1000)])
+def test_entry_size(key, value):
+    """Check that the estimate from the lengths matches the size of the
+      bytes objects."""
+    assert eviction.entry_size(key, value) == \
+        sys.getsizeof(key) + sys.getsizeof(value) + 96
+
+
+def test_memory_accounting():
+    """Check that the memory usage follows the stored entries."""
+    storage = NaiveStorage({b'a': b'1'})
+    assert storage.used_memory == eviction.entry_size(b'a', b'1')
+    storage.set(b'a', b'longer value')
+    storage.set_many({b'b': b'2', b'c': b'3'})
+    assert storage.used_memory == sum(
+        eviction.entry_size(key, value) for key, value in storage.dict.items())
+    storage.delete(b'a')
+    storage.delete_many([b'b', b'c'])
+    assert storage.used_memory == 0
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_storage_eviction(name):
+    """Check that the storage stays under its memory limit."""
+    entry_size = eviction.entry_size(b'key10', b'value')
+    storage = NaiveStorage(maxmemory=10 * entry_size, eviction_policy=name)
+    for i in range(10, 100):
+        storage.set(f"key{i}".encode(), b'value')
+        assert b'key%d' % i in storage.dict
+    assert len(storage.dict) == 10
+    assert storage.used_memory <= storage.maxmemory
+    assert storage.evicted_keys == 80
+
+
+@pytest.mark.parametrize("name", POLICIES)
+def test_storage_keeps_batch_keys(name):
+    """Check that a batch over the memory limit evicts the older keys,
+      and not the keys it has just set."""
+    entry_size = eviction.entry_size(b'old0', b'value')
+    storage = NaiveStorage(maxmemory=10 * entry_size, eviction_policy=name)
+    storage.set_many({b'old%d' % i: b'value' for i in range(5)})
+    batch = {b'new%d' % i: b'value' for i in range(10)}
+    storage.set_many(batch)
+    assert set(storage.dict) == set(batch)
+    assert storage.evicted_keys == 5
+
+
+def test_lru_storage_keeps_accessed_keys():
+    """Check that keys read through the storage are not evicted first."""
+    entry_size = eviction.entry_size(b'key0', b'value')
+    storage = NaiveStorage(maxmemory=3 * entry_size, eviction_policy=LRU)
+    storage.set_many({b'key0': b'value', b'key1': b'value'})
+    storage.get(b'key0')
+    storage.set(b'key2', b'value')
+    storage.set(b'key3', b'value')
+    assert set(storage.dict) == {b'key0', b'key2', b'key3'}
@@ -0,0 +1,67 @@
+"""Unit tests for key expiry."""
+import asyncio
+import time
+import pytest
+from kvdb import expiry
+from kvdb.exceptions import InvalidCommandException
+from kvdb.expiry import Expiry
+from kvdb.naive_storage import NaiveStorage
+
+
+def test_pop_expired():
+    """Check that only keys past their current deadline are popped."""
+    now = time.time()
+    deadlines = Expiry({b'expired': now - 2, b'valid': now + 100})
+    deadlines.set(b'changed', now - 1)
+    deadlines.set(b'changed', now + 100)
+    deadlines.set(b'cleared', now - 1)
+    deadlines.clear(b'cleared')
+
+    assert deadlines.is_expired(b'expired')
+    assert not deadlines.is_expired(b'valid')
+    assert not deadlines.is_expired(b'missing')
+    assert deadlines.pop_expired(2) == ([b'expired'], True)
+    assert deadlines.pop_expired(2) == ([], False)
+
+
+def test_heap_compaction(monkeypatch):
+    """Check that overwritten deadlines don't pile up in the heap."""
+    monkeypatch.setattr(expiry, "SWEEP_SLICE", 10)
+    deadlines = Expiry()
+    for i in range(1000):
+        deadlines.set(b'key', time.time() + i)
+    # pylint: disable-next=protected-access
+    assert len(deadlines._heap) <= expiry.HEAP_COMPACTION_RATIO + 10 + 1
+
+
+@pytest.mark.parametrize("raw", [b'0', b'-5', b'1.5', b'ten', b''])
+def test_parse_ttl_negative(raw):
+    """Check that time to live has to be positive whole seconds."""
+    with pytest.raises(InvalidCommandException):
+        expiry.parse_ttl(raw)
+
+
+def test_drop_expired():
+    """Check that restored keys past their deadline are removed."""
+    contents = {b'expired': b'1', b'valid': b'2', b'persistent': b'3'}
+    deadlines = {b'expired': time.time() - 1, b'valid': time.time() + 100,
+                 b'missing': time.time() + 100}
+    expiry.drop_expired(contents, deadlines)
+    assert contents == {b'valid': b'2', b'persistent': b'3'}
+    assert list(deadlines) == [b'valid']
+
+
+@pytest.mark.asyncio
+async def test_sweeper(monkeypatch):
+    """Check that expired keys are deleted without being accessed."""
+    monkeypatch.setattr(expiry, "SWEEP_INTERVAL", 0.01)
+    monkeypatch.setattr(expiry, "SWEEP_SLICE", 3)
+    storage = NaiveStorage({bytes([i]): b'value' for i in range(10)})
+    for i in range(10):
+        storage.expire_at(bytes([i]), time.time() - 1)
+    storage.start_expiry()
+    await asyncio.sleep(0.05)
+    assert not storage.dict
+    assert not storage.expiry.deadlines
+    # pylint: disable-next=protected-access
+    storage._sweeper_task.cancel()
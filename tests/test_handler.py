@@ -1,11 +1,17 @@
 """Unit tests for handler."""
 import asyncio
+import logging
 import pytest
 import kvdb.naive_parser
 import kvdb.naive_handler
+import kvdb.naive_storage
 from kvdb.naive_storage import NaiveStorage
-from kvdb.rpc import OK, TIMEOUT_ERROR, INVALID_COMMAND, NEWLINE
-from kvdb.exceptions import InvalidCommandException
+from kvdb.slowlog import SlowLog
+from kvdb.tracking import TrackingTable
+from kvdb.rpc import (OK, TIMEOUT_ERROR, INVALID_COMMAND, KEY_NOT_FOUND,
+                      NEWLINE)
+from kvdb.exceptions import (InvalidCommandException,
+                             WorkerUnavailableException)
 
 
 class MockReadStream():
@@ -15,6 +21,7 @@ class MockReadStream():
 
 class MockStreamWriter():
     """Mocking asyncio.StreamWriter."""
+    transport = None
 
     def write(self, data):
         """Mocking asyncio.StreamWriter.write"""
@@ -82,45 +89,31 @@ async def test_handler_positive(command, key, value, mocker, monkeypatch):
 @pytest.mark.parametrize("commands", [
     [("REUSECONN", None, None),
      ("SET", b'mykey', b'myvalue'),
-     ("GET", b'mykey', b'myvalue'),
-     ("CLOSE", None, None)],
+     ("GET", b'mykey', b'myvalue')],
     [("REUSECONN", None, None),
-     ("DELETE", b'mykey', b'myvalue'),
-     ("CLOSE", None, None)],
+     ("DELETE", b'mykey', b'myvalue')],
     [("REUSECONN", None, None),
      ("REUSECONN", None, None),
-     ("DELETE", b'mykey', b'myvalue'),
-     ("CLOSE", None, None)],
-    [("REUSECONN", None, None),
-     ("CLOSE", None, None)],
+     ("DELETE", b'mykey', b'myvalue')],
+    [("REUSECONN", None, None)],
 ])
-async def test_handler_positive_with_reuseconn(commands,
-                                               mocker,
-                                               monkeypatch):
-    """Positive test cases for handle function."""
+async def test_handler_positive_with_reuseconn(commands, mocker):
+    """Positive test cases for handle function with pipelined commands."""
 
     # pylint: disable=too-many-locals
 
-    command_counter = 0
-
-    async def stub_parse_message(message, end_bytes):
-        # pylint: disable=unused-argument
-        nonlocal command_counter
-        (command, key, value) = commands[command_counter]
-        command_counter = command_counter + 1
-        if command == "SET":
-            return (command, key, value)
-        if command in ("REUSECONN", "CLOSE"):
-            return (command, None)
-
-        return (command, key)
-
-    monkeypatch.setattr(kvdb.naive_handler,
-                        "parse_message", stub_parse_message)
-
-    read_stream = MockReadStream()
-
-    storage_contents = {command[1]: command[2] for command in commands}
+    read_stream = asyncio.StreamReader()
+    for (command, key, value) in commands:
+        if command == "REUSECONN":
+            read_stream.feed_data(b'REUSECONN ')
+        elif command == "SET":
+            read_stream.feed_data(b'SET ' + key + b' ' + value + b'\n')
+        else:
+            read_stream.feed_data(command.encode() + b' ' + key + b'\n')
+    read_stream.feed_eof()
+
+    storage_contents = {command[1]: command[2] for command in commands
+                        if command[1] is not None}
     # No point in mocking the current implementation
     storage = NaiveStorage(storage_contents)
     write_stream = MockStreamWriter()
@@ -135,28 +128,78 @@ async def test_handler_positive_with_reuseconn(commands,
 
     await kvdb.naive_handler.handler(read_stream, write_stream, storage)
 
-    write_calls = []
+    pipelined_responses = []
     get_calls = []
     set_calls = []
     delete_calls = []
-    for (command, key, value) in commands:
+    for (command, key, value) in commands[1:]:
         if command == "GET":
             get_calls.append(mocker.call(key))
-            write_calls.append(mocker.call(value + bytes(NEWLINE, "utf-8")))
+            pipelined_responses.append(value + bytes(NEWLINE, "utf-8"))
+        else:
+            pipelined_responses.append(bytes(OK + NEWLINE, "utf-8"))
         if command == "SET":
             set_calls.append(mocker.call(key, value))
-            write_calls.append(mocker.call(bytes(OK + NEWLINE, "utf-8")))
         if command == "DELETE":
             delete_calls.append(mocker.call(key))
-            write_calls.append(mocker.call(bytes(OK + NEWLINE, "utf-8")))
 
-    write_spy.assert_has_calls(write_calls)
+    write_calls = [mocker.call(bytes(OK + NEWLINE, "utf-8"))]
+    if pipelined_responses:
+        write_calls.append(mocker.call(b''.join(pipelined_responses)))
+    assert write_spy.call_args_list == write_calls
     get_spy.assert_has_calls(get_calls)
     set_spy.assert_has_calls(set_calls)
     delete_spy.assert_has_calls(delete_calls)
-    # Drain once for each command + once when closing connection
-    assert drain_spy.call_count == len(commands)
+    # Drain once for the upgrade, once for the pipelined batch
+    # and once when closing connection
+    assert drain_spy.call_count == len(write_calls) + 1
+    close_spy.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_handler_pipelined_partial_command(mocker):
+    """Test that commands split between reads are only executed
+      when their closing byte arrives."""
+    read_stream = asyncio.StreamReader()
+    read_stream.feed_data(b'REUSECONN SET key value\nGET ke')
+    storage = NaiveStorage()
+    write_stream = MockStreamWriter()
+    write_spy = mocker.spy(write_stream, "write")
+
+    handler_task = asyncio.create_task(
+        kvdb.naive_handler.handler(read_stream, write_stream, storage))
+    await asyncio.sleep(0.01)
+    write_spy.assert_called_with(bytes(OK + NEWLINE, "utf-8"))
+
+    read_stream.feed_data(b'y\nNOT_A_COMMAND\nGET missing\n')
+    read_stream.feed_eof()
+    await handler_task
+    write_spy.assert_called_with(
+        b'value\n' + bytes(INVALID_COMMAND + NEWLINE, "utf-8") +
+        bytes(KEY_NOT_FOUND + NEWLINE, "utf-8"))
+
+
+@pytest.mark.asyncio
+async def test_handler_pipelined_line_too_long(mocker, monkeypatch):
+    """Test that a command longer than the limit closes the connection,
+      once the complete commands before it are answered."""
+    monkeypatch.setattr(kvdb.naive_handler, "MAX_LINE_LENGTH", 16)
+    read_stream = asyncio.StreamReader()
+    read_stream.feed_data(b'REUSECONN SET key value\nSET key ' + b'x' * 32)
+    storage = NaiveStorage()
+    write_stream = MockStreamWriter()
+    write_spy = mocker.spy(write_stream, "write")
+    close_spy = mocker.spy(write_stream, "close")
+
+    await kvdb.naive_handler.handler(read_stream, write_stream, storage)
+
+    assert write_spy.call_args_list == [
+        mocker.call(bytes(OK + NEWLINE, "utf-8")),
+        mocker.call(bytes(OK + NEWLINE, "utf-8")),
+        mocker.call(bytes(INVALID_COMMAND + NEWLINE, "utf-8")),
+    ]
     close_spy.assert_called_once()
+    assert storage.get(b'key') == b'value'
 
 
 @pytest.mark.asyncio
@@ -213,3 +256,118 @@ async def test_message_send_invalid_command(monkeypatch, mocker):
     write_spy.assert_called_with(bytes(INVALID_COMMAND + NEWLINE, 'utf-8'))
     assert drain_spy.call_count == 1
     close_spy.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_handler_streams_scans(mocker, monkeypatch):
+    """Test that scan results are written in chunks, in order
+      with the other pipelined responses."""
+    monkeypatch.setattr(kvdb.naive_handler, "STREAM_CHUNK_SIZE", 2)
+    read_stream = asyncio.StreamReader()
+    read_stream.feed_data(b'REUSECONN GET a\nSCAN user: LIMIT 3\n'
+                          b'RANGE b c\nGET b\n')
+    read_stream.feed_eof()
+    storage = NaiveStorage({b'user:1': b'1', b'user:2': b'2', b'user:3': b'3',
+                            b'user:4': b'4', b'a': b'a', b'b': b'b'},
+                           sorted_index=True)
+    write_stream = MockStreamWriter()
+    write_spy = mocker.spy(write_stream, "write")
+
+    await kvdb.naive_handler.handler(read_stream, write_stream, storage)
+
+    assert write_spy.call_args_list == [
+        mocker.call(bytes(OK + NEWLINE, "utf-8")),
+        mocker.call(b'a\n'),
+        mocker.call(b'user:1\nuser:2\n'),
+        mocker.call(b'user:3\n'),
+        mocker.call(b'\n'),
+        mocker.call(b'b\n'),
+        mocker.call(b'\n'),
+        mocker.call(b'b\n'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_handler_streams_scans_before_later_writes(mocker,
+                                                         monkeypatch):
+    """Test that commands pipelined after a scan are executed once its
+      response is sent, so they don't change the keys it returns."""
+    monkeypatch.setattr(kvdb.naive_handler, "STREAM_CHUNK_SIZE", 2)
+    read_stream = asyncio.StreamReader()
+    read_stream.feed_data(b'REUSECONN SCAN user:\nDELETE user:4\n'
+                          b'SET user:5 x\n')
+    read_stream.feed_eof()
+    storage = NaiveStorage({b'user:1': b'1', b'user:2': b'2', b'user:3': b'3',
+                            b'user:4': b'4'}, sorted_index=True)
+    write_stream = MockStreamWriter()
+    write_spy = mocker.spy(write_stream, "write")
+
+    await kvdb.naive_handler.handler(read_stream, write_stream, storage)
+
+    assert write_spy.call_args_list == [
+        mocker.call(bytes(OK + NEWLINE, "utf-8")),
+        mocker.call(b'user:1\nuser:2\n'),
+        mocker.call(b'user:3\nuser:4\n'),
+        mocker.call(b'\n'),
+        mocker.call(b'100:OK\n100:OK\n'),
+    ]
+
+
+def test_slowlog_commands(monkeypatch):
+    """Test that slow commands are logged, and SLOWLOG reports them."""
+    monkeypatch.setattr(kvdb.naive_handler, "SLOWLOG", SlowLog(threshold=0))
+    storage = NaiveStorage()
+    execute_frame = kvdb.naive_handler.execute_frame
+    assert execute_frame(b'SET ', b'key\nx value', storage) == b'100:OK\n'
+    assert execute_frame(b'SLOWLOG ', b'LEN', storage) == b'1\n'
+    entries = execute_frame(b'SLOWLOG ', b'GET 1', storage).split(b'\n')
+    assert len(entries) == 3 and entries[1:] == [b'', b'']
+    entry_id, _, _, command, value_size, key = entries[0].split(b' ')
+    assert (entry_id, command, value_size, key) == (
+        b'1', b'SLOWLOG', b'0', b'LEN')
+    entries = execute_frame(b'SLOWLOG ', b'GET', storage).split(b'\n')
+    assert entries[-3].endswith(b' SET 5 key\\nx')
+    assert execute_frame(b'SLOWLOG ', b'RESET', storage) == b'100:OK\n'
+    assert execute_frame(b'SLOWLOG ', b'LEN', storage) == b'1\n'
+
+
+def test_tracking_frames(monkeypatch):
+    """Test that GETs are tracked after TRACKING, on reused connections."""
+    table = TrackingTable()
+    monkeypatch.setattr(kvdb.naive_handler, "TRACKING", table)
+    monkeypatch.setattr(kvdb.naive_storage, "TRACKING", table)
+    pushed = []
+    client = table.register(pushed.append)
+    storage = NaiveStorage()
+    session = kvdb.naive_handler.Session(None)
+    execute = kvdb.naive_handler.execute_pipelined_frame
+    assert execute(b'GET ', b'a', storage, session) == \
+        (KEY_NOT_FOUND + NEWLINE).encode()
+    assert execute(b'TRACKING ', b'99', storage, session) == \
+        (INVALID_COMMAND + NEWLINE).encode()
+    assert session.tracking_id is None
+    assert execute(b'TRACKING ', str(client).encode(), storage, session) == \
+        (OK + NEWLINE).encode()
+    execute(b'GET ', b'b', storage, session)
+    execute(b'MGET ', b'c d', storage, session)
+    assert table.keys == {b'b': client}
+    assert not pushed
+    storage.set(b'b', b'value')
+    assert pushed == [b'INVALIDATE b\n']
+
+
+def test_client_errors_not_logged(caplog):
+    """Test that expected errors, like missing keys, are not logged
+      as warnings, unlike faults of the server."""
+    storage = NaiveStorage()
+    execute_frame = kvdb.naive_handler.execute_frame
+    with caplog.at_level(logging.WARNING, logger="kvdb.naive_handler"):
+        assert execute_frame(b'GET ', b'missing', storage) == \
+            (KEY_NOT_FOUND + NEWLINE).encode()
+        assert execute_frame(b'NOPE ', b'key', storage) == \
+            (INVALID_COMMAND + NEWLINE).encode()
+        assert not caplog.records
+        kvdb.naive_handler._log_error(  # pylint: disable=protected-access
+            WorkerUnavailableException())
+        assert [record.levelno for record in caplog.records] == \
+            [logging.WARNING]
@@ -0,0 +1,63 @@
+"""Tests for the Prometheus metrics endpoint."""
+import asyncio
+import pytest
+from kvdb import metrics, server
+from kvdb.naive_storage import NaiveStorage
+from kvdb.stats import Stats
+from .utils import LOCALHOST, next_free_port
+
+
+def test_render():
+    """Test the counters, gauges and histograms of the text format."""
+    stats = Stats()
+    stats.record("GET", 1500)
+    stats.record("GET", 3 * 10 ** 6)
+    stats.record("SCAN_CURSOR", 1000)
+    stats.loop_lag = 0.25
+    lines = metrics.render(stats, NaiveStorage({b'key': b'value'})) \
+        .decode().splitlines()
+    assert 'kvdb_commands_total{command="GET"} 2' in lines
+    assert '# TYPE kvdb_command_duration_seconds histogram' in lines
+    assert 'kvdb_command_duration_seconds_bucket{command="GET",le="1e-06"} 0' \
+        in lines
+    assert 'kvdb_command_duration_seconds_bucket{command="GET",le="2e-06"} 1' \
+        in lines
+    assert 'kvdb_command_duration_seconds_bucket{command="GET",le="0.005"} 2' \
+        in lines
+    assert 'kvdb_command_duration_seconds_bucket{command="GET",le="+Inf"} 2' \
+        in lines
+    assert 'kvdb_command_duration_seconds_count{command="GET"} 2' in lines
+    assert 'kvdb_commands_total{command="SCAN"} 1' in lines
+    assert 'kvdb_command_duration_seconds_count{command="SCAN"} 1' in lines
+    assert 'kvdb_keys 1' in lines
+    assert 'kvdb_event_loop_lag_seconds 0.25' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(monkeypatch):
+    """Test that the endpoint serves the metrics until the server stops."""
+    monkeypatch.setattr(metrics, "LAG_INTERVAL", 0.01)
+    port = next_free_port()
+    metrics_port = next_free_port(port + 1)
+    server_instance = await server.start(LOCALHOST, port,
+                                         metrics_port=metrics_port)
+    response = await _http_get(metrics_port, b"/metrics")
+    assert response.startswith(b"HTTP/1.0 200 OK\r\n")
+    assert b"\r\n\r\n" in response
+    assert b"\nkvdb_keys 0\n" in response
+    assert (await _http_get(metrics_port, b"/other")).startswith(
+        b"HTTP/1.0 404 Not Found\r\n")
+    server_instance.close()
+    await server_instance.wait_closed()
+    await asyncio.sleep(0.05)
+    with pytest.raises(ConnectionRefusedError):
+        await _http_get(metrics_port, b"/metrics")
+
+
+async def _http_get(port, path):
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    writer.write(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return response
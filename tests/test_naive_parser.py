@@ -2,7 +2,7 @@
 import asyncio
 import pytest
 from kvdb.exceptions import InvalidCommandException, InvalidKeyException
-from kvdb.naive_parser import parse_message
+from kvdb.naive_parser import next_frame, parse_frame, parse_message
 from .utils import get_random_bytes
 
 
@@ -66,3 +66,78 @@ async def test_negative_cases(message, ex_type):
     stream.feed_eof()
     with pytest.raises(ex_type):
         await parse_message(stream)
+
+
+@pytest.mark.parametrize("buffer,start,expected", [
+    (b'GET key\n', 0, (b'GET ', b'key', 8)),
+    (b'GET key\nSET key value\n', 8, (b'SET ', b'key value', 22)),
+    (b'REUSECONN GET key\n', 0, (b'REUSECONN ', None, 10)),
+    (b'NOT_A_COMMAND\n', 0, (b'NOT_A_COMMAND', None, 14)),
+    (b'GET key', 0, None),
+    (b'GET', 0, None),
+    (b'GET key\n', 8, None),
+])
+def test_next_frame(buffer, start, expected):
+    """Check splitting pipelined commands."""
+    assert next_frame(bytearray(buffer), start, b'\n') == expected
+
+
+@pytest.mark.parametrize("command,body,expected", [
+    (b'SET ', b'key value with spaces', ("SET", b'key', b'value with spaces')),
+    (b'GET ', b'key', ("GET", b'key')),
+    (b'DELETE ', b'key', ("DELETE", b'key')),
+    (b'REUSECONN ', None, ("REUSECONN", None)),
+    (b'MGET ', b'a b c', ("MGET", [b'a', b'b', b'c'])),
+    (b'MSET ', b'a 1 b 2', ("MSET", {b'a': b'1', b'b': b'2'})),
+    (b'MDELETE ', b'a', ("MDELETE", [b'a'])),
+    (b'SET ', b'key value EX 10', ("SET", b'key', b'value EX 10')),
+    (b'SET ', b'key EX 10', ("SET", b'key', b'EX 10')),
+    (b'SETEX ', b'key 10 value', ("SET", b'key', b'value', 10)),
+    (b'SETEX ', b'key 10 value EX 20', ("SET", b'key', b'value EX 20', 10)),
+    (b'EXPIRE ', b'key 10', ("EXPIRE", b'key', 10)),
+    (b'EXPIREAT ', b'key 1700000000', ("EXPIREAT", b'key', 1700000000.0)),
+    (b'RANGE ', b'a z', ("RANGE", b'a', b'z', None)),
+    (b'RANGE ', b'a z LIMIT 10', ("RANGE", b'a', b'z', 10)),
+    (b'SCAN ', b'user:42:', ("SCAN", b'user:42:', None)),
+    (b'SCAN ', b'user: LIMIT 5', ("SCAN", b'user:', 5)),
+    (b'SCAN ', b'0 COUNT 10', ("SCAN_CURSOR", 0, 10)),
+    (b'SCAN ', b'0', ("SCAN", b'0', None)),
+    (b'INFO', None, ("INFO", None)),
+    (b'SLOWLOG ', b'GET', ("SLOWLOG", "GET", None)),
+    (b'SLOWLOG ', b'GET 10', ("SLOWLOG", "GET", 10)),
+    (b'SLOWLOG ', b'LEN', ("SLOWLOG", "LEN", None)),
+    (b'SLOWLOG ', b'RESET', ("SLOWLOG", "RESET", None)),
+])
+def test_parse_frame(command, body, expected):
+    """Check parsing the arguments of a complete command."""
+    assert parse_frame(command, body) == expected
+
+
+@pytest.mark.parametrize("command,body,ex_type", [
+    (b'MGET ', b'a  b', InvalidKeyException),
+    (b'MSET ', b'a 1 b', InvalidCommandException),
+    (b'MSET ', b' 1', InvalidKeyException),
+    (b'MDELETE ', b'', InvalidKeyException),
+    (b'SETEX ', b'key 0 value', InvalidCommandException),
+    (b'SETEX ', b'key ten value', InvalidCommandException),
+    (b'SETEX ', b'key 10', InvalidCommandException),
+    (b'SETEX ', b' 10 value', InvalidKeyException),
+    (b'EXPIRE ', b'key', InvalidCommandException),
+    (b'EXPIRE ', b'key -1', InvalidCommandException),
+    (b'EXPIRE ', b' 10', InvalidKeyException),
+    (b'EXPIREAT ', b'key soon', InvalidCommandException),
+    (b'EXPIREAT ', b'key inf', InvalidCommandException),
+    (b'RANGE ', b'a', InvalidCommandException),
+    (b'RANGE ', b'a z LIMIT 0', InvalidCommandException),
+    (b'RANGE ', b' z', InvalidKeyException),
+    (b'SCAN ', b'a LIMIT', InvalidCommandException),
+    (b'SCAN ', b'', InvalidKeyException),
+    (b'SCAN ', b'x COUNT 10', InvalidCommandException),
+    (b'SCAN ', b'0 COUNT 0', InvalidCommandException),
+    (b'SLOWLOG ', b'GET ten', InvalidCommandException),
+    (b'SLOWLOG ', b'CLEAR', InvalidCommandException),
+])
+def test_parse_frame_negative(command, body, ex_type):
+    """Check negative cases for parsing command arguments."""
+    with pytest.raises(ex_type):
+        parse_frame(command, body)
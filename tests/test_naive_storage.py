@@ -1,7 +1,10 @@
 """Unit tests for naive storage."""
 
+import time
 import pytest
-from kvdb.exceptions import InvalidKeyException, KeyNotFoundException
+from kvdb import eviction
+from kvdb.exceptions import (IndexDisabledException, InvalidKeyException,
+                             KeyNotFoundException)
 from kvdb.naive_storage import NaiveStorage
 from .utils import get_random_bytes
 
@@ -53,3 +56,117 @@ def test_get(key, init_dict, exception):
             storage.get(key)
     else:
         assert storage.get(key) == init_dict[key]
+
+
+def test_get_many():
+    """Check that missing keys are returned as None."""
+    storage = NaiveStorage({b'a': b'1', b'b': b'2'})
+    assert storage.get_many([b'a', b'missing', b'b']) == [b'1', None, b'2']
+    with pytest.raises(InvalidKeyException):
+        storage.get_many([b'a', b''])
+
+
+def test_set_many():
+    """Check that all values are set."""
+    storage = NaiveStorage()
+    storage.set_many({b'a': b'1', b'b': b'2'})
+    assert storage.dict == {b'a': b'1', b'b': b'2'}
+    with pytest.raises(InvalidKeyException):
+        storage.set_many({b'c': b'3', None: b'4'})
+    assert b'c' not in storage.dict
+
+
+def test_set_many_memory():
+    """Check that overwritten values are accounted like single sets."""
+    storage, expected = NaiveStorage({b'a': b'1'}), NaiveStorage({b'a': b'1'})
+    storage.set_many({b'a': b'a longer value', b'b': b'2'})
+    expected.set(b'a', b'a longer value')
+    expected.set(b'b', b'2')
+    assert storage.used_memory == expected.used_memory
+
+
+def test_delete_many():
+    """Check that missing keys are skipped."""
+    storage = NaiveStorage({b'a': b'1', b'b': b'2'})
+    assert storage.delete_many([b'a', b'missing']) == 1
+    assert storage.dict == {b'b': b'2'}
+
+
+def test_expiry():
+    """Check that expired values are deleted lazily."""
+    storage = NaiveStorage()
+    storage.set(b'expired', b'value', 100)
+    storage.set(b'expiring', b'value', 100)
+    storage.expire_at(b'expired', time.time() - 1)
+    assert b'expired' in storage.dict
+    with pytest.raises(KeyNotFoundException):
+        storage.get(b'expired')
+    assert b'expired' not in storage.dict
+    assert storage.get(b'expiring') == b'value'
+    with pytest.raises(KeyNotFoundException):
+        storage.expire(b'missing', 10)
+
+
+def test_set_clears_expiry():
+    """Check that setting a value without ttl makes it persistent."""
+    storage = NaiveStorage()
+    storage.set(b'key', b'value', 100)
+    storage.set_many({b'other': b'value'})
+    storage.expire(b'other', 100)
+    storage.set(b'key', b'new value')
+    storage.set_many({b'other': b'new value'})
+    assert not storage.expiry.deadlines
+
+
+def test_delete_expired():
+    """Check that expired values are deleted in bounded slices."""
+    storage = NaiveStorage()
+    for i in range(10):
+        storage.set(bytes([i]), b'value', 100)
+        storage.expire_at(bytes([i]), time.time() - 1)
+    storage.set(b'persistent', b'value')
+    assert storage.delete_expired(6)
+    assert len(storage.dict) == 5
+    assert not storage.delete_expired(6)
+    assert storage.dict == {b'persistent': b'value'}
+
+
+def test_range():
+    """Check that ranges follow mutations and skip expired keys."""
+    storage = NaiveStorage({b'b': b'2', b'a': b'1'}, sorted_index=True)
+    storage.set_many({b'd': b'4', b'c': b'3'})
+    storage.delete(b'b')
+    storage.set(b'c', b'expired', 100)
+    storage.expire_at(b'c', time.time() - 1)
+    assert storage.range(b'a', None, 2) == [b'a', b'd']
+    assert b'c' not in storage.dict
+    with pytest.raises(IndexDisabledException):
+        NaiveStorage().range(b'a', None, 10)
+
+
+def test_scan():
+    """Check that a scan returns the live keys once."""
+    storage = NaiveStorage({b'a': b'1', b'b': b'2'}, cursor_table=True)
+    storage.set_many({b'c': b'3', b'd': b'4'})
+    storage.delete(b'b')
+    storage.set(b'expired', b'value', 100)
+    storage.expire_at(b'expired', time.time() - 1)
+    cursor, keys = storage.scan(0, 100)
+    assert cursor == 0
+    assert sorted(keys) == [b'a', b'c', b'd']
+
+
+def test_cursor_table_memory():
+    """Check that the keys kept for cursors are accounted
+    in the used memory, and only kept if the table is enabled."""
+    with pytest.raises(IndexDisabledException):
+        NaiveStorage({b'a': b'1'}).scan(0, 10)
+    storage = NaiveStorage({b'a': b'1'}, cursor_table=True)
+    storage.set(b'b', b'2')
+    assert storage.used_memory == storage.cursor_table.size + sum(
+        eviction.entry_size(key, value) for key, value in storage.dict.items())
+    storage.delete(b'a')
+    storage.set(b'c', b'3')
+    assert sorted(storage.scan(0, 10)[1]) == [b'b', b'c']
+    storage.delete_many([b'b', b'c'])
+    assert storage.used_memory == storage.cursor_table.size
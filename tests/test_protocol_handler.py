@@ -0,0 +1,167 @@
+"""Unit tests for the BufferedProtocol based handler."""
+import pytest
+import kvdb.naive_handler
+import kvdb.protocol_handler
+from kvdb import binary_parser
+from kvdb.naive_storage import NaiveStorage
+from kvdb.protocol_handler import KvdbProtocol
+from kvdb.rpc import OK, NEWLINE, TIMEOUT_ERROR
+
+
+class MockTransport():
+    """Mocking asyncio.Transport."""
+
+    def __init__(self):
+        self.written = b''
+        self.closed = False
+
+    def write(self, data):
+        """Mocking asyncio.Transport.write"""
+        self.written += data
+
+    def close(self):
+        """Mocking asyncio.Transport.close"""
+        self.closed = True
+
+    def pause_reading(self):
+        """Mocking asyncio.Transport.pause_reading"""
+
+    def resume_reading(self):
+        """Mocking asyncio.Transport.resume_reading"""
+
+
+class PausingTransport(MockTransport):
+    """Transport whose write buffer is full after every write."""
+
+    def __init__(self, protocol):
+        super().__init__()
+        self.protocol = protocol
+
+    def write(self, data):
+        super().write(data)
+        self.protocol.pause_writing()
+
+
+def _connect(storage):
+    protocol = KvdbProtocol(storage)
+    transport = MockTransport()
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+def _receive(protocol, data, chunk_size=None):
+    """Feeds data like the transport does, at most chunk_size at once,
+      until the protocol closes the transport."""
+    chunk_size = chunk_size or len(data)
+    while data and not protocol.transport.closed:
+        buffer = protocol.get_buffer(chunk_size)
+        nbytes = min(len(buffer), chunk_size, len(data))
+        buffer[:nbytes] = data[:nbytes]
+        data = data[nbytes:]
+        protocol.buffer_updated(nbytes)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [None, 1, 3])
+async def test_pipelined_commands(chunk_size):
+    """Check that commands are executed regardless of how they are split."""
+    storage = NaiveStorage()
+    protocol, transport = _connect(storage)
+    _receive(protocol,
+             b'REUSECONN SET key value\nGET key\nDELETE key\nGET key\n',
+             chunk_size)
+    assert transport.written == (b'100:OK\n100:OK\nvalue\n100:OK\n' +
+                                 b'403:Key_Not_Found\n')
+    assert not protocol.eof_received()
+    assert storage.dict == {}
+
+
+@pytest.mark.asyncio
+async def test_single_message():
+    """Check that single messages are executed on EOF."""
+    storage = NaiveStorage()
+    protocol, transport = _connect(storage)
+    _receive(protocol, b'SET key value with spaces', 4)
+    assert transport.written == b''
+    protocol.eof_received()
+    assert transport.written == bytes(OK + NEWLINE, "utf-8")
+    assert storage.dict == {b'key': b'value with spaces'}
+
+
+@pytest.mark.asyncio
+async def test_buffer_grows_for_large_values(monkeypatch):
+    """Check that values larger than the initial buffer are received."""
+    monkeypatch.setattr(kvdb.protocol_handler, "INITIAL_BUFFER_SIZE", 16)
+    value = b'v' * 100
+    storage = NaiveStorage()
+    protocol, transport = _connect(storage)
+    _receive(protocol, b'REUSECONN SET key ' + value + b'\nGET key\n', 7)
+    assert transport.written == b'100:OK\n100:OK\n' + value + b'\n'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("data", [b'SET key ', b'REUSECONN SET key '])
+async def test_line_too_long(monkeypatch, data):
+    """Check that a command longer than the limit closes the connection,
+      instead of growing the buffer without a limit."""
+    monkeypatch.setattr(kvdb.protocol_handler, "INITIAL_BUFFER_SIZE", 16)
+    monkeypatch.setattr(kvdb.protocol_handler, "MAX_LINE_LENGTH", 40)
+    protocol, transport = _connect(NaiveStorage())
+    _receive(protocol, data + b'v' * 100, 7)
+    assert transport.written.endswith(b'401:Invalid Command\n')
+    assert transport.closed
+    # pylint: disable-next=protected-access
+    assert len(protocol._buffer) <= 41
+
+
+@pytest.mark.asyncio
+async def test_binary_framing():
+    """Check binary frames split between reads."""
+    storage = NaiveStorage()
+    protocol, transport = _connect(storage)
+    _receive(protocol, b'BINARY ' +
+             binary_parser.encode_request("SET", b'k', b'a b\nc') +
+             binary_parser.encode_request("GET", b'k'), 5)
+    assert transport.written == (b'100:OK\n' +
+                                 binary_parser.encode_response(b'100:OK') +
+                                 binary_parser.encode_response(b'a b\nc'))
+
+
+@pytest.mark.asyncio
+async def test_timeout(monkeypatch):
+    """Check that idle connections are closed."""
+    monkeypatch.setattr(kvdb.protocol_handler, "REQUEST_TIMEOUT", 0)
+    protocol, transport = _connect(NaiveStorage())
+    # pylint: disable-next=protected-access
+    protocol._check_timeout()
+    assert transport.written == bytes(TIMEOUT_ERROR, "utf-8")
+    assert transport.closed
+
+
+@pytest.mark.asyncio
+async def test_streamed_scan_waits_for_resume(monkeypatch):
+    """Check that a scan is sent chunk by chunk as the transport drains,
+      and the commands after it wait for the scan."""
+    monkeypatch.setattr(kvdb.naive_handler, "STREAM_CHUNK_SIZE", 1)
+    storage = NaiveStorage({b'a': b'1', b'b': b'2'}, sorted_index=True)
+    protocol = KvdbProtocol(storage)
+    transport = PausingTransport(protocol)
+    protocol.connection_made(transport)
+    _receive(protocol, b'REUSECONN RANGE a z\nGET a\n')
+    assert transport.written == b'100:OK\na\n'
+    protocol.resume_writing()
+    assert transport.written == b'100:OK\na\nb\n'
+    protocol.resume_writing()
+    protocol.resume_writing()
+    assert transport.written == b'100:OK\na\nb\n\n1\n'
+
+
+@pytest.mark.asyncio
+async def test_streamed_single_message():
+    """Check that a single message scan closes the connection when sent."""
+    storage = NaiveStorage({b'a': b'1'}, sorted_index=True)
+    protocol, transport = _connect(storage)
+    _receive(protocol, b'SCAN a')
+    assert protocol.eof_received()
+    assert transport.written == b'a\n\n'
+    assert transport.closed
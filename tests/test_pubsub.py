@@ -0,0 +1,126 @@
+"""Tests for the publish/subscribe of messages on channels."""
+import asyncio
+import pytest
+from kvdb import pubsub, server
+from kvdb.client import Client
+from kvdb.pubsub import PubSub, Subscriber
+from .utils import LOCALHOST, next_free_port
+
+
+class MockTransport():
+    """Mocking asyncio.Transport, buffering everything written."""
+
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def write(self, data):
+        """Mocking asyncio.Transport.write"""
+        self.written.append(data)
+
+    def is_closing(self):
+        """Mocking asyncio.Transport.is_closing"""
+        return self.aborted
+
+    def get_write_buffer_size(self):
+        """Mocking asyncio.Transport.get_write_buffer_size"""
+        return sum(map(len, self.written))
+
+    def abort(self):
+        """Mocking asyncio.Transport.abort"""
+        self.aborted = True
+
+
+@pytest.mark.asyncio
+async def test_publish():
+    """Test that a message is encoded once for every subscriber,
+      and that unsubscribed connections don't get it."""
+    channels = PubSub()
+    first, second = MockTransport(), MockTransport()
+    subscribers = [Subscriber(first, 1024), Subscriber(second, 1024)]
+    assert channels.subscribe(subscribers[0], [b"news", b"sport"]) == 2
+    assert channels.subscribe(subscribers[1], [b"news"]) == 1
+    assert channels.publish(b"news", b"hello world") == 2
+    assert first.written == [b"MESSAGE news hello world\n"]
+    assert first.written[0] is second.written[0]
+    assert channels.unsubscribe(subscribers[0], [b"news"]) == 1
+    assert channels.publish(b"news", b"again") == 1
+    assert channels.publish(b"other", b"nobody") == 0
+    assert channels.unsubscribe(subscribers[0]) == 0
+    assert channels.unsubscribe(subscribers[1]) == 0
+    assert not channels.channels
+
+
+@pytest.mark.asyncio
+async def test_output_limit():
+    """Test that a subscriber is disconnected instead of buffering more
+      than the output limit."""
+    channels = PubSub()
+    transport = MockTransport()
+    channels.subscribe(Subscriber(transport, 30), [b"news"])
+    channels.publish(b"news", b"first")
+    channels.publish(b"news", b"second")
+    assert transport.aborted
+    channels.publish(b"news", b"third")
+    assert transport.written == [b"MESSAGE news first\n"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_subscribe(server_core):
+    """Test that subscribed connections get the published messages,
+      and only accept SUBSCRIBE and UNSUBSCRIBE."""
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port, server_core)
+    client = Client(LOCALHOST, port)
+    reader, writer = await _subscriber(port)
+    writer.write(b"SUBSCRIBE news sport\n")
+    assert await reader.readline() == b"SUBSCRIBE 2\n"
+    assert await client.publish("news", "hello world") == 1
+    assert await client.publish("weather", "sunny") == 0
+    assert await reader.readline() == b"MESSAGE news hello world\n"
+    writer.write(b"GET key\nUNSUBSCRIBE news\n")
+    assert await reader.readline() == b"401:Invalid Command\n"
+    assert await reader.readline() == b"UNSUBSCRIBE 1\n"
+    assert await client.publish("news", "again") == 0
+    writer.write(b"UNSUBSCRIBE\nGET key\n")
+    assert await reader.readline() == b"UNSUBSCRIBE 0\n"
+    assert await reader.readline() == b"403:Key_Not_Found\n"
+    writer.close()
+    await client.close()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_slow_subscriber(server_core, monkeypatch):
+    """Test that a subscriber not reading its messages is disconnected,
+      and that closed connections are unsubscribed."""
+    monkeypatch.setattr(pubsub.PUBSUB, "output_limit", 256 * 1024)
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port, server_core)
+    client = Client(LOCALHOST, port)
+    reader, writer = await _subscriber(port)
+    writer.write(b"SUBSCRIBE news\n")
+    assert await reader.readline() == b"SUBSCRIBE 1\n"
+    payload = "x" * 64 * 1024
+    for _ in range(1000):
+        if await client.publish("news", payload) == 0:
+            break
+    else:
+        raise AssertionError("slow subscriber not disconnected")
+    assert not pubsub.PUBSUB.channels
+    writer.close()
+    await client.close()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+async def _subscriber(port):
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    writer.write(b"REUSECONN ")
+    assert await reader.readline() == b"100:OK\n"
+    return reader, writer
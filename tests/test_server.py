@@ -1,6 +1,9 @@
 """Tests for server."""
+import asyncio
+import os
+import socket
 import pytest
-from kvdb import server
+from kvdb import server, snapshot
 from .utils import LOCALHOST, next_free_port
 
 
@@ -15,3 +18,103 @@ async def test_start_server():
     server_instance.close()
     await server_instance.wait_closed()
     assert not server_instance.is_serving()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_start_server_socket_options(server_core):
+    """Test that the socket options are set on the listening socket."""
+    socket_options = server.SocketOptions(backlog=16, rcvbuf=64 * 1024,
+                                          sndbuf=64 * 1024)
+    server_instance = await server.start(LOCALHOST, next_free_port(),
+                                         server_core,
+                                         socket_options=socket_options)
+    sock = server_instance.sockets[0]
+    # The kernel may round the buffer sizes up.
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 64 * 1024
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 64 * 1024
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+@pytest.mark.parametrize("nodelay", [True, False])
+async def test_tcp_nodelay(server_core, nodelay):
+    """Test that TCP_NODELAY is set on the accepted connections,
+      or cleared if it is disabled."""
+    port = next_free_port()
+    server_instance = await server.start(
+        LOCALHOST, port, server_core,
+        socket_options=server.SocketOptions(nodelay=nodelay))
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    writer.write(b"REUSECONN ")
+    assert await reader.readline() == b"100:OK\n"
+    with _accepted_socket(writer.get_extra_info("sockname")) as sock:
+        assert bool(sock.getsockopt(socket.IPPROTO_TCP,
+                                    socket.TCP_NODELAY)) == nodelay
+    writer.close()
+    await writer.wait_closed()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+def _accepted_socket(client_address):
+    """Finds the socket accepted by the server of this process,
+      connected to the client address."""
+    for descriptor in os.listdir("/proc/self/fd"):
+        duplicate = os.dup(int(descriptor))
+        try:
+            sock = socket.socket(fileno=duplicate)
+        except OSError:
+            os.close(duplicate)
+            continue
+        try:
+            if sock.family == socket.AF_INET and \
+                    sock.getpeername() == client_address:
+                return sock
+        except OSError:
+            pass
+        sock.close()
+    raise AssertionError("accepted socket not found")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_start_unix_server(tmp_path, server_core):
+    """Test that the server is serving on the unix domain socket."""
+    path = str(tmp_path / "kvdb.sock")
+    server_instance = await server.start_unix(path, server_core)
+    assert server_instance.sockets[0].getsockname() == path
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(b"REUSECONN ")
+    assert await reader.readline() == b"100:OK\n"
+    writer.write(b"SET key value\nGET key\n")
+    assert [await reader.readline() for _ in range(2)] == [b"100:OK\n",
+                                                           b"value\n"]
+    writer.close()
+    await writer.wait_closed()
+    server_instance.close()
+    await server_instance.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_open_storage_prefers_aof(tmp_path):
+    """Test that the append-only file is replayed instead of the snapshot."""
+    snapshot_path = tmp_path / "kvdb.snapshot"
+    aof_path = tmp_path / "kvdb.aof"
+    snapshot.save(snapshot_path, {b'key': b'snapshot'})
+    storage = server.open_storage(snapshot_path=snapshot_path)
+    assert storage.get(b'key') == b'snapshot'
+
+    storage = server.open_storage(aof_path, snapshot_path=snapshot_path)
+    assert storage.get(b'key') == b'snapshot'
+    storage.set(b'other_key', b'aof')
+    await storage.aof.close()
+    snapshot.save(snapshot_path, {b'key': b'outdated'})
+    storage = server.open_storage(aof_path, snapshot_path=snapshot_path)
+    assert storage.dict == {b'key': b'snapshot', b'other_key': b'aof'}
+    await storage.aof.close()
@@ -0,0 +1,98 @@
+"""Unit tests for sharded storage."""
+import threading
+import time
+import pytest
+from kvdb.exceptions import (InvalidKeyException, KeyNotFoundException,
+                             SnapshotsDisabledException)
+from kvdb.sharded_storage import ShardedStorage
+
+
+def test_single_key_commands():
+    """Check that single key commands behave like the naive storage."""
+    storage = ShardedStorage(4, {b'a': b'1'})
+    storage.set(b'b', b'2')
+    assert storage.get(b'a') == b'1'
+    assert storage.get(b'b') == b'2'
+    storage.delete(b'a')
+    with pytest.raises(KeyNotFoundException):
+        storage.get(b'a')
+    with pytest.raises(InvalidKeyException):
+        storage.set(b'', b'value')
+    storage.set(b'expiring', b'value', 100)
+    storage.expire_at(b'expiring', time.time() - 1)
+    with pytest.raises(KeyNotFoundException):
+        storage.get(b'expiring')
+    with pytest.raises(SnapshotsDisabledException):
+        storage.save()
+
+
+def test_shard_keys_spread_by_low_bits():
+    """Check that the keys of a shard don't share the low bits of their
+      hash, that the buckets of the shard are picked by."""
+    storage = ShardedStorage(16)
+    keys = [f"key{i}".encode() for i in range(2000)]
+    storage.set_many({key: b"v" for key in keys})
+    shard_keys = list(storage.shards[0].dict)
+    assert len({hash(key) & 15 for key in shard_keys}) == 16
+
+
+def test_batches():
+    """Check that batches are split between the shards in order."""
+    storage = ShardedStorage(4)
+    items = {b'key%d' % i: b'%d' % i for i in range(20)}
+    storage.set_many(items)
+    assert len(storage) == 20
+    keys = list(items) + [b'missing']
+    assert storage.get_many(keys) == list(items.values()) + [None]
+    assert storage.delete_many(keys[:10] + [b'missing']) == 10
+    with pytest.raises(InvalidKeyException):
+        storage.set_many({b'new': b'value', b'': b'value'})
+    assert storage.get_many([b'new']) == [None]
+
+
+def test_range_and_scan():
+    """Check that scans cover the keys of every shard."""
+    storage = ShardedStorage(4, sorted_index=True,
+                             cursor_table=True)
+    keys = [b'key%02d' % i for i in range(30)]
+    storage.set_many(dict.fromkeys(keys, b'value'))
+    assert storage.range(b'key05', b'key10', 3) == keys[5:8]
+    scanned = []
+    cursor = 0
+    while True:
+        cursor, batch = storage.scan(cursor, 4)
+        scanned += batch
+        if cursor == 0:
+            break
+    assert sorted(scanned) == keys
+
+
+def test_maxmemory_is_split():
+    """Check that the memory limit holds for the whole storage."""
+    storage = ShardedStorage(4, maxmemory=40 * 200)
+    for i in range(1000):
+        storage.set(b'key%d' % i, b'v' * 100)
+    assert storage.used_memory <= 40 * 200
+    assert storage.evicted_keys > 0
+
+
+def test_concurrent_threads():
+    """Check that threads changing the storage at once lose no updates."""
+    storage = ShardedStorage(8)
+    number_of_threads = 8
+    keys_per_thread = 500
+
+    def write(thread):
+        for i in range(keys_per_thread):
+            key = b'%d-%d' % (thread, i)
+            storage.set(key, key)
+            assert storage.get(key) == key
+            storage.set_many({key + b'-batch': key})
+
+    threads = [threading.Thread(target=write, args=(thread,))
+               for thread in range(number_of_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(storage) == 2 * number_of_threads * keys_per_thread
@@ -0,0 +1,34 @@
+"""Tests for the slow log."""
+from kvdb.slowlog import SlowLog
+
+
+def test_add_and_get():
+    """Test that the newest entries are returned first."""
+    slowlog = SlowLog()
+    slowlog.add(("SET", b"key", b"value", None), 20000)
+    slowlog.add(("MSET", {b"a": b"12", b"b": b"345"}), 30000)
+    entries = slowlog.get()
+    assert [entry[0] for entry in entries] == [1, 0]
+    assert entries[0][2:] == (30, "MSET", None, 5)
+    assert entries[1][2:] == (20, "SET", b"key", 5)
+    assert slowlog.get(1) == entries[:1]
+
+
+def test_ring_buffer():
+    """Test that the oldest entries are dropped, and reset drops all."""
+    slowlog = SlowLog(max_length=2)
+    for i in range(3):
+        slowlog.add(("GET", f"key{i}".encode()), 1000)
+    assert [entry[4] for entry in slowlog.get()] == [b"key2", b"key1"]
+    slowlog.configure(0, 1)
+    assert [entry[4] for entry in slowlog.get()] == [b"key2"]
+    slowlog.reset()
+    assert not slowlog.get()
+
+
+def test_threshold():
+    """Test the threshold in microseconds, and disabling the slow log."""
+    slowlog = SlowLog(threshold=10)
+    assert slowlog.threshold_ns == 10000
+    slowlog.configure(-1, 10)
+    assert slowlog.threshold_ns > 10 ** 18
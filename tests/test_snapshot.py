@@ -0,0 +1,73 @@
+"""Unit tests for snapshots."""
+import asyncio
+import time
+import pytest
+from kvdb import snapshot
+from kvdb.exceptions import (CorruptedSnapshotException,
+                             SaveInProgressException,
+                             SnapshotsDisabledException)
+from kvdb.naive_storage import NaiveStorage
+from kvdb.snapshot import Snapshotter, load, save
+from .utils import get_random_bytes
+
+
+@pytest.mark.parametrize("contents", [
+    {},
+    {b'key': b'value'},
+    {b'key with spaces': b'value\nwith newline', b'empty': b''},
+    {get_random_bytes(8): get_random_bytes(64) for _ in range(3000)},
+])
+def test_save_and_load(tmp_path, contents):
+    """Check that loading a snapshot restores the contents."""
+    path = tmp_path / "kvdb.snapshot"
+    save(path, contents)
+    assert load(path) == (contents, {})
+
+
+def test_save_and_load_deadlines(tmp_path):
+    """Check that deadlines are restored, and expired keys are not."""
+    path = tmp_path / "kvdb.snapshot"
+    deadline = time.time() + 100
+    save(path, {b'key': b'value', b'expiring': b'value', b'expired': b'v'},
+         {b'expiring': deadline, b'expired': time.time() - 1})
+    assert load(path) == ({b'key': b'value', b'expiring': b'value'},
+                          {b'expiring': deadline})
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:-1],
+    lambda data: data[:snapshot.HEADER.size],
+    lambda data: b'NOTASNAP' + data[8:],
+    lambda data: data[:8] + b'\x00\x01' + data[10:],
+    lambda data: data[:-5] + bytes([data[-5] ^ 1]) + data[-4:],
+])
+def test_load_corrupted(tmp_path, corrupt):
+    """Check that damaged snapshots are not loaded."""
+    path = tmp_path / "kvdb.snapshot"
+    save(path, {b'key': b'value', b'other': b'value'})
+    path.write_bytes(corrupt(path.read_bytes()))
+    with pytest.raises(CorruptedSnapshotException):
+        load(path)
+
+
+@pytest.mark.asyncio
+async def test_bgsave(tmp_path):
+    """Check that the snapshot holds the contents at the time of BGSAVE."""
+    path = tmp_path / "kvdb.snapshot"
+    storage = NaiveStorage({b'key': b'value'},
+                           snapshotter=Snapshotter(path))
+    storage.bgsave()
+    storage.set(b'after_bgsave', b'value')
+    with pytest.raises(SaveInProgressException):
+        storage.bgsave()
+    # pylint: disable-next=protected-access
+    await storage.snapshotter._bgsave_task
+    assert load(path) == ({b'key': b'value'}, {})
+    assert storage.snapshotter.last_save_time is not None
+    await asyncio.sleep(0)
+
+
+def test_snapshots_disabled():
+    """Check that snapshots need a snapshot file."""
+    with pytest.raises(SnapshotsDisabledException):
+        NaiveStorage().save()
@@ -0,0 +1,44 @@
+"""Unit tests for the sorted index."""
+import random
+import pytest
+import kvdb.sorted_index
+from kvdb.sorted_index import SortedIndex, prefix_end
+
+
+def test_add_and_remove(monkeypatch):
+    """Check that keys stay in order while chunks are split and dropped."""
+    monkeypatch.setattr(kvdb.sorted_index, "CHUNK_SIZE", 4)
+    keys = [b'%05d' % i for i in range(200)]
+    shuffled = random.sample(keys, len(keys))
+    index = SortedIndex(shuffled[:50])
+    for key in shuffled[50:]:
+        index.add(key)
+    assert index.range(b'', None, 1000) == keys
+    for key in shuffled[:150]:
+        index.remove(key)
+    assert index.range(b'', None, 1000) == sorted(shuffled[150:])
+    assert len(index) == 50
+
+
+@pytest.mark.parametrize("start,end,limit,expected", [
+    (b'b', b'd', 10, [b'b', b'ba', b'c']),
+    (b'bb', None, 10, [b'c', b'd']),
+    (b'a', b'z', 2, [b'a', b'b']),
+    (b'e', None, 10, []),
+    (b'c', b'c', 10, []),
+])
+def test_range(start, end, limit, expected, monkeypatch):
+    """Check that ranges include the start and exclude the end."""
+    monkeypatch.setattr(kvdb.sorted_index, "CHUNK_SIZE", 2)
+    index = SortedIndex([b'd', b'a', b'c', b'b', b'ba'])
+    assert index.range(start, end, limit) == expected
+
+
+@pytest.mark.parametrize("prefix,expected", [
+    (b'user:42:', b'user:42;'),
+    (b'a\xff\xff', b'b'),
+    (b'\xff', None),
+])
+def test_prefix_end(prefix, expected):
+    """Check the exclusive end of prefix scans."""
+    assert prefix_end(prefix) == expected
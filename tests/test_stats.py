@@ -0,0 +1,67 @@
+"""Tests for the server metrics."""
+from kvdb.naive_storage import NaiveStorage
+from kvdb.stats import LATENCY_BUCKETS, Stats
+
+
+def test_record_commands():
+    """Test that calls and latency are summed per command."""
+    stats = Stats()
+    stats.record("GET", 3000)
+    stats.record("GET", 5000)
+    stats.record("SET", 1000)
+    assert {command: command_stats[:2]
+            for command, command_stats in stats.commands.items()} == {
+        "GET": [2, 8000], "SET": [1, 1000]}
+
+
+def test_record_latency_buckets():
+    """Test that latencies are counted in the bucket of their upper bound."""
+    stats = Stats()
+    stats.record("GET", 1000)
+    stats.record("GET", 1001)
+    stats.record("GET", 10 ** 11)
+    buckets = stats.commands["GET"][2]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1
+    assert buckets[0] == 1
+    assert buckets[1] == 1
+    assert buckets[-1] == 1
+    assert sum(buckets) == 3
+
+
+def test_by_wire_name():
+    """Test that SCAN with a cursor is reported as SCAN."""
+    stats = Stats()
+    stats.record("SCAN", 1000)
+    stats.record("SCAN_CURSOR", 3000)
+    stats.record("SET", 1000)
+    assert [(command, command_stats[:2])
+            for command, command_stats in stats.by_wire_name()] == [
+        ("SCAN", [2, 4000]), ("SET", [1, 1000])]
+    assert sum(stats.by_wire_name()[0][1][2]) == 2
+
+
+def test_connections():
+    """Test that connected clients are counted until they disconnect."""
+    stats = Stats()
+    stats.connected()
+    stats.connected()
+    stats.disconnected()
+    assert stats.connected_clients == 1
+    assert stats.connections_received == 2
+
+
+def test_info():
+    """Test that the metrics are reported as name:value lines."""
+    stats = Stats()
+    stats.record("GET", 3000)
+    stats.record("GET", 6000)
+    stats.keyspace_hits = 2
+    storage = NaiveStorage({b'key': b'value'})
+    lines = stats.info(storage).decode().splitlines()
+    fields = dict(line.split(":", 1) for line in lines)
+    assert fields["keys"] == "1"
+    assert int(fields["used_memory"]) == storage.used_memory > 0
+    assert int(fields["used_memory_peak_rss"]) > 0
+    assert fields["keyspace_hits"] == "2"
+    assert fields["keyspace_misses"] == "0"
+    assert fields["cmdstat_get"] == "calls=2,usec=9,usec_per_call=4.50"
@@ -0,0 +1,71 @@
+"""Tests for the tracking of the keys read by caching clients."""
+import pytest
+from kvdb import naive_storage
+from kvdb.exceptions import InvalidCommandException
+from kvdb.naive_storage import NaiveStorage
+from kvdb.tracking import TrackingTable
+
+
+def test_track_and_invalidate():
+    """Test that a modified key is pushed once to every client
+      that read it, but not to unregistered clients."""
+    table = TrackingTable()
+    pushed = {1: [], 2: [], 3: []}
+    for client, messages in pushed.items():
+        assert table.register(messages.append) == client
+    table.track(1, b"key")
+    assert table.keys == {b"key": 1}
+    table.track(1, b"key")
+    table.track(2, b"key")
+    table.track(3, b"key")
+    assert table.keys == {b"key": {1, 2, 3}}
+    table.unregister(3)
+    table.invalidate(b"key")
+    table.invalidate(b"key")
+    table.invalidate(b"other")
+    assert pushed == {1: [b"INVALIDATE key\n"], 2: [b"INVALIDATE key\n"],
+                      3: []}
+    assert not table.keys
+
+
+def test_max_keys():
+    """Test that the oldest key is invalidated to make room."""
+    table = TrackingTable(max_keys=2)
+    pushed = []
+    client = table.register(pushed.append)
+    for key in (b"a", b"b", b"c"):
+        table.track(client, key)
+    assert list(table.keys) == [b"b", b"c"]
+    assert pushed == [b"INVALIDATE a\n"]
+
+
+def test_client_id():
+    """Test that only the ids of registered clients are accepted."""
+    table = TrackingTable()
+    client = table.register(print)
+    assert table.client_id(str(client).encode()) == client
+    for raw in (b"", b"x", b"99"):
+        with pytest.raises(InvalidCommandException):
+            table.client_id(raw)
+
+
+def test_storage_invalidates(monkeypatch):
+    """Test that sets, deletes, batches and evictions invalidate
+      the tracked keys."""
+    table = TrackingTable()
+    monkeypatch.setattr(naive_storage, "TRACKING", table)
+    pushed = []
+    client = table.register(pushed.append)
+    storage = NaiveStorage(maxmemory=1000)
+    for key in (b"a", b"b", b"c", b"d"):
+        table.track(client, key)
+    storage.set(b"a", b"1")
+    storage.set_many({b"b": b"2", b"c": b"3"})
+    storage.delete(b"a")
+    storage.delete_many([b"b", b"d"])
+    storage.set(b"big", b"x" * 900)
+    assert pushed == [b"INVALIDATE a\n", b"INVALIDATE b\n",
+                      b"INVALIDATE c\n"]
+    table.track(client, b"c")
+    storage.set(b"other", b"x" * 900)
+    assert pushed[-1] == b"INVALIDATE c\n"
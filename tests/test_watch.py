@@ -0,0 +1,174 @@
+"""Tests for the streams of the modifications of watched prefixes."""
+import asyncio
+import pytest
+from kvdb import naive_storage, server, watch
+from kvdb.client import Client
+from kvdb.exceptions import EventsLostException, InvalidCommandException
+from kvdb.naive_storage import NaiveStorage
+from kvdb.watch import KeyspaceWatch, PrefixTrie
+from .utils import LOCALHOST, next_free_port
+
+
+# pylint: disable-next=too-few-public-methods
+class MockWatcher():
+    """Mocking kvdb.pubsub.Subscriber."""
+
+    def __init__(self):
+        self.prefixes = set()
+        self.delivered = []
+
+    def deliver(self, message):
+        """Mocking kvdb.pubsub.Subscriber.deliver"""
+        self.delivered.append(message)
+
+
+def test_trie():
+    """Test that the watchers of every prefix of a key match,
+      and that removed prefixes leave no nodes."""
+    trie = PrefixTrie()
+    trie.add(b"", "all")
+    trie.add(b"user:", "users")
+    trie.add(b"user:1", "user 1")
+    trie.add(b"user:1", "other user 1")
+    trie.add(b"order:", "orders")
+    assert trie.match(b"user:12") == {"all", "users", "user 1",
+                                      "other user 1"}
+    assert trie.match(b"user:2") == {"all", "users"}
+    assert trie.match(b"use") == {"all"}
+    trie.remove(b"user:1", "user 1")
+    trie.remove(b"user:1", "other user 1")
+    trie.remove(b"order:", "orders")
+    trie.remove(b"missing", "all")
+    assert trie.match(b"user:12") == {"all", "users"}
+    assert list(trie.root.children) == [ord("u")]
+    trie.remove(b"user:", "users")
+    trie.remove(b"", "all")
+    assert not trie.root.children
+    assert not trie.match(b"user:1")
+
+
+def test_notify():
+    """Test that events are numbered, and sent once to the watchers
+      of the matching prefixes."""
+    keyspace = KeyspaceWatch()
+    watcher, other = MockWatcher(), MockWatcher()
+    assert keyspace.watch(watcher, b"a") == (0, [])
+    keyspace.watch(watcher, b"ab")
+    keyspace.watch(other, b"b")
+    keyspace.notify("SET", b"abc", b"a value")
+    keyspace.notify("DELETE", b"b")
+    keyspace.notify("SET", b"c", b"")
+    assert watcher.delivered == [b"EVENT 1 SET abc a value\n"]
+    assert other.delivered == [b"EVENT 2 DELETE b\n"]
+    assert keyspace.unwatch(watcher, [b"a"]) == 1
+    assert keyspace.unwatch(watcher) == 0
+    keyspace.notify("DELETE", b"abc")
+    assert len(watcher.delivered) == 1
+
+
+def test_resume():
+    """Test that the kept events after the sequence number are replayed,
+      and that lost events are reported."""
+    # Every event is 18 bytes long.
+    keyspace = KeyspaceWatch(backlog=40)
+    keyspace.watch(MockWatcher(), b"")
+    for key in (b"a1", b"b1", b"a2", b"a3"):
+        keyspace.notify("DELETE", key)
+    assert keyspace.backlog_size == 36
+    assert keyspace.watch(MockWatcher(), b"a", since=2) == \
+        (4, [b"EVENT 3 DELETE a2\n", b"EVENT 4 DELETE a3\n"])
+    assert keyspace.watch(MockWatcher(), b"a", since=4) == (4, [])
+    with pytest.raises(EventsLostException):
+        keyspace.watch(MockWatcher(), b"a", since=1)
+    with pytest.raises(InvalidCommandException):
+        keyspace.watch(MockWatcher(), b"a", since=5)
+    keyspace.resize(20)
+    assert list(keyspace.events) == [(4, b"a3", b"EVENT 4 DELETE a3\n")]
+    assert keyspace.backlog_size == 18
+
+
+def test_disabled_when_unwatched(monkeypatch):
+    """Test that modifications are not numbered nor kept once nothing was
+      watched for the resume window, and that resuming from before reports
+      lost events."""
+    keyspace = KeyspaceWatch()
+    watcher = MockWatcher()
+    keyspace.watch(watcher, b"a")
+    keyspace.watch(watcher, b"a")
+    keyspace.notify("DELETE", b"a1")
+    assert keyspace.unwatch(watcher) == 0
+    keyspace.notify("DELETE", b"a2")
+    assert keyspace.enabled
+    assert keyspace.watch(watcher, b"a", since=1) == \
+        (2, [b"EVENT 2 DELETE a2\n"])
+    keyspace.unwatch(watcher)
+    monkeypatch.setattr(watch, "RESUME_WINDOW", 0)
+    keyspace.notify("DELETE", b"a3")
+    assert not keyspace.enabled
+    assert not keyspace.events and keyspace.backlog_size == 0
+    with pytest.raises(EventsLostException):
+        keyspace.watch(watcher, b"a", since=2)
+    assert keyspace.watch(watcher, b"a") == (3, [])
+    keyspace.notify("DELETE", b"a4")
+    assert watcher.delivered[-1] == b"EVENT 4 DELETE a4\n"
+
+
+def test_storage_notifies(monkeypatch):
+    """Test that sets, deletes, batches, expiry and evictions are streamed,
+      but only once watching is enabled."""
+    keyspace = KeyspaceWatch()
+    monkeypatch.setattr(naive_storage, "WATCH", keyspace)
+    storage = NaiveStorage(maxmemory=1000)
+    storage.set(b"before", b"1")
+    watcher = MockWatcher()
+    keyspace.watch(watcher, b"")
+    storage.set(b"a", b"1")
+    storage.set_many({b"b": b"2"})
+    storage.delete(b"a")
+    storage.delete_many([b"b", b"missing"])
+    storage.set(b"big", b"x" * 900)
+    assert watcher.delivered == [
+        b"EVENT 1 SET a 1\n", b"EVENT 2 SET b 2\n", b"EVENT 3 DELETE a\n",
+        b"EVENT 4 DELETE b\n", b"EVENT 5 SET big " + b"x" * 900 + b"\n",
+        b"EVENT 6 DELETE before\n"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server_core",
+                         [server.STREAMS_CORE, server.PROTOCOL_CORE])
+async def test_watch(server_core, monkeypatch):
+    """Test that the modifications of the watched keys are streamed,
+      and that a consumer resumes after the last event it read."""
+    monkeypatch.setattr(watch, "WATCH", KeyspaceWatch())
+    monkeypatch.setattr(naive_storage, "WATCH", watch.WATCH)
+    monkeypatch.setattr("kvdb.naive_handler.WATCH", watch.WATCH)
+    port = next_free_port()
+    server_instance = await server.start(LOCALHOST, port, server_core)
+    client = Client(LOCALHOST, port)
+    events = client.watch("user:")
+    first = asyncio.ensure_future(anext(events))
+    while not watch.WATCH.enabled:
+        await asyncio.sleep(0.01)
+    await client.set("user:1", "a value")
+    await client.set("order:1", "skipped")
+    await client.delete("user:1")
+    assert await first == (1, "SET", b"user:1", b"a value")
+    assert await anext(events) == (3, "DELETE", b"user:1", None)
+    await events.aclose()
+    await client.set("user:2", "missed")
+    resumed = client.watch("user:", since=3)
+    assert await anext(resumed) == (4, "SET", b"user:2", b"missed")
+    await resumed.aclose()
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    writer.write(b"REUSECONN GET key\nWATCH user: 0\nGET key\nUNWATCH\n")
+    assert await reader.readline() == b"100:OK\n"
+    assert await reader.readline() == b"403:Key_Not_Found\n"
+    assert await reader.readline() == b"WATCH 4\n"
+    for _ in range(3):
+        assert (await reader.readline()).startswith(b"EVENT ")
+    assert await reader.readline() == b"401:Invalid Command\n"
+    assert await reader.readline() == b"UNWATCH 0\n"
+    writer.close()
+    await client.close()
+    server_instance.close()
+    await server_instance.wait_closed()